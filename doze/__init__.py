@@ -1,6 +1,7 @@
 
 import inspect
 from doze import *
+from pool import *
 
 __all__ = [name for name, ref in locals().items()\
     if not name[0] == '_' and not inspect.ismodule(ref)]
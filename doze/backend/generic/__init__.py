@@ -2,4 +2,9 @@
 from doze.backend.generic.base import *
 from doze.backend.generic.where import *
 from doze.backend.generic.join import *
+from doze.backend.generic.columns import *
+from doze.backend.generic.cache import *
+from doze.backend.generic.fingerprint import *
+from doze.backend.generic.hooks import *
+from doze.backend.generic.scan import *
 from doze.backend.generic.builder import *
@@ -1,6 +1,14 @@
-
+import re
 from doze import *
 
+# Token kinds, as returned by FieldLexer.tokenize()
+TOKEN_TEXT = 0
+TOKEN_QUOTED = 1
+TOKEN_OPEN = 2
+TOKEN_CLOSE = 3
+TOKEN_SEPARATOR = 4
+TOKEN_OPERATOR = 5
+
 class IterableField():
     """
     Iterable Field. This class is intended to be used for iterating over
@@ -109,6 +117,109 @@ class IterableField():
             
             yield make_object()
 
+class FieldLexer(object):
+    """
+    Single pass lexer for field strings. Where IterableField yields a
+    dictionary for every character, FieldLexer scans the string once with a
+    compiled regular expression, and returns a tuple of tokens, one for each
+    run of similar characters:
+    
+        (kind, start, end, depth)
+    
+    kind is one of the TOKEN_* constants, start and end are offsets into the
+    string, and depth is the parenthesis depth. As with IterableField, both
+    the opening and closing parenthesis count as inside the parenthesis.
+    Quoted spans include their quotes, and an unterminated quote runs to the
+    end of the string.
+    
+    Basic Usage:
+        lexer = FieldLexer.get('\'`', '.,')
+        for kind, start, end, depth in lexer.tokenize('a.b'):
+            if kind == TOKEN_SEPARATOR:
+                do_something()
+    """
+    
+    # Operator characters, used for detecting SQL expressions
+    operators = '=<>'
+    
+    # Compiled lexers, keyed by (quotes, separators)
+    lexers = {}
+    
+    def __init__(self, quotes='\'`', separators='.,'):
+        self.quotes = quotes
+        self.separators = separators
+        
+        special = re.escape(quotes + separators + self.operators + '()')
+        quoted = []
+        for q in quotes:
+            q = re.escape(q)
+            quoted.append('%s[^%s]*(?:%s|\\Z)' % (q, q, q))
+        
+        # Group numbers map directly to the TOKEN_* constants, plus one.
+        # Every character matches exactly one group, so tokens are contiguous.
+        pattern = [
+            '([^%s]+)' % (special),
+            '(%s)' % ('|'.join(quoted) or '(?!)'),
+            '(\\()',
+            '(\\))',
+            '([%s])' % (re.escape(separators)) if separators else '((?!))',
+            '([%s]+)' % (re.escape(self.operators))]
+        
+        self.regex = re.compile('|'.join(pattern))
+    
+    @staticmethod
+    def get(quotes='\'`', separators='.,'):
+        """ Get a shared, compiled lexer for quotes and separators. """
+        key = (quotes, separators)
+        lexer = FieldLexer.lexers.get(key)
+        if lexer is None:
+            lexer = FieldLexer(quotes, separators)
+            FieldLexer.lexers[key] = lexer
+        return lexer
+    
+    def tokenize(self, string):
+        """ Tokenize string, and return tuple of (kind, start, end, depth) """
+        
+        tokens = []
+        append = tokens.append
+        depth = 0
+        
+        for match in self.regex.finditer(string):
+            kind = match.lastindex - 1
+            start, end = match.span()
+            if kind == TOKEN_OPEN:
+                depth += 1
+                append((kind, start, end, depth))
+            elif kind == TOKEN_CLOSE:
+                append((kind, start, end, depth))
+                depth -= 1
+            else:
+                append((kind, start, end, depth))
+        
+        return tuple(tokens)
+
+class FieldClassification(object):
+    """
+    Classification record for a single field string, as returned by
+    BaseClause.classifyField(). Each attribute starts out as None, and is
+    filled in the first time the matching BaseClause predicate runs, so a
+    record only costs what has actually been asked of it.
+    """
+    
+    __slots__ = [
+        'tokens',           # FieldLexer tokens
+        'aliased',          # fieldIsAliased()
+        'function',         # isSqlFunction()
+        'value',            # isValue()
+        'expression',       # isSqlExpression()
+        'needsAlias',       # fieldNeedsAlias()
+        'needsQuoted',      # fieldNeedsQuoted()
+        'quoted']           # quoteField()
+    
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
 class BaseClause(object):
     """
     This is the Base class, which is extended by various other classes such as
@@ -140,6 +251,23 @@ class BaseClause(object):
     
     # Assignment / Comparison operators.
     assignments = []
+    
+    # Maximum number of parameters per statement, supported by the driver.
+    # None means there is no limit.
+    maxParameters = None
+    
+    # Maximum estimated size of a multi-row INSERT statement in bytes, for
+    # drivers which interpolate values into the statement client-side.
+    # None means there is no limit.
+    maxStatementBytes = None
+    
+    # Maximum number of FieldClassification records cached per dialect.
+    # Set to 0 to keep only the most recently classified field, so the
+    # predicates still share its record.
+    classificationCacheSize = 1024
+    
+    # Classification caches, keyed by dialect attributes
+    classificationCaches = {}
 
     def __init__(self):
         self.childObjects = []
@@ -213,6 +341,60 @@ class BaseClause(object):
         
         return aliased
     
+    def classificationCache(self):
+        """
+        Get the LRUCache of FieldClassification records for this dialect.
+        Clauses which share the same quoting, separator, literal and boolean
+        attributes (eg, pgsql.Where, pgsql.Join and pgsql.Builder) share the
+        same cache. The key is read from the instance, so overriding one of
+        the attributes on a single clause gets it a separate cache.
+        """
+        key = (
+            self.fieldQuote,
+            self.fieldSeparator,
+            self.valueQuote,
+            self.searchQuotes,
+            self.escapeLiterals,
+            tuple(self.booleanTypes),
+            self.classificationCacheSize)
+        
+        caches = BaseClause.classificationCaches
+        cache = caches.get(key)
+        if cache is None:
+            cache = LRUCache(max(self.classificationCacheSize, 1))
+            cache = caches.setdefault(key, cache)
+        
+        return cache
+    
+    def classifyField(self, field):
+        """
+        Get FieldClassification record for field. Records are stored in a
+        bounded LRU cache per dialect, so the predicates below only do their
+        work once for each distinct field string. Fields which aren't strings
+        get a fresh record, which isn't cached.
+        """
+        if not isinstance(field, basestring):
+            return FieldClassification()
+        
+        cache = self.classificationCache()
+        record = cache.get(field)
+        if record is None:
+            record = FieldClassification()
+            cache.set(field, record)
+        return record
+    
+    def tokenizeField(self, field):
+        """
+        Tokenize field with FieldLexer, using self.searchQuotes for quotes.
+        The tokens are stored on the field's FieldClassification record, and
+        shared by fieldIsAliased(), isSqlFunction() and isSqlExpression().
+        """
+        record = self.classifyField(field)
+        if record.tokens is None:
+            record.tokens = FieldLexer.get(self.searchQuotes,
+                self.fieldSeparator + ',').tokenize(field)
+        return record.tokens
+    
     def fieldIsAliased(self, field):
         """
         Check if field is aliased.
@@ -222,23 +404,24 @@ class BaseClause(object):
         outside of both field quotes and value quotes.
         """
         
-        # Preliminary check
-        if self.fieldSeparator not in field:
-            return False
-        
-        # More detailed check
-        inFieldQuote = False
-        inValueQuote = False
-        fieldLen = len(field)
-        
-        it = IterableField(field, self.searchQuotes)
-        for i in it.iterate():
-            if (not i['inside_quote']
-                and i['string'] == self.fieldSeparator
-                and i['last'] == False):
-                return True
+        record = self.classifyField(field)
+        if record.aliased is not None:
+            return record.aliased
         
-        return False
+        # Preliminary check
+        aliased = False
+        if self.fieldSeparator in field:
+            # More detailed check
+            last = len(field) - 1
+            for kind, start, end, depth in self.tokenizeField(field):
+                if (kind == TOKEN_SEPARATOR
+                    and start < last
+                    and field[start] == self.fieldSeparator):
+                    aliased = True
+                    break
+        
+        record.aliased = aliased
+        return aliased
     
     def isSqlFunction(self, param):
         """
@@ -258,6 +441,14 @@ class BaseClause(object):
                This behavior needs to be fixed.
         """
     
+        record = self.classifyField(param)
+        if record.function is None:
+            record.function = self.checkSqlFunction(param)
+        return record.function
+    
+    def checkSqlFunction(self, param):
+        """ Uncached implementation of isSqlFunction(). """
+    
         # Constants, which are usually aliases for functions in most RDBMS
         nonParenthesised = [
             'CURRENT_TIME',
@@ -276,12 +467,17 @@ class BaseClause(object):
             return False
     
         hasParen = False
-        it = IterableField(param, self.searchQuotes, parenthesis=True)
-        for i in it.iterate():
-            if i['parenthesis_depth'] > 0:
+        closed = True
+        for kind, start, end, depth in self.tokenizeField(param):
+            if depth > 0:
                 hasParen = True
+            
+            if kind == TOKEN_OPEN:
+                closed = False
+            elif kind == TOKEN_CLOSE and depth == 1:
+                closed = True
     
-        return hasParen and i['parenthesis_closed']
+        return hasParen and closed
     
     def isSelectQuery(self, param):
         """
@@ -308,17 +504,21 @@ class BaseClause(object):
         all cases.
         """
         
-        basicAssignments = '=<>'
+        record = self.classifyField(param)
+        if record.expression is not None:
+            return record.expression
+        
+        expression = False
         if param[0:4].lower() == 'case':
-            return True
+            expression = True
+        else:
+            for kind, start, end, depth in self.tokenizeField(param):
+                if kind == TOKEN_OPERATOR:
+                    expression = True
+                    break
         
-        it = IterableField(param, self.searchQuotes)
-        for i in it.iterate():
-            if (not i['inside_quote']
-                and i['string'] in basicAssignments):
-                return True
-            
-        return False
+        record.expression = expression
+        return expression
     
     def isQuotedValue(self, param):
         """ Return true if param is a quoted value. """
@@ -328,6 +528,14 @@ class BaseClause(object):
     def isValue(self, param):
         """ Return true if param is a value, quoted or otherwise. """
         
+        record = self.classifyField(param)
+        if record.value is None:
+            record.value = self.checkValue(param)
+        return record.value
+    
+    def checkValue(self, param):
+        """ Uncached implementation of isValue(). """
+        
         # Strip space from param
         param = param.strip()
         
@@ -352,6 +560,22 @@ class BaseClause(object):
         
         return False
     
+    def fieldNeedsAlias(self, field):
+        """
+        Return true if field is a plain field, which should be aliased with
+        a table. That is, when it isn't already aliased, and it isn't an SQL
+        function, value or expression.
+        """
+        
+        record = self.classifyField(field)
+        if record.needsAlias is None:
+            record.needsAlias = not (
+                self.fieldIsAliased(field)
+                or self.isSqlFunction(field)
+                or self.isValue(field)
+                or self.isSqlExpression(field))
+        return record.needsAlias
+    
     def isQuotedField(self, param):
         """ Return true if param is a valid quoted field. """
         param = param.strip()
@@ -375,29 +599,35 @@ class BaseClause(object):
     def fieldNeedsQuoted(self, field):
         """ Check if table or field needs to be quoted. """
         
-        if self.isQuotedField(field):
-            return False
+        record = self.classifyField(field)
+        if record.needsQuoted is not None:
+            return record.needsQuoted
         
-        # Search for literals which need to be quoted
-        for literal in self.escapeLiterals:
-            if literal in field:
-                return True
+        needsQuoted = False
+        if not self.isQuotedField(field):
+            # Search for literals which need to be quoted
+            for literal in self.escapeLiterals:
+                if literal in field:
+                    needsQuoted = True
+                    break
         
-        return False
+        record.needsQuoted = needsQuoted
+        return needsQuoted
     
     def quoteField(self, field):
         """ Escape and quote a field or table. """
+        
+        record = self.classifyField(field)
+        if record.quoted is not None:
+            return record.quoted
     
         if self.fieldQuote in field:
-            escaped = ''
-            for i in range(0, len(field)):
-                if field[i] == self.fieldQuote:
-                    escaped += self.fieldQuote
-                escaped += field[i]
+            escaped = field.replace(self.fieldQuote, self.fieldQuote * 2)
         else:
             escaped = field
         
-        return self.fieldQuote + escaped + self.fieldQuote
+        record.quoted = self.fieldQuote + escaped + self.fieldQuote
+        return record.quoted
     
     def splitFields(self, string):
         """
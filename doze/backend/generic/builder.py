@@ -1,23 +1,133 @@
 
+import itertools
+import collections
 from doze import *
 from doze.backend.generic.base import *
 from doze.backend.generic.where import *
 from doze.backend.generic.join import *
+from doze.backend.generic.columns import *
+from doze.backend.generic.cache import *
+from doze.backend.generic.hooks import *
+from doze.backend.generic.scan import *
+
+# Generated namedtuple classes, keyed by labels
+rowClasses = LRUCache(256)
+
+def rowClass(labels):
+    """
+    Get namedtuple class, with a field for each label. Labels which aren't
+    valid identifiers are renamed by position.
+    """
+    key = tuple(labels)
+    
+    res = rowClasses.get(key)
+    if res is None:
+        res = collections.namedtuple('Row', labels, rename=True)
+        rowClasses.set(key, res)
+    return res
+
+class Record(object):
+    """
+    **
+    * Base class for slotted row records. When Record, or a subclass of it,
+    * is passed as fetch to Builder.asObject(), a subclass with a slot for
+    * each column is generated once per result, from cursor.description.
+    * Columns can then be accessed as attributes, or by index.
+    *
+    * Examples:
+    *
+    *   for row in builder.select('id, name').from_('users').asObject(fetch=Record):
+    *       print row.id, row[1]
+    **
+    """
+    
+    __slots__ = ()
+    
+    # Generated record classes, keyed by (base class, labels)
+    recordClasses = LRUCache(256)
+    
+    def __getitem__(self, index):
+        return getattr(self, self.__slots__[index])
+    
+    def __len__(self):
+        return len(self.__slots__)
+    
+    def __iter__(self):
+        for name in self.__slots__:
+            yield getattr(self, name)
+    
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            ['%s=%s' % (name, repr(getattr(self, name))) for name in self.__slots__]))
+    
+    @classmethod
+    def forLabels(cls, labels):
+        """
+        Get subclass of cls, with a slot for each label. Labels which aren't
+        valid identifiers are renamed by position, as with namedtuple.
+        """
+        key = (cls, tuple(labels))
+        
+        record = Record.recordClasses.get(key)
+        if record is None:
+            fields = rowClass(labels)._fields
+            
+            # __init__ is generated, so records are built without a loop.
+            # Fields never start with an underscore, so _self can't clash.
+            src = 'def __init__(%s):\n' % (', '.join(('_self',) + fields))
+            src += ''.join(['    _self.%s = %s\n' % (i, i) for i in fields])
+            if len(fields) == 0:
+                src += '    pass\n'
+            
+            namespace = {}
+            exec(src, namespace)
+            
+            record = type(cls.__name__, (cls,), {
+                '__slots__': fields,
+                '__init__': namespace['__init__']})
+            Record.recordClasses.set(key, record)
+        
+        return record
 
 class QueryResult(object):
     """
     Query Result Object. This is a wraps around the cursor object, and provides
     an OO interface for accessing rows sequentially.
+    
+    When arraysize is given, rows are fetched with cursor.fetchmany(arraysize),
+    and returned from a local buffer, instead of calling cursor.fetchone() for
+    every row. For server-side cursors, this saves a round trip per row.
+    
+    The shape of each row is set by fetch:
+        dict                    - Dictionaries, keyed by column label
+        collections.namedtuple  - namedtuple, generated from the labels
+        Record, or subclass     - Slotted Record, generated from the labels
+        anything else           - Rows as returned by the driver (tuples)
+    
+    The row factory is chosen once, in initCursorDescr().
+    
+    columnTypes maps cursor.description type codes to array.array typecodes,
+    for asColumns(). Backends override it for their drivers' type codes.
+    
+    When trace is set to a QueryTrace, each batch fetched from the cursor is
+    timed, and fires the fetchBatch hooks.
     """
+    
+    columnTypes = {}
+    columnArraysize = 2000
 
-    def __init__(self, cursor = None, destroy = True, fetch = dict):
+    def __init__(self, cursor = None, destroy = True, fetch = dict, arraysize = None):
         self.setCursor(cursor, destroy)
         self.fetch = fetch
         self.rownumber = -1
+        self.arraysize = arraysize
+        self.buffer = []
+        self.bufferIndex = 0
+        self.onClose = None
+        self.trace = None
     
     def __del__(self):
-        if not self.cursor.closed:
-            self.cursor.close()
+        self.close()
     
     def __len__(self):
         if self.cursor is None:
@@ -25,61 +135,283 @@ class QueryResult(object):
         return self.cursor.rowcount
     
     def __iter__(self):
-        res = self.cursor.fetchone()
+        while True:
+            rows = self.fetchRows()
+            if len(rows) == 0:
+                break
+            
+            if self.cursorDescrInit == False:
+                self.initCursorDescr()
+            
+            factory = self.rowFactory
+            if factory is None:
+                for res in rows:
+                    yield res
+            else:
+                for res in rows:
+                    yield factory(res)
+        
+        if self.destroy == True:
+            self.close()
+    
+    def next(self):
+        res = self.nextRow()
         if res is None:
-            raise StopIteration()
+            return None
         
         if self.cursorDescrInit == False:
             self.initCursorDescr()
+        
+        # Rows left in the buffer have been fetched from the cursor, but
+        # not yet returned
+        self.rownumber = self.cursor.rownumber - (len(self.buffer) - self.bufferIndex)
+        return self.convertRow(res)
     
-        while not res == None:
-            if self.fetch.__name__ == 'dict':
-                yield dict(zip(self.labels, res))
-            else:
-                yield res
-            res = self.cursor.fetchone()
+    def fetchRows(self):
+        """
+        Fetch the next batch of rows, either from the buffer, or from the
+        cursor. Returns an empty list when there are no rows left.
+        """
+        if self.bufferIndex < len(self.buffer):
+            rows = self.buffer[self.bufferIndex:]
+            self.buffer = []
+            self.bufferIndex = 0
+            return rows
         
-        if self.destroy == True:
-            if not self.cursor.closed:
-                self.cursor.close()
+        if self.trace is not None:
+            return self.trace.fetch(self.fetchFromCursor)
+        return self.fetchFromCursor()
     
-    def next(self):
+    def fetchFromCursor(self):
+        """ Fetch the next batch of rows from the cursor """
+        if self.arraysize:
+            return self.cursor.fetchmany(self.arraysize)
+        
         res = self.cursor.fetchone()
         if res is None:
-            return None
+            return []
+        return [res]
+    
+    def nextRow(self):
+        """ Get next raw row from the buffer, refilling it as needed. """
+        if self.bufferIndex >= len(self.buffer):
+            self.buffer = self.fetchRows()
+            self.bufferIndex = 0
+            if len(self.buffer) == 0:
+                return None
+        
+        res = self.buffer[self.bufferIndex]
+        self.bufferIndex += 1
+        return res
+    
+    def asColumns(self, arraysize = None):
+        """
+        Fetch all remaining rows into a ColumnSet, in chunks of arraysize
+        rows, skipping the per-row conversion. Typecodes for the columns are
+        looked up in columnTypes, by cursor.description type code.
+        """
+        if arraysize is not None:
+            self.arraysize = arraysize
+        elif not self.arraysize:
+            self.arraysize = self.columnArraysize
         
         if self.cursorDescrInit == False:
             self.initCursorDescr()
-
-        self.rownumber = self.cursor.rownumber
-        if self.fetch.__name__ == 'dict':
-            return dict(zip(self.labels, res))
-        return res
+        
+        types = [self.columnTypes.get(d[1]) for d in self.cursor.description]
+        columns = ColumnSet(self.labels, types)
+        
+        while True:
+            rows = self.fetchRows()
+            if len(rows) == 0:
+                break
+            columns.append(rows)
+        
+        if self.destroy == True:
+            self.close()
+        
+        return columns
+    
+    def convertRow(self, res):
+        """ Convert raw row, as per self.fetch """
+        if self.rowFactory is None:
+            return res
+        return self.rowFactory(res)
     
     def initCursorDescr(self):
         for i in self.cursor.description:
             self.labels.append(i[0])
         
+        self.rowFactory = self.makeRowFactory()
         self.cursorDescrInit = True
     
+    def makeRowFactory(self):
+        """
+        Returns callable, which converts a raw row as per self.fetch, or None
+        when rows should be returned as is.
+        """
+        fetch = self.fetch
+        labels = self.labels
+        
+        if fetch is dict:
+            return lambda res: dict(zip(labels, res))
+        elif fetch is collections.namedtuple:
+            return rowClass(labels)._make
+        elif isinstance(fetch, type) and issubclass(fetch, Record):
+            record = fetch.forLabels(labels)
+            return lambda res: record(*res)
+        
+        return None
+    
     def setCursor(self, cursor = None, destroy = True):
         self.cursor = cursor
         self.destroy = destroy
         self.labels = []
+        self.rowFactory = None
         self.cursorDescrInit = False
     
+    def close(self):
+        """
+        Close cursor, and call self.onClose once, such as to check a pooled
+        connection back in.
+        """
+        self.closeCursor()
+        if self.onClose is not None:
+            onClose, self.onClose = self.onClose, None
+            onClose()
+    
+    def closeCursor(self):
+        """ Close cursor, if it's still open """
+        if self.cursor is not None and not getattr(self.cursor, 'closed', False):
+            self.cursor.close()
+    
     def isReady(self):
         return True
 
+class CachedQueryResult(QueryResult):
+    """
+    Query result served from a ResultCache, wrapping a CachedCursor. See
+    Builder.setResultCache().
+    """
+    
+    def isReady(self):
+        return True
+
+class PartitionedQueryResult(QueryResult):
+    """
+    Query result merged from the partitions of a parallel scan, wrapping a
+    PartitionCursor. See Builder.asPartitioned().
+    """
+    
+    def isReady(self):
+        return True
+
+class QueryTemplate(object):
+    """
+    **
+    * Immutable, compiled query. Holds the final SQL text and escape list,
+    * along with the slots in the escape list which hold a doze.Param. Binding
+    * values only builds a new escape list, so the SQL is never rebuilt.
+    * The statement's kind, destination table and the tables it reads are
+    * kept too, so result caching works the same as for the builder.
+    *
+    * Examples:
+    *
+    *   template = builder.select('*').from_('users')\
+    *       .where(Where('id').equals(Param('id'))).compile()
+    *
+    *   query, escape = template.sql(id=10)
+    *   res = builder.fromTemplate(template, id=10).asObject()
+    **
+    """
+    
+    __slots__ = ['query', 'escape', 'slots', 'params', 'kind', 'destination',
+        'tables']
+    
+    def __init__(self, query, escape, kind = None, destination = None,
+                 tables = ()):
+        slots = []
+        params = []
+        
+        for i in range(0, len(escape)):
+            if isinstance(escape[i], Param):
+                name = escape[i].name
+                slots.append((i, name))
+                if name not in params:
+                    params.append(name)
+        
+        object.__setattr__(self, 'query', query)
+        object.__setattr__(self, 'escape', tuple(escape))
+        object.__setattr__(self, 'slots', tuple(slots))
+        object.__setattr__(self, 'params', tuple(params))
+        object.__setattr__(self, 'kind', kind)
+        object.__setattr__(self, 'destination', destination)
+        object.__setattr__(self, 'tables', tuple(tables))
+    
+    def __setattr__(self, name, value):
+        raise AttributeError('QueryTemplate is immutable')
+    
+    def bind(self, *args, **kwargs):
+        """
+        Bind values to params, and return a new escape list. Positional
+        arguments are bound in the order of self.params, keyword arguments
+        are bound by name.
+        """
+        if len(args) > len(self.params):
+            raise DozeError('Too many values given for template. Expected at'
+                + ' most ' + str(len(self.params)) + ', got ' + str(len(args)))
+        
+        values = dict(zip(self.params, args))
+        values.update(kwargs)
+        
+        escape = list(self.escape)
+        for index, name in self.slots:
+            if name not in values:
+                raise DozeError('No value given for parameter "%s"' % (name))
+            escape[index] = values[name]
+        
+        return escape
+    
+    def sql(self, *args, **kwargs):
+        """ Bind values, and return (query, escape) """
+        return (self.query, self.bind(*args, **kwargs))
+
 class Builder(BaseClause):
     """ Builder Class. """
     
+    # Default maximum number of rows per multi-row INSERT statement. The
+    # actual number may be lower, to stay within self.maxParameters and
+    # self.maxStatementBytes.
+    insertBatchSize = 1000
+    
+    # Default number of rows fetched per round trip, for server-side cursors
+    serverArraysize = 2000
+    
+    # Class used by asObject() to wrap cursors
+    queryResultClass = QueryResult
+    
+    # Class used to build conditions, such as by paginate()
+    whereClass = Where
+    
+    # ResultCache used by asObject(), and its TTL, see setResultCache()
+    resultCache = None
+    resultCacheTtl = None
+    
+    # QueryHooks fired while running queries, see setHooks()
+    hooks = None
+    
+    # QueryTrace of the last query run, when hooks are set
+    trace = None
+    
     def __init__(self, db = None, onError = None):
         super(Builder, self).__init__()
         self.tableContext = TableContext()
-        self.db = db
+        self.setConnection(db)
         self.onError = onError
         self.kind = None
+        
+        # Tables written since the last commit, see invalidateCommitted()
+        self.uncommittedTables = set()
     
     def reset(self):
         """
@@ -120,6 +452,13 @@ class Builder(BaseClause):
         # Insert / Update
         self.values_ = []
         self.destination = None
+        self.batch_ = None
+        self.many_ = False
+        
+        # Template
+        self.template_ = None
+        self.templateArgs = ()
+        self.templateKwargs = {}
     
     def select(self, columns):
         if self.kind == 'with' and self.withNotComplete:
@@ -199,16 +538,15 @@ class Builder(BaseClause):
                 #   - Field is already aliased
                 #   - Field is an SQL function
                 #   - Field is a quoted value
+                #   - Field is an SQL expression
                 #
                 # Otherwise, alias it with the origin table and append it.
+                # See BaseClause.fieldNeedsAlias().
                 
-                if (self.fieldIsAliased(i)
-                or self.isSqlFunction(i)
-                or self.isValue(i)
-                or self.isSqlExpression(i)):
-                    cols.append(i)
-                else:
+                if self.fieldNeedsAlias(i):
                     cols.append(self.fieldSeparator.join([origin, i]))
+                else:
+                    cols.append(i)
             
             columns = cols
         return columns
@@ -369,33 +707,172 @@ class Builder(BaseClause):
         self.destination = table
         return self
     
-    def values(self, values):
+    def values(self, values, batch = None, many = False):
+        """
+        **
+        * Set values for INSERT / UPDATE. For INSERT, values may also be an
+        * iterable of dictionaries, one per row, which is consumed lazily by
+        * execute(). Rows are then inserted with multi-row INSERT statements,
+        * of at most batch rows each, or with cursor.executemany() when many
+        * is True.
+        *
+        * @param    values  dict, or iterable of dicts
+        * @param    batch   int, maximum rows per INSERT statement. Defaults
+        *                   to self.insertBatchSize. The driver's parameter
+        *                   limit (self.maxParameters), and statement size
+        *                   limit (self.maxStatementBytes), are always
+        *                   respected.
+        * @param    many    bool, use cursor.executemany() instead of
+        *                   multi-row INSERT statements
+        * @return   reference to self
+        **
+        """
         self.values_ = values
+        self.batch_ = batch
+        self.many_ = many
         return self
     
-    def SqlForInsert(self):
-        """ From INSERT. Returns single SQL statement. """
+    def insertIsBatched(self):
+        """ Returns True when INSERT values are an iterable of rows. """
+        return self.kind == 'insert' and not isinstance(self.values_, dict)
+    
+    def insertRowsPerBatch(self, columns):
+        """ Get number of rows per INSERT statement, for number of columns. """
+        
+        rows = self.batch_
+        if rows is None:
+            rows = self.insertBatchSize
+        
+        if self.maxParameters is not None and columns > 0:
+            rows = min(rows, self.maxParameters // columns)
+        
+        return max(rows, 1)
+    
+    def SqlForInsertRows(self, keys, rows):
+        """
+        Build a single INSERT statement for rows, using keys for column
+        names and order. Returns (query, escape).
+        """
         
         if self.fieldNeedsQuoted(self.destination):
             self.destination = self.quoteField(self.destination)
         
-        values = self.values_
         query = ['INSERT INTO', self.destination]
+        query.append('(' + ', '.join(keys) + ')')
+        query.append('VALUES')
         
-        keys = []
+        placeholders = '(' + ', '.join([self.escapePattern] * len(keys)) + ')'
         vals = []
         escape = []
-        for k, v in values.items():
-            keys.append(k)
-            vals.append(self.escapePattern)
-            escape.append(v)
         
-        query.append('(' + ', '.join(keys) + ')')
-        query.append('VALUES')
-        query.append('(' + ', '.join(vals) + ')')
+        for row in rows:
+            if len(row) != len(keys):
+                raise DozeError('Columns for row do not match first row: '
+                    + ', '.join(row.keys()))
+            try:
+                for k in keys:
+                    escape.append(row[k])
+            except KeyError:
+                raise DozeError('Columns for row do not match first row: '
+                    + ', '.join(row.keys()))
+            vals.append(placeholders)
         
+        query.append(', '.join(vals))
         return (' '.join(query), escape)
     
+    def SqlForInsert(self):
+        """
+        From INSERT. Returns single SQL statement. If values is an iterable
+        of rows, all rows are included in the statement. Use insertBatches(),
+        or execute(), to split rows into batches.
+        """
+        
+        values = self.values_
+        if isinstance(values, dict):
+            return self.SqlForInsertRows(values.keys(), [values])
+        
+        rows = list(values)
+        if len(rows) == 0:
+            raise DozeError('No rows given for INSERT')
+        
+        return self.SqlForInsertRows(rows[0].keys(), rows)
+    
+    def insertBatches(self):
+        """
+        Generator, which yields (query, escape) for each multi-row INSERT
+        statement. Rows are consumed lazily, one batch at a time.
+        """
+        
+        values = self.values_
+        if isinstance(values, dict):
+            values = [values]
+        
+        rows = iter(values)
+        try:
+            first = rows.next()
+        except StopIteration:
+            return
+        
+        keys = first.keys()
+        size = self.insertRowsPerBatch(len(keys))
+        
+        batch = [first]
+        batch.extend(itertools.islice(rows, size - 1))
+        while len(batch) > 0:
+            for part in self.splitInsertBatch(keys, batch):
+                yield self.SqlForInsertRows(keys, part)
+            batch = list(itertools.islice(rows, size))
+    
+    def splitInsertBatch(self, keys, batch):
+        """
+        Generator, which splits batch into runs of rows, whose estimated
+        statement size stays within self.maxStatementBytes. Each value is
+        counted as if every character needed escaping, plus quotes and a
+        separator, so the estimate errs on the large side.
+        """
+        
+        if self.maxStatementBytes is None:
+            yield batch
+            return
+        
+        part = []
+        size = 0
+        for row in batch:
+            rowSize = 2 * estimateBytes([[row.get(k) for k in keys]])\
+                + 8 * len(keys)
+            if len(part) > 0 and size + rowSize > self.maxStatementBytes:
+                yield part
+                part = []
+                size = 0
+            part.append(row)
+            size += rowSize
+        
+        if len(part) > 0:
+            yield part
+    
+    def SqlForInsertMany(self):
+        """
+        Returns (query, escapes) for cursor.executemany(), where query is a
+        single row INSERT statement, and escapes is a generator of escape
+        lists, one per row.
+        """
+        
+        rows = iter(self.values_)
+        try:
+            first = rows.next()
+        except StopIteration:
+            return (None, [])
+        
+        keys = first.keys()
+        query, escape = self.SqlForInsertRows(keys, [first])
+        
+        def escapes():
+            yield escape
+            for row in rows:
+                yield self.SqlForInsertRows(keys, [row])[1]
+        
+        return (query, escapes())
+    
     def update(self, table):
         """ Perform UPDATE on table. """
 
@@ -466,6 +943,53 @@ class Builder(BaseClause):
         
         return (' '.join(query), escape)
     
+    @ExceptionWrapper
+    def compile(self):
+        """
+        **
+        * Build SQL once, and return an immutable QueryTemplate. Values given
+        * as doze.Param are left as slots, to be filled in by
+        * QueryTemplate.bind(), or by fromTemplate().
+        *
+        * @return   QueryTemplate
+        **
+        """
+        query, escape = self.sql()
+        kind, destination = self.statement()
+        return QueryTemplate(query, escape, kind, destination,
+            self.cacheTables())
+    
+    def fromTemplate(self, template, *args, **kwargs):
+        """
+        **
+        * Use a compiled QueryTemplate, binding args / kwargs to its params.
+        * The builder can then be executed as usual, with cursor(), asObject()
+        * or execute(), without rebuilding the SQL.
+        *
+        * @param    template    QueryTemplate
+        * @return   reference to self
+        **
+        """
+        self.reset()
+        self.kind = 'template'
+        self.template_ = template
+        self.templateArgs = args
+        self.templateKwargs = kwargs
+        return self
+    
+    def SqlForTemplate(self):
+        """ From compiled template. Returns (query, escape). """
+        return self.template_.sql(*self.templateArgs, **self.templateKwargs)
+    
+    def statement(self):
+        """
+        Returns (kind, destination) of the current query, such as
+        ('insert', 'users'), taken from the template when using one.
+        """
+        if self.kind == 'template':
+            return (self.template_.kind, self.template_.destination)
+        return (self.kind, self.destination)
+    
     @ExceptionWrapper
     def cursor(self, server = False):
         """
@@ -480,14 +1004,16 @@ class Builder(BaseClause):
         if self.db == None:
             return None
         
-        query, escape = self.sql()
+        trace = self.startTrace()
+        query, escape = self.compileSql(trace)
         
         cursor = self.db.cursor()
-        cursor.execute(query, escape)
+        self.executeCursor(cursor, query, escape, trace)
         return cursor
     
     @ExceptionWrapper
-    def asObject(self, fetchall = False, server = False, destroy = True, fetch = dict):
+    def asObject(self, fetchall = False, server = False, destroy = True, fetch = dict,
+                 arraysize = None):
         """
         **
         * Execute query and return result object. If fetchall == True,
@@ -496,21 +1022,589 @@ class Builder(BaseClause):
         * use a server-side cursor and wrap it in an object, so data can be
         * downloaded as needed, instead of all at once.
         *
+        * When the builder has a ConnectionPool, the connection is held until
+        * the result is closed, and is committed then, as execute() does, so
+        * INSERT / UPDATE ... RETURNING isn't rolled back.
+        *
         * @param    fetchall    bool
         * @param    server      bool
-        * @param    fetch       type, dict returns dictionaries, anything else
+        * @param    fetch       type, dict returns dictionaries,
+        *                       collections.namedtuple returns namedtuples,
+        *                       Record returns slotted records, anything else
         *                       returns tuples
+        * @param    arraysize   int, number of rows to fetch per call to
+        *                       cursor.fetchmany(). Defaults to
+        *                       self.serverArraysize for server-side cursors,
+        *                       otherwise rows are fetched one at a time.
         * @return   QueryResult
         **
         """
+        if (self.resultCache is not None and not server
+        and (self.db is not None or self.isPooled())):
+            trace = self.startTrace()
+            key = self.cacheKey(trace)
+            if key is not None:
+                return self.asCachedObject(key, destroy, fetch, arraysize, trace)
+        
+        if self.isPooled():
+            # Hold on to the connection until the result is closed
+            pool = self.pool
+            conn = pool.get()
+            self.db = conn
+            result = None
+            try:
+                result = self.asObject(fetchall, server, destroy, fetch, arraysize)
+            finally:
+                self.db = None
+                if result is None:
+                    pool.put(conn)
+            
+            # onError swallowed the exception
+            if result is None:
+                return None
+            
+            def checkIn():
+                try:
+                    conn.commit()
+                finally:
+                    pool.put(conn)
+            
+            # Results which aren't a QueryResult never call onClose, such as
+            # rows fetched by a subclass, so check the connection in now
+            if not isinstance(result, QueryResult):
+                checkIn()
+                return result
+            
+            result.onClose = checkIn
+            return result
+        
+        if arraysize is None and server:
+            arraysize = self.serverArraysize
+        
         cursor = self.cursor(server)
-        return QueryResult(cursor, destroy, fetch)
+        self.initArraysize(cursor, arraysize)
+        result = self.queryResultClass(cursor, destroy, fetch, arraysize)
+        result.trace = self.trace
+        return result
+    
+    def setResultCache(self, cache, ttl = None):
+        """
+        **
+        * Serve SELECT / WITH / template queries run with asObject() from
+        * cache, a ResultCache, which may be shared by several builders.
+        * Entries are keyed by connection, or by ConnectionPool, so builders
+        * on different databases don't share them.
+        *
+        * Entries are tagged with the tables in the query's FROM and JOIN
+        * clauses, and in sub-queries given as Builders, including those in
+        * WHERE and HAVING, as recorded by compile() for templates.
+        * Sub-queries given as SQL strings aren't tagged, so their entries
+        * only expire by TTL. INSERT, UPDATE and DELETE run with execute(),
+        * directly or from a template, invalidate entries for their table
+        * right away, and again once committed with
+        * commit(), or by a pooled builder, so rows cached by other builders
+        * before the commit are dropped too. Server-side cursors bypass the
+        * cache. Pass None to stop using the cache.
+        *
+        * @param    cache   ResultCache or None
+        * @param    ttl     float, seconds. Defaults to cache.ttl.
+        * @return   reference to self
+        **
+        """
+        self.resultCache = cache
+        self.resultCacheTtl = ttl
+        return self
+    
+    def cacheKey(self, trace = None):
+        """
+        Returns ResultCache key for the current query, as (scope, query,
+        escape tuple), or None when the query can't be cached. scope
+        identifies the connection, or the pool, see ResultCache.scope().
+        """
+        if self.statement()[0] not in ('select', 'with'):
+            return None
+        
+        if self.isPooled():
+            scope = self.resultCache.scope(self.pool)
+        else:
+            scope = self.resultCache.scope(self.db)
+        
+        query, escape = self.compileSql(trace)
+        key = (scope, query, tuple(escape))
+        try:
+            hash(key)
+        except TypeError:
+            # Unhashable values, such as lists, aren't cached
+            return None
+        return key
+    
+    def cacheTables(self):
+        """
+        Returns names of the tables the current query reads from, including
+        those of sub-queries given to from_(), as_(), union(), and to
+        where() / having(), or as values of their conditions.
+        """
+        if self.kind == 'template':
+            return list(self.template_.tables)
+        
+        tables = [name for name, alias in self.tableContext]
+        if type(self.source) == str:
+            tables.append(self.source)
+        
+        for i in self.joins:
+            if type(i.table) == list:
+                tables.append(i.table[0])
+            else:
+                tables.append(i.table)
+        
+        queries = [self.source] + self.withQueries + [i[0] for i in self.union_]
+        for i in queries:
+            if isinstance(i, Builder):
+                tables.extend(i.cacheTables())
+        
+        wheres = list(self.where_)
+        if self.having_ is not None:
+            wheres.append(self.having_)
+        tables.extend(self.whereTables(wheres))
+        return tables
+    
+    def whereTables(self, wheres):
+        """ Returns names of the tables read by sub-queries in wheres """
+        tables = []
+        for where in wheres:
+            if isinstance(where, Builder):
+                tables.extend(where.cacheTables())
+            elif isinstance(where, WhereGroup):
+                tables.extend(self.whereTables(where.wheres))
+            elif isinstance(where, Where):
+                for each in where.where:
+                    for value in each:
+                        if type(value) != list:
+                            value = [value]
+                        tables.extend(self.whereTables(
+                            [i for i in value if isinstance(i, Builder)]))
+        return tables
+    
+    def fetchForCache(self, query, escape, trace = None):
+        """ Execute query, and return (description, rows) as tuples """
+        cursor = self.db.cursor()
+        try:
+            self.executeCursor(cursor, query, escape, trace)
+            description = tuple([tuple(i) for i in cursor.description])
+            if trace is None:
+                rows = cursor.fetchall()
+            else:
+                rows = trace.fetch(cursor.fetchall)
+            rows = tuple([tuple(i) for i in rows])
+        finally:
+            cursor.close()
+        return (description, rows)
+    
+    def asCachedObject(self, key, destroy = True, fetch = dict, arraysize = None,
+                       trace = None):
+        """
+        **
+        * Return result for key from self.resultCache, executing the query
+        * and storing its result on a miss. Rows are fetched all at once.
+        *
+        * @param    key     tuple, as returned by cacheKey()
+        * @return   CachedQueryResult
+        **
+        """
+        entry = self.resultCache.get(key)
+        if entry is None:
+            if self.isPooled():
+                entry = self.withConnection(self.fetchForCache, key[1],
+                    list(key[2]), trace)
+            else:
+                entry = self.fetchForCache(key[1], list(key[2]), trace)
+            self.resultCache.set(key, entry[0], entry[1], self.cacheTables(),
+                self.resultCacheTtl)
+        
+        result = CachedQueryResult(CachedCursor(*entry), destroy, fetch, arraysize)
+        result.columnTypes = self.queryResultClass.columnTypes
+        return result
+    
+    def paginate(self, key = 'id', pageSize = 1000, descending = False,
+                 fetch = dict):
+        """
+        **
+        * Generator, which runs the current SELECT one page at a time, using
+        * keyset (seek) pagination, and yields rows as asObject() would. Each
+        * page is fetched with a fresh query, which continues after the last
+        * key seen, ordered by key, so every page costs the same, and no
+        * cursor or transaction is held open between pages.
+        *
+        * For a composite key (a, b), pages after the first are selected with
+        * "(a > ?) OR (a = ? AND b > ?)", which databases can answer from an
+        * index on (a, b). Keys must be unique together, not NULL, and
+        * selected, so their values can be read from the last row of a page.
+        * The query's ORDER BY is replaced, and its LIMIT, if any, caps the
+        * total number of rows yielded. The builder is left holding the
+        * compiled page query.
+        *
+        * Examples:
+        *
+        *   builder.select('id, name').from_('events')\
+        *       .where(Where('kind').equals('click'))
+        *   for row in builder.paginate('id', 5000):
+        *       process(row)
+        *
+        *   for row in builder.select('*').from_('log')\
+        *           .paginate(['day', 'seq'], descending=True):
+        *       process(row)
+        *
+        * @param    key         str, or list of str for a composite key
+        * @param    pageSize    int, rows per page
+        * @param    descending  bool, walk keys in descending order
+        * @param    fetch       type, see asObject()
+        * @return   generator
+        **
+        """
+        if self.kind not in ('select', 'with'):
+            raise DozeError('paginate() requires a SELECT query')
+        
+        total = None
+        if self.limit_ is not None:
+            try:
+                total = int(self.limit_)
+            except (TypeError, ValueError):
+                raise DozeError('paginate() requires LIMIT to be a number'
+                    ' of rows, not "%s"' % (self.limit_))
+            pageSize = max(1, min(pageSize, total))
+        
+        keys = key
+        if type(keys) not in (list, tuple):
+            keys = [keys]
+        
+        # (k0 > :key0) OR (k0 = :key0 AND k1 > :key1) OR ...
+        params = [Param('key%d' % (i)) for i in range(0, len(keys))]
+        branches = []
+        for i in range(0, len(keys)):
+            where = self.whereClass(keys[0])
+            for j in range(0, i + 1):
+                if j > 0:
+                    where.and_(keys[j])
+                
+                if j < i:
+                    where.equals(params[j])
+                elif descending:
+                    where.lt(params[j])
+                else:
+                    where.gt(params[j])
+            branches.append(where)
+        
+        seek = WhereGroup(branches, 'or_')
+        seek.setTableContext(self.tableContext)
+        
+        direction = ''
+        if descending:
+            direction = ' DESC'
+        
+        # Existing conditions are grouped, so an OR in them can't bind to
+        # the seek condition
+        where_, order_, limit_ = self.where_, self.order_, self.limit_
+        grouped = [WhereGroup([i]) for i in where_]
+        try:
+            self.order_ = ', '.join([i + direction for i in keys])
+            self.limit_ = pageSize
+            self.where_ = grouped
+            firstPage = self.compile()
+            self.where_ = grouped + [seek]
+            nextPage = self.compile()
+        finally:
+            self.where_, self.order_, self.limit_ = where_, order_, limit_
+        
+        labels = [i.split(self.fieldSeparator)[-1].strip(self.fieldQuote)
+            for i in keys]
+        
+        template = firstPage
+        values = {}
+        indexes = None
+        yielded = 0
+        while True:
+            result = self.fromTemplate(template, **values)\
+                .asObject(fetch=fetch, arraysize=pageSize)
+            if result is None:
+                return
+            
+            count = 0
+            last = None
+            try:
+                while total is None or yielded < total:
+                    row = result.nextRow()
+                    if row is None:
+                        break
+                    if result.cursorDescrInit == False:
+                        result.initCursorDescr()
+                    
+                    # Checked on the first row, before any are yielded
+                    if indexes is None:
+                        indexes = []
+                        for label in labels:
+                            if label not in result.labels:
+                                raise DozeError('Key column "%s" must be'
+                                    ' selected, to paginate on it' % (label))
+                            indexes.append(result.labels.index(label))
+                    
+                    count += 1
+                    yielded += 1
+                    last = row
+                    yield result.convertRow(row)
+            finally:
+                result.close()
+            
+            if count < pageSize or (total is not None and yielded >= total):
+                return
+            
+            template = nextPage
+            values = dict([('key%d' % (i), last[indexes[i]])
+                for i in range(0, len(indexes))])
+    
+    @ExceptionWrapper
+    def asPartitioned(self, key = 'id', partitions = 4, workers = None,
+                      ordered = False, fetch = dict, arraysize = None):
+        """
+        **
+        * Execute the current SELECT as a parallel, partitioned scan, for
+        * exporting large tables. The range of key is read with MIN() / MAX(),
+        * and split into partitions of equal width, each selected with
+        * "key >= ? AND key < ?" on its own connection from self.pool, by up
+        * to workers threads, using server-side cursors. Rows with a NULL key
+        * are selected by one more partition. Rows from all partitions are
+        * returned through a single result, as asObject() would.
+        *
+        * Rows are returned in no particular order, unless ordered is True,
+        * in which case each partition is ordered by key, and partitions are
+        * returned in key order, with NULL keys last. Workers block once
+        * their partition's queue of fetched batches is full, so memory use
+        * is bounded either way. The query's ORDER BY is replaced, and GROUP
+        * BY, HAVING, LIMIT and UNION are not supported. The key must be
+        * numeric, or support subtraction and division of the difference,
+        * such as dates. Partitions don't share a transaction, so rows
+        * written during the scan may or may not be returned.
+        *
+        * Examples:
+        *
+        *   builder = pgsql.Builder(pgsql.pool(maxsize=8, **params))
+        *   res = builder.select('*').from_('events')\
+        *       .where(Where('kind').equals('click'))\
+        *       .asPartitioned('id', partitions=8)
+        *   for row in res:
+        *       export(row)
+        *
+        * @param    key         str, column to partition on
+        * @param    partitions  int, number of key ranges
+        * @param    workers     int, number of threads and connections.
+        *                       Defaults to the pool's maxsize, less the
+        *                       connections already checked out, so
+        *                       workers don't wait on connections the
+        *                       caller holds.
+        * @param    ordered     bool, return rows ordered by key
+        * @param    fetch       type, see asObject()
+        * @param    arraysize   int, rows per fetch and per queued batch.
+        *                       Defaults to self.serverArraysize.
+        * @return   PartitionedQueryResult
+        **
+        """
+        if self.kind != 'select':
+            raise DozeError('asPartitioned() requires a SELECT query')
+        
+        if self.pool is None:
+            raise DozeError('asPartitioned() requires a ConnectionPool')
+        
+        if (self.group_ is not None or self.having_ is not None
+        or self.limit_ is not None or len(self.union_) > 0):
+            raise DozeError('asPartitioned() does not support GROUP BY,'
+                ' HAVING, LIMIT or UNION')
+        
+        if arraysize is None:
+            arraysize = self.serverArraysize
+        
+        if workers is None:
+            checkedOut = len(self.pool) - len(self.pool.idleConnections)
+            workers = max(1, self.pool.maxsize - checkedOut)
+        
+        column = self.normalizeColumns([key])[0]
+        low, high = Param('low'), Param('high')
+        between = self.whereClass(key).gte(low).and_(key).lt(high)
+        last = self.whereClass(key).gte(low).and_(key).lte(high)
+        nulls = self.whereClass(key).isNull()
+        for where in (between, last, nulls):
+            where.setTableContext(self.tableContext)
+        
+        # Existing conditions are grouped, so an OR in them can't bind to
+        # the range condition
+        columns, where_, order_ = self.columns, self.where_, self.order_
+        grouped = [WhereGroup([i]) for i in where_]
+        try:
+            self.columns = 'MIN(%s), MAX(%s)' % (column, column)
+            self.where_ = grouped
+            self.order_ = None
+            bounds = self.compile()
+            
+            self.columns = columns
+            if ordered:
+                self.order_ = column
+            self.where_ = grouped + [between]
+            betweenTemplate = self.compile()
+            self.where_ = grouped + [last]
+            lastTemplate = self.compile()
+            self.where_ = grouped + [nulls]
+            nullsTemplate = self.compile()
+        finally:
+            self.columns, self.where_, self.order_ = columns, where_, order_
+        
+        def builder():
+            res = self.__class__(self.pool)
+            res.hooks = self.hooks
+            return res
+        
+        # Bounds read from a cache could miss rows written since, so the
+        # query always runs
+        result = builder().setResultCache(None).fromTemplate(bounds)\
+            .asObject(fetch=tuple)
+        try:
+            lowest, highest = result.next()
+        finally:
+            result.close()
+        
+        # Partitions as (template, values)
+        scans = []
+        if lowest is not None:
+            edges = splitRange(lowest, highest, partitions)
+            for i in range(0, len(edges) - 1):
+                template = betweenTemplate
+                if i == len(edges) - 2:
+                    template = lastTemplate
+                scans.append((template, {'low': edges[i], 'high': edges[i + 1]}))
+        scans.append((nullsTemplate, {}))
+        
+        def run(scan, emit):
+            result = builder().fromTemplate(scan[0], **scan[1])\
+                .asObject(server=True, fetch=tuple, arraysize=arraysize)
+            try:
+                while True:
+                    rows = result.fetchRows()
+                    if not emit(result.cursor.description, rows):
+                        return
+                    if len(rows) == 0:
+                        return
+            finally:
+                result.close()
+        
+        cursor = PartitionCursor(scans, run, workers, ordered)
+        cursor.arraysize = arraysize
+        result = PartitionedQueryResult(cursor, True, fetch, arraysize)
+        result.columnTypes = self.queryResultClass.columnTypes
+        return result
+    
+    @ExceptionWrapper
+    def asColumns(self, server = False, arraysize = None):
+        """
+        **
+        * Execute query and return result in columnar form. Rows are fetched
+        * with cursor.fetchmany(arraysize), and pivoted into a typed
+        * array.array per numeric column, or a list for other columns. NULLs
+        * in typed columns are flagged in a mask.
+        *
+        * @param    server      bool
+        * @param    arraysize   int, number of rows to fetch per call to
+        *                       cursor.fetchmany(). Defaults to
+        *                       self.serverArraysize.
+        * @return   ColumnSet
+        **
+        """
+        if arraysize is None:
+            arraysize = self.serverArraysize
+        
+        return self.asObject(server=server, fetch=tuple,
+            arraysize=arraysize).asColumns()
+    
+    @ExceptionWrapper
+    def asArrays(self, server = False, arraysize = None):
+        """
+        **
+        * Execute query and return result as NumPy arrays, keyed by column
+        * label. Columns with NULLs are returned as masked arrays. Raises
+        * NotSupported when NumPy is not installed.
+        *
+        * @param    server      bool
+        * @param    arraysize   int, see asColumns()
+        * @return   dict
+        **
+        """
+        return self.asColumns(server, arraysize).asArrays()
+    
+    def initArraysize(self, cursor, arraysize):
+        """ Set arraysize on cursor, before rows are fetched. """
+        if cursor is not None and arraysize:
+            cursor.arraysize = arraysize
     
     @ExceptionWrapper
     def execute(self, server = False):
-        cursor = self.cursor(server)
-        rows = cursor.rowcount
-        cursor.close()
+        if self.isPooled():
+            return self.withConnection(self.execute, server)
+        
+        if self.insertIsBatched():
+            rows = self.executeInsertBatches()
+        else:
+            cursor = self.cursor(server)
+            rows = cursor.rowcount
+            cursor.close()
+        
+        kind, destination = self.statement()
+        if (self.resultCache is not None
+        and kind in ('insert', 'update', 'delete')):
+            # Dropped now, so this connection doesn't read stale entries,
+            # and again once committed, in case other builders cached the
+            # old rows in between
+            self.resultCache.invalidate(destination)
+            self.uncommittedTables.add(destination)
+        return rows
+    
+    def invalidateCommitted(self):
+        """
+        Invalidate cache entries for the tables written since the last
+        commit. Called once the write has been committed.
+        """
+        tables, self.uncommittedTables = self.uncommittedTables, set()
+        if self.resultCache is not None and len(tables) > 0:
+            self.resultCache.invalidate(*tables)
+    
+    def executeInsertBatches(self):
+        """
+        **
+        * Execute INSERT for an iterable of rows, either as multi-row INSERT
+        * statements, or with cursor.executemany(). Returns number of rows
+        * inserted.
+        *
+        * @return   int
+        **
+        """
+        if self.db == None:
+            return None
+        
+        rows = 0
+        trace = self.startTrace()
+        cursor = self.db.cursor()
+        try:
+            if self.many_:
+                query, escapes = self.SqlForInsertMany()
+                if query is not None:
+                    self.executeCursor(cursor, query, escapes, trace, True)
+                    rows = cursor.rowcount
+            else:
+                batches = self.insertBatches()
+                if trace is not None:
+                    batches = trace.compileEach(batches)
+                
+                for query, escape in batches:
+                    self.executeCursor(cursor, query, escape, trace)
+                    rows += cursor.rowcount
+        finally:
+            cursor.close()
+        
         return rows
     
     @ExceptionWrapper
@@ -525,26 +1619,113 @@ class Builder(BaseClause):
             return self.SqlForDelete()
         elif self.kind == 'with':
             return self.SqlForWith()
+        elif self.kind == 'template':
+            return self.SqlForTemplate()
+    
+    def setHooks(self, hooks):
+        """
+        **
+        * Fire hooks, a QueryHooks, as queries are compiled, executed and
+        * fetched. Set Builder.hooks instead, to install hooks for all
+        * builders. Pass None to remove the hooks.
+        *
+        * @param    hooks   QueryHooks or None
+        * @return   reference to self
+        **
+        """
+        self.hooks = hooks
+        return self
+    
+    def startTrace(self):
+        """
+        Returns a new QueryTrace, set as self.trace, or None when there are
+        no hooks to fire.
+        """
+        if self.hooks is None or len(self.hooks) == 0:
+            self.trace = None
+        else:
+            self.trace = QueryTrace(self, self.hooks)
+        return self.trace
+    
+    def compileSql(self, trace = None, sql = None):
+        """
+        Returns sql(), or the (query, escape) returned by the given sql
+        callable, firing the compile hooks when tracing.
+        """
+        if sql is None:
+            sql = self.sql
+        if trace is None:
+            return sql()
+        return trace.compile(sql)
+    
+    def executeCursor(self, cursor, query, escape, trace = None, many = False):
+        """
+        Execute query on cursor, with cursor.executemany() when many is True,
+        firing the execute hooks when tracing.
+        """
+        if trace is not None:
+            trace.execute(cursor, query, escape, many)
+        elif many:
+            cursor.executemany(query, escape)
+        else:
+            cursor.execute(query, escape)
     
     @ExceptionWrapper
     def commit(self):
         """ Convenience wrapper for db.commit() """
         if self.db is not None:
             self.db.commit()
+            self.invalidateCommitted()
     
     @ExceptionWrapper
     def rollback(self):
         """ Convenience wrapper for db.rollback() """
         if self.db is not None:
             self.db.rollback()
+            self.uncommittedTables.clear()
     
     def getConnection(self):
         """ Get database connection, if any """
         return self.db
     
     def setConnection(self, db):
-        """ Set database connection """
-        self.db = db
+        """
+        Set database connection. db may also be a ConnectionPool, in which
+        case a connection is borrowed from it for each query.
+        """
+        if isinstance(db, ConnectionPool):
+            self.pool = db
+            self.db = None
+        else:
+            self.pool = None
+            self.db = db
+    
+    def isPooled(self):
+        """ True when a connection has to be borrowed from self.pool """
+        return self.pool is not None and self.db is None
+    
+    def withConnection(self, func, *args, **kwargs):
+        """
+        **
+        * Borrow a connection from self.pool, and call func with it set as
+        * self.db. The connection is committed when func succeeds, and checked
+        * back in either way.
+        *
+        * @param    func    callable
+        * @return   mixed, whatever func returns
+        **
+        """
+        conn = self.pool.get()
+        self.db = conn
+        try:
+            res = func(*args, **kwargs)
+            conn.commit()
+        finally:
+            self.db = None
+            self.pool.put(conn)
+        
+        self.invalidateCommitted()
+        return res
     
     def isReady(self):
         return True
@@ -0,0 +1,225 @@
+import time
+import weakref
+import threading
+from doze import *
+
+class ResultCache(object):
+    """
+    **
+    * Bounded, thread-safe cache of query results, keyed by (query, escape)
+    * as returned by Builder.sql(). Results are stored fully fetched, as a
+    * tuple of row tuples, along with the cursor description. Entries expire
+    * ttl seconds after they're stored (never, when ttl is None), and the
+    * least recently used entry is evicted once maxsize entries are stored.
+    * Results of more than maxrows rows are returned, but not stored.
+    *
+    * Keys start with a scope, which identifies the connection or pool the
+    * query ran on, see scope(), so a cache can be shared by builders on
+    * different databases.
+    *
+    * Each entry is tagged with the tables its query reads from, so writes
+    * can invalidate just the entries they affect. Tables are matched by
+    * their unqualified name, without quotes, so invalidating "app.users"
+    * also drops entries for "users" in other schemas.
+    *
+    * Examples:
+    *
+    *   cache = ResultCache(maxsize=512, ttl=30)
+    *   builder = pgsql.Builder(db).setResultCache(cache)
+    *   builder.select('*').from_('config').asObject()   # Miss
+    *   builder.select('*').from_('config').asObject()   # Hit
+    *
+    *   cache.invalidate('config')
+    **
+    """
+
+    def __init__(self, maxsize = 1024, ttl = 60, maxrows = 10000):
+        self.ttl = ttl
+        self.maxrows = maxrows
+        self.hits = 0
+        self.misses = 0
+
+        # Table name => set of keys. The lock is reentrant, since entries
+        # evicted by set() are untagged from within it.
+        self.tags = {}
+        self.lock = threading.RLock()
+        self.entries = LRUCache(maxsize, self.untag)
+
+        # Connection or pool => scope, see scope()
+        self.scopes = weakref.WeakKeyDictionary()
+        self.lastScope = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def scope(self, db):
+        """
+        Returns scope for db, a connection or ConnectionPool, which is
+        unique for as long as db is alive. Objects which can't be weakly
+        referenced are scoped by id().
+        """
+        self.lock.acquire()
+        try:
+            try:
+                scope = self.scopes.get(db)
+            except TypeError:
+                return ('id', id(db))
+
+            if scope is None:
+                self.lastScope += 1
+                scope = self.lastScope
+                self.scopes[db] = scope
+            return scope
+        finally:
+            self.lock.release()
+
+    def tableTag(self, table):
+        """ Returns tag for table name, unqualified and without quotes """
+        for quote in '"`[]':
+            table = table.replace(quote, '')
+        return table.split('.')[-1]
+
+    def untag(self, key, entry):
+        """ Remove key from the tags of entry """
+        self.lock.acquire()
+        try:
+            for tag in entry[3]:
+                keys = self.tags.get(tag)
+                if keys is None:
+                    continue
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self.tags[tag]
+        finally:
+            self.lock.release()
+
+    def get(self, key):
+        """
+        Returns (description, rows) stored for key, or None when there's no
+        entry, or it has expired.
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] is not None and entry[0] < time.time():
+            self.lock.acquire()
+            try:
+                # Entry may have been replaced since
+                if self.entries.get(key) is entry:
+                    self.entries.remove(key)
+                    self.untag(key, entry)
+            finally:
+                self.lock.release()
+            entry = None
+
+        # Counters are informational, so they're updated without the lock
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return (entry[1], entry[2])
+
+    def set(self, key, description, rows, tables = (), ttl = None):
+        """
+        **
+        * Store result for key. Returns False when the result has more than
+        * self.maxrows rows, and isn't stored.
+        *
+        * @param    key         tuple, (scope, query, tuple(escape))
+        * @param    description tuple, cursor.description
+        * @param    rows        tuple of row tuples
+        * @param    tables      list of table names, for invalidate()
+        * @param    ttl         float, seconds. Defaults to self.ttl.
+        * @return   bool
+        **
+        """
+        if self.maxrows is not None and len(rows) > self.maxrows:
+            return False
+
+        if ttl is None:
+            ttl = self.ttl
+
+        expires = None
+        if ttl is not None:
+            expires = time.time() + ttl
+
+        tags = frozenset([self.tableTag(i) for i in tables])
+        entry = (expires, description, rows, tags)
+
+        self.lock.acquire()
+        try:
+            old = self.entries.get(key)
+            if old is not None:
+                self.untag(key, old)
+
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            self.entries.set(key, entry)
+        finally:
+            self.lock.release()
+        return True
+
+    def invalidate(self, *tables):
+        """
+        Drop entries for queries reading from any of tables. Returns number
+        of entries dropped.
+        """
+        count = 0
+        self.lock.acquire()
+        try:
+            for table in tables:
+                for key in list(self.tags.get(self.tableTag(table), ())):
+                    entry = self.entries.get(key)
+                    if entry is None:
+                        continue
+                    self.entries.remove(key)
+                    self.untag(key, entry)
+                    count += 1
+        finally:
+            self.lock.release()
+        return count
+
+    def clear(self):
+        """ Drop all entries """
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.tags = {}
+        finally:
+            self.lock.release()
+
+class CachedCursor(object):
+    """
+    Read-only, DB-API style cursor over rows held in memory, so cached
+    results can be wrapped in a QueryResult like any other cursor.
+    """
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+        self.rowcount = len(rows)
+        self.rownumber = 0
+        self.arraysize = 1
+        self.closed = False
+        self.connection = None
+
+    def fetchone(self):
+        if self.rownumber >= self.rowcount:
+            return None
+        self.rownumber += 1
+        return self.rows[self.rownumber - 1]
+
+    def fetchmany(self, size = None):
+        if size is None:
+            size = self.arraysize
+        start = self.rownumber
+        self.rownumber = min(start + size, self.rowcount)
+        return list(self.rows[start:self.rownumber])
+
+    def fetchall(self):
+        return self.fetchmany(self.rowcount - self.rownumber)
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,179 @@
+import array
+from doze import *
+
+# array.array typecode for 64 bit integers. Python 2 has no 'q' typecode,
+# where 'l' is 64 bits wide on LP64 platforms.
+try:
+    array.array('q')
+    ARRAY_INT64 = 'q'
+except ValueError:
+    ARRAY_INT64 = 'l'
+
+class ColumnSet(object):
+    """
+    **
+    * Columnar query result, as returned by QueryResult.asColumns(). Rows are
+    * added in chunks, and pivoted into one container per column:
+    *
+    *   - Numeric and boolean columns are stored in typed array.array's. NULL
+    *     is stored as 0, and flagged in a mask (array.array('B'), where 1
+    *     means NULL). Columns without NULLs have no mask.
+    *   - Other columns are stored as lists.
+    *
+    * The typecode of each column is taken from types, which is usually
+    * built from cursor.description type codes. When it's None, the typecode
+    * is inferred from the first non-NULL value.
+    *
+    * Examples:
+    *
+    *   columns = builder.select('id, price').from_('items').asColumns()
+    *   print sum(columns['price'])
+    *   print columns.masks['price']
+    **
+    """
+
+    def __init__(self, labels, types = None):
+        if types is None:
+            types = [None] * len(labels)
+
+        self.labels = list(labels)
+        self.types = list(types)
+        self.data = {}
+        self.masks = {}
+        self.rowcount = 0
+
+        for i in range(0, len(self.labels)):
+            self.initColumn(i)
+
+    def __getitem__(self, label):
+        return self.data[label]
+
+    def __contains__(self, label):
+        return label in self.data
+
+    def __iter__(self):
+        for label in self.labels:
+            yield (label, self.data[label])
+
+    def __len__(self):
+        return self.rowcount
+
+    def initColumn(self, index):
+        """ Create empty container for column, based on its typecode """
+        label = self.labels[index]
+        typecode = self.types[index]
+
+        if typecode is None:
+            self.data[label] = []
+        else:
+            self.data[label] = array.array(typecode)
+        self.masks[label] = None
+
+    def inferType(self, value):
+        """ Get array typecode for value, or None when it has to be a list """
+        if isinstance(value, bool):
+            return 'B'
+        elif isinstance(value, (int, long)):
+            return ARRAY_INT64
+        elif isinstance(value, float):
+            return 'd'
+        return None
+
+    def convertToList(self, index):
+        """ Convert typed column to a list, restoring NULLs from its mask """
+        label = self.labels[index]
+        values = self.data[label].tolist()
+        mask = self.masks[label]
+
+        if mask is not None:
+            values = [None if m else v for v, m in zip(values, mask)]
+
+        self.data[label] = values
+        self.masks[label] = None
+        self.types[index] = False
+
+    def append(self, rows):
+        """ Append chunk of rows (sequence of tuples) """
+
+        if len(rows) == 0:
+            return
+
+        columns = zip(*rows)
+        for i in range(0, len(self.labels)):
+            label = self.labels[i]
+            values = columns[i]
+
+            # Infer typecode from the first non-NULL value. A typecode of
+            # False means the column has already been settled as a list.
+            if self.types[i] is None:
+                for v in values:
+                    if v is not None:
+                        typecode = self.inferType(v)
+                        if typecode is None:
+                            self.types[i] = False
+                        else:
+                            nulls = self.data[label]
+                            self.types[i] = typecode
+                            self.data[label] = array.array(typecode, [0] * len(nulls))
+                            if len(nulls) > 0:
+                                self.masks[label] = array.array('B', [1] * len(nulls))
+                        break
+
+            if not self.types[i]:
+                self.data[label].extend(values)
+                continue
+
+            mask = self.masks[label]
+            if None in values:
+                if mask is None:
+                    mask = array.array('B', [0] * self.rowcount)
+                    self.masks[label] = mask
+                mask.extend([v is None for v in values])
+                values = [0 if v is None else v for v in values]
+            elif mask is not None:
+                mask.extend([0] * len(values))
+
+            try:
+                self.data[label].extend(values)
+            except (TypeError, OverflowError):
+                # Value doesn't fit the typecode, such as a string or an
+                # unsigned 64 bit integer. Drop the partial chunk, and fall
+                # back to a list.
+                del self.data[label][self.rowcount:]
+                if mask is not None:
+                    del mask[self.rowcount:]
+                self.convertToList(i)
+                self.data[label].extend(columns[i])
+
+        self.rowcount += len(rows)
+
+    def asArrays(self):
+        """
+        **
+        * Convert columns to NumPy arrays. Typed columns share memory with the
+        * underlying array.array. Columns with NULLs are returned as
+        * numpy.ma masked arrays, and list columns as object arrays.
+        *
+        * @return   dict, of label => numpy array
+        **
+        """
+        try:
+            import numpy
+        except ImportError:
+            raise NotSupported('asArrays() requires NumPy')
+
+        arrays = {}
+        for label in self.labels:
+            column = self.data[label]
+            if isinstance(column, list):
+                arrays[label] = numpy.array(column, dtype=object)
+                continue
+
+            data = numpy.frombuffer(column, dtype=numpy.dtype(column.typecode))
+            mask = self.masks[label]
+            if mask is not None:
+                data = numpy.ma.masked_array(data,
+                    mask=numpy.frombuffer(mask, dtype=numpy.bool_))
+            arrays[label] = data
+
+        return arrays
@@ -0,0 +1,67 @@
+import re
+from doze import *
+
+# Tokens replaced by fingerprint(). Quoted identifiers are matched first, so
+# their contents are left alone.
+FINGERPRINT_TOKENS = re.compile(r"""
+    (?P<identifier>"(?:[^"]|"")*"|`(?:[^`]|``)*`)
+    | (?P<literal>
+        '(?:[^'\\]|''|\\.)*'                    # String
+        | %\([^)]*\)s | %s | \? | \$\d+         # Placeholder
+        | (?<!:):[A-Za-z_]\w*                   # Named placeholder
+        | (?<![\w.])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.]))  # Number
+    | (?P<space>\s+)
+    """, re.X)
+
+# Parenthesized lists of literals, and runs of them, such as in
+# "IN (?, ?, ?)", or "VALUES (?, ?), (?, ?)"
+FINGERPRINT_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+FINGERPRINT_LISTS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+
+# Fingerprints, keyed by query. Queries longer than
+# FINGERPRINT_CACHE_LENGTH, such as INSERTs with many rows of literals,
+# rarely repeat, so they aren't kept, which bounds the cache's memory.
+fingerprintCache = LRUCache(4096)
+FINGERPRINT_CACHE_LENGTH = 2048
+
+def fingerprintToken(match):
+    if match.group('literal') is not None:
+        return '?'
+    elif match.group('space') is not None:
+        return ' '
+    return match.group(0)
+
+def fingerprint(query):
+    """
+    **
+    * Normalize query into a fingerprint, shared by every run of the same
+    * statement. Literals and placeholders (%s, %(name)s, ?, :name, $1) are
+    * replaced by ?, lists of them are collapsed to (...), and whitespace
+    * is collapsed to single spaces. Quoted identifiers are left as is.
+    *
+    * Examples:
+    *
+    *   fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'x'")
+    *   # SELECT * FROM t WHERE id IN (...) AND name = ?
+    *
+    *   fingerprint('INSERT INTO t (a, b) VALUES (?, ?), (?, ?)')
+    *   # INSERT INTO t (a, b) VALUES (...)
+    *
+    * @param    query   str
+    * @return   str
+    **
+    """
+    if query is None:
+        return None
+
+    cached = len(query) <= FINGERPRINT_CACHE_LENGTH
+    res = None
+    if cached:
+        res = fingerprintCache.get(query)
+    if res is None:
+        res = FINGERPRINT_TOKENS.sub(fingerprintToken, query).strip()
+        res = FINGERPRINT_LIST.sub('(...)', res)
+        res = FINGERPRINT_LISTS.sub('(...)', res)
+        if cached:
+            fingerprintCache.set(query, res)
+    return res
@@ -0,0 +1,403 @@
+import sys
+import json
+import math
+import time
+import atexit
+import random
+import threading
+from doze import *
+from doze.backend.generic.fingerprint import *
+
+# Query events, see QueryHooks
+HOOK_BEFORE_COMPILE = 'beforeCompile'
+HOOK_AFTER_COMPILE = 'afterCompile'
+HOOK_BEFORE_EXECUTE = 'beforeExecute'
+HOOK_AFTER_EXECUTE = 'afterExecute'
+HOOK_FETCH_BATCH = 'fetchBatch'
+HOOK_ERROR = 'error'
+
+HOOK_EVENTS = [
+    HOOK_BEFORE_COMPILE,
+    HOOK_AFTER_COMPILE,
+    HOOK_BEFORE_EXECUTE,
+    HOOK_AFTER_EXECUTE,
+    HOOK_FETCH_BATCH,
+    HOOK_ERROR]
+
+# Highest resolution wall clock available
+timer = getattr(time, 'perf_counter', time.time)
+
+def estimateBytes(rows):
+    """
+    Returns rough size of rows in bytes: the length of strings, and 8 bytes
+    for anything else which isn't NULL.
+    """
+    size = 0
+    for row in rows:
+        for value in row:
+            if value is None:
+                continue
+            elif isinstance(value, (basestring, buffer, bytearray)):
+                size += len(value)
+            else:
+                size += 8
+    return size
+
+class QueryHooks(object):
+    """
+    **
+    * Registry of callbacks, fired as a Builder runs a query. Callbacks are
+    * called as func(event, trace), where event is one of HOOK_EVENTS, and
+    * trace is the QueryTrace of the query:
+    *
+    *   beforeCompile / afterCompile - Around Builder.sql(). trace.query and
+    *       trace.escape are set after compiling.
+    *   beforeExecute / afterExecute - Around cursor.execute(), once per
+    *       statement. trace.rowcount is set after executing.
+    *   fetchBatch - After each batch of rows is fetched from the cursor.
+    *       trace.batchRows and trace.batchBytes hold its size.
+    *   error - When compiling, executing or fetching raises. trace.error
+    *       holds the exception, which is raised again afterwards.
+    *
+    * trace.elapsed holds the seconds spent in the step which just finished.
+    * Exceptions raised by callbacks are not caught.
+    *
+    * Examples:
+    *
+    *   hooks = QueryHooks()
+    *   hooks.add(lambda event, trace: log(trace.query), [HOOK_BEFORE_EXECUTE])
+    *   builder.setHooks(hooks)
+    *
+    *   # For all builders
+    *   generic.Builder.hooks = hooks
+    **
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hooks = dict([(i, []) for i in HOOK_EVENTS])
+
+    def __len__(self):
+        return sum([len(i) for i in self.hooks.values()])
+
+    def add(self, func, events = None):
+        """ Add callback for events, or for all events when None """
+        if events is None:
+            events = HOOK_EVENTS
+
+        self.lock.acquire()
+        try:
+            for event in events:
+                if event not in self.hooks:
+                    raise DozeError('Unknown hook event: ' + str(event))
+
+                # Copied on write, so fire() can iterate without the lock
+                self.hooks[event] = self.hooks[event] + [func]
+        finally:
+            self.lock.release()
+        return func
+
+    def remove(self, func):
+        """ Remove callback from all events """
+        self.lock.acquire()
+        try:
+            for event, funcs in self.hooks.items():
+                self.hooks[event] = [i for i in funcs if i is not func]
+        finally:
+            self.lock.release()
+
+    def fire(self, event, trace):
+        for func in self.hooks[event]:
+            func(event, trace)
+
+class QueryTrace(object):
+    """
+    **
+    * Timing and size of one query run through a Builder, passed to each
+    * QueryHooks callback. Times are in seconds, and accumulate over the
+    * statements of batched INSERTs, and over the batches fetched.
+    **
+    """
+
+    def __init__(self, builder, hooks):
+        self.builder = builder
+        self.hooks = hooks
+        self.query = None
+        self.escape = None
+        self.error = None
+        self.elapsed = 0.0
+        self.compileTime = 0.0
+        self.executeTime = 0.0
+        self.fetchTime = 0.0
+        self.statements = 0
+        self.rowcount = -1
+        self.rows = 0
+        self.bytes = 0
+        self.batchRows = 0
+        self.batchBytes = 0
+        self.startTime = None
+        self.queryFingerprint = None
+
+    def fire(self, event):
+        self.hooks.fire(event, self)
+
+    def fail(self, ex):
+        """ Record exception, and fire the error hooks """
+        self.error = ex
+        self.fire(HOOK_ERROR)
+
+    def compile(self, func):
+        """ Call func, which returns (query, escape), and time it """
+        self.fire(HOOK_BEFORE_COMPILE)
+        start = timer()
+        try:
+            query, escape = func()
+        except Exception, ex:
+            self.fail(ex)
+            raise
+        self.compiled(query, escape, timer() - start)
+        return (query, escape)
+
+    def compiled(self, query, escape, elapsed):
+        """ Record statement compiled in elapsed seconds """
+        self.query = query
+        self.queryFingerprint = None
+        self.escape = escape
+        self.elapsed = elapsed
+        self.compileTime += elapsed
+        self.fire(HOOK_AFTER_COMPILE)
+
+    def compileEach(self, statements):
+        """
+        Generator, which yields (query, escape) from statements, timing
+        each. Statements are produced lazily, so both compile hooks fire
+        once a statement has been produced.
+        """
+        statements = iter(statements)
+        while True:
+            start = timer()
+            try:
+                query, escape = statements.next()
+            except StopIteration:
+                return
+            except Exception, ex:
+                self.fail(ex)
+                raise
+
+            elapsed = timer() - start
+            self.fire(HOOK_BEFORE_COMPILE)
+            self.compiled(query, escape, elapsed)
+            yield (query, escape)
+
+    def fingerprint(self):
+        """
+        Returns fingerprint() of self.query, computed once per statement,
+        so hooks called for each batch fetched don't normalize it again.
+        """
+        if self.queryFingerprint is None:
+            self.queryFingerprint = fingerprint(self.query)
+        return self.queryFingerprint
+
+    def execute(self, cursor, query, escape, many = False):
+        """ Execute statement on cursor, with cursor.executemany() if many """
+        self.started()
+        try:
+            if many:
+                cursor.executemany(query, escape)
+            else:
+                cursor.execute(query, escape)
+        except Exception, ex:
+            self.fail(ex)
+            raise
+        self.executed(cursor.rowcount)
+
+    def started(self):
+        """
+        Fire the before execute hooks, and start timing a statement. For
+        statements which don't complete in a call to execute(), such as on
+        asynchronous connections, or COPY.
+        """
+        self.fire(HOOK_BEFORE_EXECUTE)
+        self.startTime = timer()
+
+    def executed(self, rowcount):
+        """ Record statement completed since started() """
+        self.elapsed = timer() - self.startTime
+        self.executeTime += self.elapsed
+        self.statements += 1
+        self.rowcount = rowcount
+        self.fire(HOOK_AFTER_EXECUTE)
+
+    def fetch(self, func):
+        """ Call func, which returns a list of rows, and time it """
+        start = timer()
+        try:
+            rows = func()
+        except Exception, ex:
+            self.fail(ex)
+            raise
+
+        self.elapsed = timer() - start
+        self.fetchTime += self.elapsed
+        self.batchRows = len(rows)
+        self.batchBytes = estimateBytes(rows)
+        self.rows += self.batchRows
+        self.bytes += self.batchBytes
+        self.fire(HOOK_FETCH_BATCH)
+        return rows
+
+# Key in QueryStats, for queries past QueryStats.maxEntries fingerprints
+OTHER_QUERIES = '(other)'
+
+class QueryStats(object):
+    """
+    **
+    * Built-in QueryHooks callback, and client-side equivalent of
+    * pg_stat_statements. Totals compile (Doze), execute and fetch
+    * (database) time, rows and bytes returned, and errors per query
+    * fingerprint, so runs of the same statement with different values share
+    * an entry. Execute latency is also tracked per statement, as min, max
+    * and 95th percentile, the latter from a sample of at most sampleSize
+    * latencies per fingerprint. At most maxEntries fingerprints are kept,
+    * after which queries with new fingerprints are totalled under
+    * OTHER_QUERIES, so memory use is bounded even when queries embed
+    * values which can't be normalized.
+    *
+    * Examples:
+    *
+    *   stats = QueryStats()
+    *   stats.dumpAtExit('/var/log/app/query-stats.json')
+    *   generic.Builder.hooks = QueryHooks()
+    *   generic.Builder.hooks.add(stats)
+    *   ...
+    *   print json.dumps(stats.snapshot(), indent=4)
+    **
+    """
+
+    # Maximum number of latencies sampled per fingerprint, for p95Time
+    sampleSize = 1000
+
+    # Maximum number of fingerprints kept, see OTHER_QUERIES
+    maxEntries = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.samples = {}
+        self.random = random.Random()
+
+    def newEntry(self):
+        return {
+            'count': 0,
+            'errors': 0,
+            'compileTime': 0.0,
+            'executeTime': 0.0,
+            'fetchTime': 0.0,
+            'minTime': None,
+            'maxTime': None,
+            'rows': 0,
+            'bytes': 0}
+
+    def fingerprint(self, trace):
+        """ Returns key for trace's query """
+        return trace.fingerprint()
+
+    def sample(self, key, entry, elapsed):
+        """ Add latency to the sample for key (reservoir sampling) """
+        samples = self.samples.setdefault(key, [])
+        if len(samples) < self.sampleSize:
+            samples.append(elapsed)
+        else:
+            i = self.random.randint(0, entry['count'] - 1)
+            if i < self.sampleSize:
+                samples[i] = elapsed
+
+    def __call__(self, event, trace):
+        if event == HOOK_BEFORE_COMPILE or event == HOOK_BEFORE_EXECUTE:
+            return
+
+        key = self.fingerprint(trace)
+
+        self.lock.acquire()
+        try:
+            entry = self.stats.get(key)
+            if entry is None and len(self.stats) >= self.maxEntries:
+                key = OTHER_QUERIES
+                entry = self.stats.get(key)
+            if entry is None:
+                entry = self.newEntry()
+                self.stats[key] = entry
+
+            if event == HOOK_AFTER_COMPILE:
+                entry['compileTime'] += trace.elapsed
+            elif event == HOOK_AFTER_EXECUTE:
+                elapsed = trace.elapsed
+                entry['count'] += 1
+                entry['executeTime'] += elapsed
+                if entry['minTime'] is None or elapsed < entry['minTime']:
+                    entry['minTime'] = elapsed
+                if entry['maxTime'] is None or elapsed > entry['maxTime']:
+                    entry['maxTime'] = elapsed
+                self.sample(key, entry, elapsed)
+            elif event == HOOK_FETCH_BATCH:
+                entry['fetchTime'] += trace.elapsed
+                entry['rows'] += trace.batchRows
+                entry['bytes'] += trace.batchBytes
+            elif event == HOOK_ERROR:
+                entry['errors'] += 1
+        finally:
+            self.lock.release()
+
+    def snapshot(self):
+        """
+        Returns copy of the stats, as {fingerprint: {count, errors,
+        compileTime, executeTime, fetchTime, minTime, maxTime, p95Time, rows,
+        bytes}}, ready for json.dumps(). Times are in seconds.
+        """
+        self.lock.acquire()
+        try:
+            res = {}
+            for key, entry in self.stats.items():
+                entry = dict(entry)
+                entry['p95Time'] = None
+
+                samples = sorted(self.samples.get(key, []))
+                if len(samples) > 0:
+                    index = int(math.ceil(len(samples) * 0.95)) - 1
+                    entry['p95Time'] = samples[index]
+                res[key] = entry
+            return res
+        finally:
+            self.lock.release()
+
+    def dump(self, fileobj):
+        """ Write snapshot() to fileobj, as JSON """
+        json.dump(self.snapshot(), fileobj, indent=4, sort_keys=True)
+        fileobj.write('\n')
+
+    def dumpAtExit(self, filename = None):
+        """
+        Write snapshot() as JSON when the process exits, to filename, or to
+        stderr when None.
+        """
+        def dump():
+            if filename is None:
+                self.dump(sys.stderr)
+                return
+
+            fileobj = open(filename, 'w')
+            try:
+                self.dump(fileobj)
+            finally:
+                fileobj.close()
+
+        atexit.register(dump)
+
+    def reset(self):
+        """ Clear stats """
+        self.lock.acquire()
+        try:
+            self.stats = {}
+            self.samples = {}
+        finally:
+            self.lock.release()
@@ -10,25 +10,34 @@ class ObjectList(object):
     ObjectList class. It provides a friendly interface for accessing
     attributes, so for instance, you can access data as:
     database.tables.my_table.my_column.type
+    
+    Objects are kept in insertion order, with a dictionary index of names
+    to positions, for constant time lookups. An ObjectList can be built in
+    one go, from an iterable of (name, object) pairs.
     """
 
-    def __init__(self):
+    def __init__(self, items = None):
         self.__dict__['objects'] = []
         self.__dict__['keys'] = []
+        self.__dict__['index'] = {}
+        
+        if items is not None:
+            self.extend(items)
     
     def __getattr__(self, name):
         try:
-            idx = self.__dict__['keys'].index(name)
+            idx = self.__dict__['index'][name]
             return self.__dict__['objects'][idx]
-        except:
+        except KeyError:
             raise AttributeError('"%s" has no attribute named "%s"'
                 % (self.__class__.__name__, name))
     
     def __setattr__(self, name, value):
-        if name in self.__dict__['keys']:
-            idx = self.__dict__['keys'].index(name)
-            self.__dict__['objects'][idx] = value
+        index = self.__dict__['index']
+        if name in index:
+            self.__dict__['objects'][index[name]] = value
         else:
+            index[name] = len(self.__dict__['keys'])
             self.__dict__['keys'].append(name)
             self.__dict__['objects'].append(value)
     
@@ -38,6 +47,12 @@ class ObjectList(object):
                 self.__dict__['keys'][i],
                 self.__dict__['objects'][i])
     
+    def __len__(self):
+        return len(self.__dict__['keys'])
+    
+    def __contains__(self, name):
+        return name in self.__dict__['index']
+    
     def attributes(self):
         """ Returns iterator of accessible attributes """
     
@@ -48,6 +63,12 @@ class ObjectList(object):
     
     def setattr(self, name, value):
         self.__setattr__(name, value)
+    
+    def extend(self, items):
+        """ Set objects from an iterable of (name, object) pairs """
+        
+        for name, value in items:
+            self.__setattr__(name, value)
 
 class Relation(object):
     """ Base class for all Relations. """
@@ -64,12 +85,38 @@ class Relation(object):
         self.__dict__['__attributes'] = {}
     
     def __getattr__(self, name):
-        if name in self.__dict__['__attributes']:
-            func = getattr(self, self.__dict__['__attributes'][name])
+        # __attributes may be missing while unpickling
+        attributes = self.__dict__.get('__attributes', {})
+        if name in attributes:
+            func = getattr(self, attributes[name])
             return func()
     
         raise AttributeError('"%s" has no attribute named "%s"'
             % (self.__class__.__name__, name))
+    
+    def __getstate__(self):
+        # Connections can't be pickled, see set_connection()
+        state = self.__dict__.copy()
+        state.pop('conn', None)
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+    
+    def set_connection(self, conn):
+        """
+        Set connection on relation, and on the relations loaded under it,
+        such as after the tree has been unpickled.
+        """
+        
+        self.__dict__['conn'] = conn
+        for k, v in self.__dict__.items():
+            if isinstance(v, Relation):
+                v.set_connection(conn)
+            elif isinstance(v, ObjectList):
+                for name, obj in v:
+                    if isinstance(obj, Relation):
+                        obj.set_connection(conn)
 
     def __getitem__(self, key, value):
         if key in self.__dict__:
@@ -0,0 +1,194 @@
+import threading
+from doze import *
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+def splitRange(low, high, count):
+    """
+    **
+    * Split the closed range [low, high] into at most count partitions, and
+    * return their edges, as a list of count + 1 values or less. Integers are
+    * split on integer edges, and duplicate edges are dropped, so small
+    * ranges give fewer partitions. Other types only need to support
+    * subtraction, and division of the difference, such as float, Decimal
+    * and datetime.
+    *
+    * @param    low     mixed
+    * @param    high    mixed
+    * @param    count   int
+    * @return   list
+    **
+    """
+    if count < 1:
+        raise ValueError('Invalid number of partitions: ' + str(count))
+
+    try:
+        span = high - low
+        if isinstance(low, (int, long)) and isinstance(high, (int, long)):
+            edges = [low + span * i // count for i in range(0, count)]
+        else:
+            edges = [low + span * i / count for i in range(0, count)]
+    except TypeError:
+        raise NotSupported('Can\'t split key range of type '
+            + type(low).__name__)
+
+    res = []
+    for edge in edges + [high]:
+        if len(res) == 0 or edge > res[-1]:
+            res.append(edge)
+
+    # A single value is still one partition
+    if len(res) == 1:
+        res.append(high)
+    return res
+
+class PartitionCursor(object):
+    """
+    **
+    * Read-only, DB-API style cursor over rows streamed from several
+    * partitions of a query, each run by a worker thread on its own
+    * connection. Workers hand batches of rows to the cursor through bounded
+    * queues, so memory use doesn't depend on the size of the result, and
+    * block while the consumer falls behind.
+    *
+    * run(partition, emit) is called by a worker for each partition. It runs
+    * the partition's query, and calls emit(description, rows) for each
+    * batch fetched, including the final, empty batch. emit() returns False
+    * once the cursor has been closed, in which case run() should stop.
+    *
+    * When ordered is True, rows are returned partition by partition, in the
+    * order partitions were given. Otherwise, batches are returned as soon
+    * as any worker has fetched them.
+    **
+    """
+
+    def __init__(self, partitions, run, workers = 4, ordered = False,
+                 queueSize = 8):
+        self.partitions = list(partitions)
+        self.run = run
+        self.ordered = ordered
+        self.descr = None
+        self.buffer = []
+        self.rowcount = -1
+        self.rownumber = 0
+        self.arraysize = 1
+        self.closed = False
+        self.connection = None
+
+        # Partitions done, and the next partition to hand out to a worker
+        self.done = 0
+        self.next = 0
+        self.lock = threading.Lock()
+
+        if ordered:
+            self.queues = [queue.Queue(queueSize) for i in self.partitions]
+        else:
+            self.queues = [queue.Queue(queueSize)] * len(self.partitions)
+
+        self.workers = []
+        for i in range(0, min(workers, len(self.partitions))):
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def put(self, index, message):
+        """
+        Put message on the queue for partition index, waiting while it's
+        full. Returns False when the cursor has been closed.
+        """
+        while not self.closed:
+            try:
+                self.queues[index].put(message, True, 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def work(self):
+        """ Worker thread. Runs partitions, in order, until none are left """
+        while not self.closed:
+            self.lock.acquire()
+            try:
+                index = self.next
+                self.next += 1
+            finally:
+                self.lock.release()
+
+            if index >= len(self.partitions):
+                return
+
+            emit = lambda description, rows: self.put(index,
+                ('rows', description, rows))
+            try:
+                self.run(self.partitions[index], emit)
+            except Exception, ex:
+                self.put(index, ('error', None, ex))
+            else:
+                self.put(index, ('done', None, None))
+
+    def read(self):
+        """
+        Read one message from the workers, adding rows to self.buffer.
+        Returns False once all partitions are done.
+        """
+        if self.closed or self.done >= len(self.partitions):
+            return False
+
+        kind, description, data = self.queues[self.done].get()
+        if kind == 'rows':
+            if self.descr is None:
+                self.descr = description
+            self.buffer.extend(data)
+        elif kind == 'done':
+            self.done += 1
+        else:
+            self.close()
+            raise data
+        return True
+
+    @property
+    def description(self):
+        while self.descr is None and self.read():
+            pass
+        return self.descr
+
+    def fetchmany(self, size = None):
+        if size is None:
+            size = self.arraysize
+
+        while len(self.buffer) < size and self.read():
+            pass
+
+        rows = self.buffer[0:size]
+        del self.buffer[0:size]
+        self.rownumber += len(rows)
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        if len(rows) == 0:
+            return None
+        return rows[0]
+
+    def fetchall(self):
+        rows = []
+        while True:
+            batch = self.fetchmany(10000)
+            if len(batch) == 0:
+                return rows
+            rows.extend(batch)
+
+    def close(self):
+        """
+        Stop workers, and wait for them to close their results, so their
+        connections are back in the pool.
+        """
+        self.closed = True
+        self.buffer = []
+        for worker in self.workers:
+            if worker is not threading.current_thread():
+                worker.join()
@@ -340,3 +340,61 @@ class Where(BaseClause):
             sql.append(comp)
         
         return (' '.join(sql), escape)
+
+class WhereGroup(BaseClause):
+    """
+    **
+    * Parenthesized group of Where clauses, joined by AND or OR, for
+    * conditions which can't be expressed by chaining a single Where, such
+    * as "a > 1 OR (a = 1 AND b > 2)". Groups may be nested, and can be
+    * passed to Builder.where() like a Where.
+    *
+    * Examples:
+    *
+    * group = WhereGroup([
+    *     Where('a').gt(1),
+    *     Where('a').equals(1).and_('b').gt(2)], 'or_')
+    * (where, escape) = group.sql()
+    **
+    """
+    
+    def __init__(self, wheres, cond = 'and_'):
+        super(WhereGroup, self).__init__()
+        
+        if cond not in Where.condOperators:
+            raise DozeError('Invalid conditional: ' + str(cond))
+        
+        self.wheres = list(wheres)
+        self.cond = cond
+        self.tableContext = None
+    
+    def setTableContext(self, ctx):
+        """ Set the TableContext, on the group and its clauses """
+        self.tableContext = ctx
+        for i in self.wheres:
+            if isinstance(i, BaseClause):
+                i.setTableContext(ctx)
+    
+    def preProcessSql(self):
+        for i in self.wheres:
+            if isinstance(i, BaseClause):
+                i.preProcessSql()
+    
+    def sql(self):
+        """ Build SQL and return (query, escape) """
+        
+        sql = []
+        escape = []
+        for i in self.wheres:
+            tmpquery, tmpescape = i.sql()
+            if len(self.wheres) > 1 and not isinstance(i, WhereGroup):
+                tmpquery = '(' + tmpquery + ')'
+            sql.append(tmpquery)
+            escape.extend(tmpescape)
+        
+        if self.cond == 'or_':
+            op = ' OR '
+        else:
+            op = ' AND '
+        
+        return ('(' + op.join(sql) + ')', escape)
@@ -53,6 +53,25 @@ def connect(host='',
         port=port,
         unix_socket=unix_socket)
 
+def pool(minsize=1,
+         maxsize=10,
+         idle=300,
+         timeout=None,
+         **kwargs):
+    
+    """
+    Returns a ConnectionPool of connections opened with connect(**kwargs),
+    health-checked with connection_is_open() and connection_is_ready().
+    """
+    
+    return ConnectionPool(lambda: connect(**kwargs),
+        minsize=minsize,
+        maxsize=maxsize,
+        idle=idle,
+        timeout=timeout,
+        isOpen=connection_is_open,
+        isReady=connection_is_ready)
+
 class BaseClause(generic.BaseClause):
     """
     MySQL specific implementation of the BaseClause class. Currently,
@@ -78,6 +97,14 @@ class BaseClause(generic.BaseClause):
     # Search quotes
     searchQuotes = '\'`"'
     
+    # MySQLdb interpolates values into the statement client-side, so the
+    # prepared statement limit on parameters doesn't apply. Statements are
+    # bounded by the server's max_allowed_packet instead, which defaults to
+    # 4MB (64MB from MySQL 8.0). Batches are kept under the 1MB default of
+    # older servers, so they fit either way. Raise to match the server.
+    maxParameters = None
+    maxStatementBytes = 1048576
+    
     def quoteValue(self, value):
         """ Return Quoted Value """
         if type(value) == str:
@@ -86,19 +113,33 @@ class BaseClause(generic.BaseClause):
         return value
 
 class Where(generic.Where, BaseClause): pass
+class WhereGroup(generic.WhereGroup, BaseClause): pass
 class Join(generic.Join, BaseClause): pass
 
 class QueryResult(generic.QueryResult):
-    def initCursorDescr(self):
-        """ Init cursor description, for MySQL. """
-        for i in self.cursor.description:
-            self.labels.append(i[0])
-        self.cursorDescrInit = True
+    # FIELD_TYPE => array typecode, for asColumns(). Unsigned values that
+    # don't fit make the column fall back to a list.
+    columnTypes = {
+        1: 'h',                     # TINY
+        2: 'i',                     # SHORT
+        3: generic.ARRAY_INT64,     # LONG
+        4: 'd',                     # FLOAT
+        5: 'd',                     # DOUBLE
+        8: generic.ARRAY_INT64,     # LONGLONG
+        9: 'i',                     # INT24
+        13: 'h',                    # YEAR
+    }
 
 class Builder(generic.Builder, BaseClause):
     """
     MySQL specific implementation of the Builder class.
     """
+    
+    # Class used by asObject() to wrap cursors
+    queryResultClass = QueryResult
+    
+    # Class used to build conditions, such as by paginate()
+    whereClass = Where
 
     @ExceptionWrapper
     def with_(self, name, recursive=False):
@@ -119,31 +160,12 @@ class Builder(generic.Builder, BaseClause):
         if self.db == None:
             return None
         
-        query, escape = self.sql()
+        trace = self.startTrace()
+        query, escape = self.compileSql(trace)
         
         if server == True:
             cursor = self.db.cursor(MySQLdb.cursors.SSCursor)
         else:
             cursor = self.db.cursor()
-        cursor.execute(query, escape)
+        self.executeCursor(cursor, query, escape, trace)
         return cursor
-    
-    @ExceptionWrapper
-    def asObject(self, fetchall = False, server = False, destroy = True, fetch = dict):
-        """
-        **
-        * Execute query and return result object. If fetchall == True,
-        * cursor.fetchall() will be used instead of wrapping the cursor
-        * into an iterable object, and fetching as needed. If server == True,
-        * use a server-side cursor and wrap it in an object, so data can be
-        * downloaded as needed, instead of all at once.
-        *
-        * @param    fetchall    bool
-        * @param    server      bool
-        * @param    fetch       type, dict returns dictionaries, anything else
-        *                       returns tuples
-        * @return   QueryResult
-        **
-        """
-        cursor = self.cursor(server)
-        return QueryResult(cursor, destroy, fetch)
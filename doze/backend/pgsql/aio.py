@@ -0,0 +1,335 @@
+"""
+*
+* asyncio support for PostgreSQL, on top of psycopg2 asynchronous connections.
+*
+* Instead of busy-polling isReady(), the connection's socket is registered
+* with the event loop, and conn.poll() is called whenever it becomes readable
+* or writable. Methods return asyncio Futures.
+*
+* Doze runs on Python 2, which has no asyncio, so this module needs the
+* trollius backport, where coroutines wait on Futures with "yield From()":
+*
+*   @asyncio.coroutine
+*   def users():
+*       db = yield From(pgsql.connect_async(host='127.0.0.1'))
+*       result = yield From(pgsql.AsyncBuilder(db)\
+*           .select('*').from_('users').fetch())
+*       for row in result:
+*           print row
+*
+* Without asyncio or trollius, the module imports, but its functions raise
+* NotSupported. "await" and "async for" are Python 3 syntax, and can't be
+* used until Doze itself is ported.
+*
+"""
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+try:
+    StopAsyncIteration
+except NameError:
+    class StopAsyncIteration(Exception): pass
+
+from doze import *
+from pgsql import *
+
+def get_loop(loop = None):
+    """ Returns loop, or the current event loop when loop is None """
+    if asyncio is None:
+        raise NotSupported('asyncio is not available')
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    return loop
+
+def new_future(loop):
+    """ Returns a new, pending Future bound to loop """
+    if hasattr(loop, 'create_future'):
+        return loop.create_future()
+    return asyncio.Future(loop=loop)
+
+def wait_connection(conn, loop = None):
+    """
+    Returns a Future, which resolves to conn once conn.poll() returns
+    POLL_OK. While the connection is busy, its socket is watched with
+    loop.add_reader() / loop.add_writer(), as requested by poll().
+    """
+    loop = get_loop(loop)
+    future = new_future(loop)
+    fd = conn.fileno()
+
+    def callback():
+        loop.remove_reader(fd)
+        loop.remove_writer(fd)
+        if future.done():
+            return
+
+        try:
+            state = conn.poll()
+        except Exception, ex:
+            future.set_exception(ex)
+            return
+
+        if state == psycopg2.extensions.POLL_OK:
+            future.set_result(conn)
+        elif state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fd, callback)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(fd, callback)
+        else:
+            future.set_exception(DozeError('Unexpected poll() state: '
+                + str(state)))
+
+    callback()
+    return future
+
+def connect_async(host=None,
+                  user=None,
+                  password=None,
+                  database=None,
+                  port=5432,
+                  loop=None):
+    """
+    Open an asynchronous connection. Returns a Future, which resolves to
+    the connection once it's established.
+    """
+    if DRIVER_NAME != 'psycopg2':
+        raise NotSupported('Asynchronous connections require psycopg2')
+
+    # "async" is passed through a dictionary, since it's a reserved word
+    # in newer Python versions
+    conn = psycopg2.connect(
+        host=host,
+        user=user,
+        password=password,
+        database=database,
+        port=port,
+        **{'async': 1})
+
+    return wait_connection(conn, loop)
+
+class AsyncQueryResult(QueryResult):
+    """
+    Query result for asynchronous connections. Rows have already been
+    transferred by the time the result is returned, so iterating doesn't
+    block. Also implements the asynchronous iterator protocol, returning
+    Futures bound to loop, the event loop of the builder which ran the
+    query.
+    """
+
+    # Event loop for Futures returned by __anext__(), None for the current
+    loop = None
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = new_future(get_loop(self.loop))
+
+        try:
+            res = self.next()
+        except Exception, ex:
+            future.set_exception(ex)
+            return future
+
+        if res is None:
+            if self.destroy == True:
+                self.close()
+            future.set_exception(StopAsyncIteration())
+        else:
+            future.set_result(res)
+        return future
+
+class AsyncBuilder(Builder):
+    """
+    **
+    * Builder for psycopg2 asynchronous connections, driven by an asyncio
+    * event loop. Queries are compiled when fetch() / execute() is called,
+    * and sent once the connection is free, so several queries can be queued
+    * on one builder. To run queries concurrently, use one builder (and
+    * connection) per query.
+    *
+    * Examples:
+    *
+    *   futures = [AsyncBuilder(db).select('*').from_('users').fetch()
+    *       for db in connections]
+    *   results = yield From(asyncio.gather(*futures))
+    **
+    """
+
+    queryResultClass = AsyncQueryResult
+
+    def __init__(self, db = None, onError = None, loop = None):
+        super(AsyncBuilder, self).__init__(db, onError)
+        self.loop = loop
+        self.pending = None
+
+    def run(self, start, finish, trace = None):
+        """
+        **
+        * Queue a query on the connection. Once previously queued queries are
+        * done and the connection is ready, start() is called to send the
+        * query, and returns a cursor. Once the query completes, the returned
+        * Future resolves to finish(cursor). When trace is given, the execute
+        * hooks fire as the query is sent and completes, so execute time
+        * covers the round trip.
+        *
+        * @param    start   callable
+        * @param    finish  callable
+        * @param    trace   QueryTrace or None
+        * @return   Future
+        **
+        """
+        loop = get_loop(self.loop)
+        future = new_future(loop)
+        previous = self.pending
+        self.pending = future
+
+        def fail(ex):
+            if trace is not None:
+                trace.fail(ex)
+            if not future.done():
+                future.set_exception(ex)
+
+        def completed(waiter, cursor):
+            if waiter.cancelled():
+                future.cancel()
+            elif waiter.exception() is not None:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+                fail(waiter.exception())
+            elif not future.done():
+                try:
+                    if trace is not None:
+                        trace.executed(cursor.rowcount)
+                    future.set_result(finish(cursor))
+                except Exception, ex:
+                    fail(ex)
+
+        def ready(waiter):
+            if waiter.cancelled():
+                future.cancel()
+                return
+            elif waiter.exception() is not None:
+                fail(waiter.exception())
+                return
+
+            try:
+                if trace is not None:
+                    trace.started()
+                cursor = start()
+            except Exception, ex:
+                fail(ex)
+                return
+
+            wait_connection(self.db, loop).add_done_callback(
+                lambda waiter: completed(waiter, cursor))
+
+        def queued(_):
+            # A failed query doesn't fail the queries queued after it
+            wait_connection(self.db, loop).add_done_callback(ready)
+
+        if previous is None or previous.done():
+            queued(None)
+        else:
+            previous.add_done_callback(queued)
+
+        return future
+
+    def fetch(self, fetch = dict):
+        """
+        **
+        * Execute query, and return a Future, which resolves to an
+        * AsyncQueryResult once the query completes.
+        *
+        * @param    fetch   type, see Builder.asObject()
+        * @return   Future
+        **
+        """
+        if self.db == None:
+            return None
+
+        trace = self.startTrace()
+        query, escape = self.compileSql(trace)
+
+        def start():
+            cursor = self.db.cursor()
+            cursor.execute(query, escape)
+            return cursor
+
+        def finish(cursor):
+            result = self.queryResultClass(cursor, True, fetch)
+            result.loop = self.loop
+            result.trace = trace
+            return result
+
+        return self.run(start, finish, trace)
+
+    def execute(self, server = False):
+        """
+        **
+        * Execute query, and return a Future, which resolves to the number of
+        * rows affected. Batched INSERTs are sent one statement at a time.
+        *
+        * @return   Future
+        **
+        """
+        if self.db == None:
+            return None
+
+        trace = self.startTrace()
+        if self.insertIsBatched():
+            statements = self.insertBatches()
+            if trace is not None:
+                statements = trace.compileEach(statements)
+            statements = list(statements)
+        else:
+            statements = [self.compileSql(trace)]
+
+        loop = get_loop(self.loop)
+        total = new_future(loop)
+        futures = []
+
+        def finish(cursor):
+            rows = cursor.rowcount
+            cursor.close()
+            return rows
+
+        for query, escape in statements:
+            # Asynchronous connections are in autocommit mode, so stop at
+            # the first failed statement
+            def start(query = query, escape = escape, index = len(futures)):
+                if index > 0 and futures[index - 1].exception() is not None:
+                    raise DozeError('Previous statement failed')
+
+                cursor = self.db.cursor()
+                cursor.execute(query, escape)
+                return cursor
+            futures.append(self.run(start, finish, trace))
+
+        if len(futures) == 0:
+            total.set_result(0)
+            return total
+
+        def done(_):
+            if total.done() or not all([f.done() for f in futures]):
+                return
+            for f in futures:
+                if f.cancelled():
+                    total.cancel()
+                    return
+                elif f.exception() is not None:
+                    total.set_exception(f.exception())
+                    return
+            total.set_result(sum([f.result() for f in futures]))
+
+        for f in futures:
+            f.add_done_callback(done)
+        return total
@@ -0,0 +1,157 @@
+"""
+*
+* COPY encoding, for bulk loading data into PostgreSQL.
+*
+"""
+
+import binascii
+import datetime
+import decimal
+
+# COPY formats
+COPY_TEXT = 'text'
+COPY_CSV = 'csv'
+
+# Types written as bytea, in hex format
+BINARY_TYPES = (buffer, bytearray, memoryview)
+
+def copy_text_value(value):
+    """
+    Encode a single value for COPY text format. NULL is written as \\N, and
+    backslashes, tabs, newlines and carriage returns are escaped. Binary
+    values are written as bytea hex, with the backslash escaped.
+    """
+
+    if value is None:
+        return '\\N'
+    elif value is True:
+        return 't'
+    elif value is False:
+        return 'f'
+    elif isinstance(value, BINARY_TYPES):
+        return '\\\\x' + binascii.hexlify(value)
+    elif isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif isinstance(value, float):
+        value = repr(value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    elif not isinstance(value, str):
+        return str(value)
+
+    if ('\\' in value or '\t' in value
+    or '\n' in value or '\r' in value):
+        value = (value.replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+    return value
+
+def copy_csv_value(value):
+    """
+    Encode a single value for COPY CSV format. NULL is written as an
+    unquoted empty string, while empty strings are quoted. Binary values are
+    written as bytea hex.
+    """
+
+    if value is None:
+        return ''
+    elif value is True:
+        return 't'
+    elif value is False:
+        return 'f'
+    elif isinstance(value, BINARY_TYPES):
+        return '\\x' + binascii.hexlify(value)
+    elif isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif isinstance(value, float):
+        return repr(value)
+    elif isinstance(value, (int, long, decimal.Decimal)):
+        return str(value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    elif not isinstance(value, str):
+        value = str(value)
+
+    if (value == '' or value == '\\.' or ',' in value or '"' in value
+    or '\n' in value or '\r' in value):
+        value = '"' + value.replace('"', '""') + '"'
+
+    return value
+
+class CopyStream(object):
+    """
+    **
+    * Read-only, file-like object which encodes rows into COPY data as it
+    * is read, so rows are streamed into COPY ... FROM STDIN without
+    * materializing the whole dataset.
+    *
+    * Rows may be tuples / lists, or dictionaries. Dictionary rows are
+    * encoded in the order of columns.
+    *
+    * Examples:
+    *
+    *   stream = CopyStream([(1, 'a'), (2, 'b')])
+    *   cursor.copy_expert('COPY mytable FROM STDIN', stream)
+    **
+    """
+
+    def __init__(self, rows, columns = None, format = COPY_TEXT):
+        if format == COPY_TEXT:
+            self.encode = copy_text_value
+            self.delimiter = '\t'
+        elif format == COPY_CSV:
+            self.encode = copy_csv_value
+            self.delimiter = ','
+        else:
+            raise ValueError('Invalid COPY format: ' + str(format))
+
+        self.rows = iter(rows)
+        self.columns = columns
+        self.format = format
+        self.rowcount = 0
+        self.buffer = ''
+
+    def encodeRow(self, row):
+        """ Encode row, and return line of COPY data """
+
+        encode = self.encode
+        if isinstance(row, dict):
+            row = [row[k] for k in self.columns]
+
+        return self.delimiter.join([encode(v) for v in row]) + '\n'
+
+    def readline(self, size = -1):
+        """ Returns next line of COPY data, or an empty string when done """
+
+        if len(self.buffer) > 0:
+            line, self.buffer = self.buffer, ''
+            return line
+
+        try:
+            row = self.rows.next()
+        except StopIteration:
+            return ''
+
+        self.rowcount += 1
+        return self.encodeRow(row)
+
+    def read(self, size = -1):
+        """ Returns up to size bytes of COPY data, or all when size < 0 """
+
+        data = []
+        length = 0
+
+        while size < 0 or length < size:
+            line = self.readline()
+            if len(line) == 0:
+                break
+            data.append(line)
+            length += len(line)
+
+        data = ''.join(data)
+        if size >= 0 and len(data) > size:
+            data, self.buffer = data[:size], data[size:]
+
+        return data
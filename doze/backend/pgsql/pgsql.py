@@ -7,9 +7,13 @@ except ImportError:
     DRIVER_NAME = 'psycopg'
 
 import psycopg2.extensions
-import random
+import os
+import uuid
+import threading
+import itertools
 from doze import *
 import doze.backend.generic as generic
+from bulk import *
 
 def connection_is_open(conn):
     """
@@ -57,6 +61,25 @@ def connect(host=None,
         database=database,
         port=port)
 
+def pool(minsize=1,
+         maxsize=10,
+         idle=300,
+         timeout=None,
+         **kwargs):
+    
+    """
+    Returns a ConnectionPool of connections opened with connect(**kwargs),
+    health-checked with connection_is_open() and connection_is_ready().
+    """
+    
+    return ConnectionPool(lambda: connect(**kwargs),
+        minsize=minsize,
+        maxsize=maxsize,
+        idle=idle,
+        timeout=timeout,
+        isOpen=connection_is_open,
+        isReady=connection_is_ready)
+
 class BaseClause(generic.BaseClause):
     """
     PostgreSQL specific implementation of the BaseClause class. Currently,
@@ -90,21 +113,80 @@ class BaseClause(generic.BaseClause):
     
     # Search quotes
     searchQuotes = '\'`'
+    
+    # psycopg2 interpolates values into the statement client-side, so the
+    # 65535 parameter limit of the bind message doesn't apply. The server
+    # accepts statements up to 1GB, but the whole statement is built in
+    # memory on both ends, so batches are kept to 16MB instead.
+    maxParameters = None
+    maxStatementBytes = 16777216
 
     def quoteValue(self, value):
         """ Return Quoted Value """
         return psycopg2.extensions.adapt(value).getquoted()
 
 class Where(generic.Where, BaseClause): pass
+class WhereGroup(generic.WhereGroup, BaseClause): pass
 class Join(generic.Join, BaseClause): pass
 
+class CursorNames(object):
+    """
+    **
+    * Generates server-side cursor names locally, from a token unique to the
+    * process (pid plus a random uuid), and a counter, so they never collide
+    * and need no round trip to pg_cursors. Nothing is kept per connection,
+    * so names don't need releasing, and there's no state to leak on
+    * long-lived pooled connections. Names given explicitly are passed to
+    * the server as is, which reports a clash with a cursor still open.
+    **
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.token = None
+        self.counter = 0
+    
+    def getToken(self):
+        """ Returns the process token, regenerated after a fork. """
+        pid = os.getpid()
+        if self.pid != pid:
+            self.pid = pid
+            self.token = '%d_%s' % (pid, uuid.uuid4().hex[:8])
+        return self.token
+    
+    def next(self):
+        """ Returns a new, unique cursor name """
+        with self.lock:
+            self.counter += 1
+            return 'doze_%s_%d' % (self.getToken(), self.counter)
+
 class QueryResult(generic.QueryResult):
+    # Type OID => array typecode, for asColumns()
+    columnTypes = {
+        16: 'B',                    # bool
+        20: generic.ARRAY_INT64,    # int8
+        21: 'h',                    # int2
+        23: 'i',                    # int4
+        700: 'f',                   # float4
+        701: 'd',                   # float8
+    }
+    
     def isReady(self):
         if self.cursor is None:
             return False
         return connection_is_ready(self.cursor.connection)
 
 class Builder(generic.Builder, BaseClause):
+    # Class used by asObject() to wrap cursors
+    queryResultClass = QueryResult
+    
+    # Class used to build conditions, such as by paginate()
+    whereClass = Where
+    
+    # Shared generator of server-side cursor names
+    cursorNames = CursorNames()
+    
     def __init__(self, db = None, onError = None):
         super(Builder, self).__init__(db, onError)
 
@@ -115,7 +197,7 @@ class Builder(generic.Builder, BaseClause):
         * Execute query and return cursor. If server == True, return a
         * server-side cursor.
         *
-        * @param    server  bool or str. If server is true, a random cursor
+        * @param    server  bool or str. If server is true, a unique cursor
         *                   name is generated. If its a string, the string
         *                   is used as the cursor name.
         * @return   object
@@ -124,66 +206,186 @@ class Builder(generic.Builder, BaseClause):
         if self.db == None:
             return None
         
-        query, escape = self.sql()
+        trace = self.startTrace()
+        query, escape = self.compileSql(trace)
         
-        if type(server) == str and len(server) > 0:
-            # Create a cursor with "server" as name
-            cursor = self.db.cursor(server)
-        elif server == True:
+        if (type(server) == str and len(server) > 0) or server == True:
             # For PostgreSQL, you have to create a named cursor in order for it
-            # to be server-side. So this next block attempts to generate a random
-            # number between 100 and 1,000,000, to use as a cursor name. It will
-            # attempt 20 tries before raising an error.
-        
-            def getRandNum():
-                return random.randint(100, 1000000)
-        
-            tmpcursor = self.db.cursor()
-            rand = getRandNum()
-            max = 20
-            tries = 1
-            
-            while True:
-                cursorName = 'doze_cursor_' + str(rand)
-                tmpcursor.execute('SELECT name FROM pg_catalog.pg_cursors WHERE name = %s',
-                    [cursorName])
-                
-                if tmpcursor.fetchone() == None:
-                    break
-                elif tries >= max:
-                    raise DozeError('Unable to generate unique cursor name.'\
-                        + ' Max tries exhausted (' + str(max) + ')')
-                
-                rand = getRandNum()
-                tries += 1
+            # to be server-side. Names are generated locally, see
+            # CursorNames.
+            if type(server) == str:
+                name = server
+            else:
+                name = self.cursorNames.next()
             
-            tmpcursor.close()
-            cursor = self.db.cursor(cursorName)
+            cursor = self.db.cursor(name)
         else:
             cursor = self.db.cursor()
         
-        cursor.execute(query, escape)
+        self.executeCursor(cursor, query, escape, trace)
         return cursor
     
+    def initArraysize(self, cursor, arraysize):
+        """
+        Set arraysize on cursor, and itersize for named (server-side) cursors,
+        so iterating over the cursor fetches the same number of rows per
+        round trip.
+        """
+        if cursor is not None and arraysize:
+            cursor.arraysize = arraysize
+            if getattr(cursor, 'name', None):
+                cursor.itersize = arraysize
+    
+    def quoteTable(self, table):
+        """ Quote table name, which may be qualified with a schema. """
+        
+        if self.fieldQuote in table:
+            return table
+        
+        parts = []
+        for i in table.split(self.fieldSeparator):
+            if self.fieldNeedsQuoted(i):
+                i = self.quoteField(i)
+            parts.append(i)
+        return self.fieldSeparator.join(parts)
+    
+    def mogrify(self, query, escape):
+        """ Return query, with escape values bound client-side. """
+        
+        cursor = self.db.cursor()
+        try:
+            return cursor.mogrify(query, escape)
+        finally:
+            cursor.close()
+    
+    def SqlForCopyFrom(self, table, columns = None, format = COPY_TEXT):
+        """ Returns COPY ... FROM STDIN statement. """
+        
+        query = ['COPY', self.quoteTable(table)]
+        if columns is not None:
+            cols = []
+            for i in columns:
+                if self.fieldNeedsQuoted(i):
+                    i = self.quoteField(i)
+                cols.append(i)
+            query.append('(' + ', '.join(cols) + ')')
+        
+        query.append('FROM STDIN')
+        if format == COPY_CSV:
+            query.append('WITH CSV')
+        
+        return ' '.join(query)
+    
+    def SqlForCopyTo(self, format = COPY_TEXT, header = False):
+        """ Returns COPY (SELECT ...) TO STDOUT statement, for current query. """
+        
+        query, escape = self.sql()
+        query = self.mogrify(query, escape)
+        if not isinstance(query, str):
+            query = query.decode(
+                psycopg2.extensions.encodings[self.db.encoding])
+        
+        query = ['COPY', '(' + query + ')', 'TO STDOUT']
+        if format == COPY_CSV:
+            query.append('WITH CSV')
+            if header:
+                query.append('HEADER')
+        
+        return ' '.join(query)
+    
+    @ExceptionWrapper
+    def copyFrom(self, table, rows, columns = None, format = COPY_TEXT):
+        """
+        **
+        * Bulk load rows into table, using COPY ... FROM STDIN. Rows are
+        * encoded and streamed to the server as they're read, so rows may
+        * be a generator. Returns number of rows copied.
+        *
+        * @param    table   str, may be qualified with a schema
+        * @param    rows    iterable of tuples or dicts
+        * @param    columns list of column names. Required for tuples when
+        *                   not all columns are given in table order. For
+        *                   dicts, defaults to the keys of the first row.
+        * @param    format  COPY_TEXT or COPY_CSV
+        * @return   int
+        **
+        """
+        if self.isPooled():
+            return self.withConnection(self.copyFrom, table, rows, columns, format)
+        
+        if self.db == None:
+            return None
+        
+        rows = iter(rows)
+        try:
+            first = rows.next()
+        except StopIteration:
+            return 0
+        
+        if columns is None and isinstance(first, dict):
+            columns = first.keys()
+        
+        stream = CopyStream(itertools.chain([first], rows), columns, format)
+        trace = self.startTrace()
+        query = self.compileSql(trace,
+            lambda: (self.SqlForCopyFrom(table, columns, format), ()))[0]
+        
+        cursor = self.db.cursor()
+        try:
+            self.copyCursor(cursor, query, stream, trace)
+        finally:
+            cursor.close()
+        
+        return stream.rowcount
+    
     @ExceptionWrapper
-    def asObject(self, fetchall = False, server = False, destroy = True, fetch = dict):
+    def copyTo(self, fileobj, format = COPY_TEXT, header = False):
         """
         **
-        * Execute query and return result object. If fetchall == True,
-        * cursor.fetchall() will be used instead of wrapping the cursor
-        * into an iterable object, and fetching as needed. If server == True,
-        * use a server-side cursor and wrap it in an object, so data can be
-        * downloaded as needed, instead of all at once.
+        * Export current SELECT query, using COPY (...) TO STDOUT. Data is
+        * streamed to fileobj.write() as it's received from the server.
+        * Returns number of rows copied.
         *
-        * @param    fetchall    bool
-        * @param    server      bool
-        * @param    fetch       type, dict returns dictionaries, anything else
-        *                       returns tuples
-        * @return   QueryResult
+        * @param    fileobj file-like object, with a write() method
+        * @param    format  COPY_TEXT or COPY_CSV
+        * @param    header  bool, include header line (COPY_CSV only)
+        * @return   int
         **
         """
-        cursor = self.cursor(server)
-        return QueryResult(cursor, destroy, fetch)
+        if self.isPooled():
+            return self.withConnection(self.copyTo, fileobj, format, header)
+        
+        if self.db == None:
+            return None
+        
+        trace = self.startTrace()
+        query = self.compileSql(trace,
+            lambda: (self.SqlForCopyTo(format, header), ()))[0]
+        cursor = self.db.cursor()
+        try:
+            self.copyCursor(cursor, query, fileobj, trace)
+            rows = cursor.rowcount
+        finally:
+            cursor.close()
+        
+        return rows
+    
+    def copyCursor(self, cursor, query, fileobj, trace = None):
+        """
+        Run COPY query on cursor, with cursor.copy_expert(), firing the
+        execute hooks when tracing.
+        """
+        if trace is None:
+            cursor.copy_expert(query, fileobj)
+            return
+        
+        trace.started()
+        try:
+            cursor.copy_expert(query, fileobj)
+        except Exception, ex:
+            trace.fail(ex)
+            raise
+        trace.executed(cursor.rowcount)
     
     def isReady(self):
         if self.db is None:
@@ -1,6 +1,7 @@
 
 import inspect
 from relations import *
+from diff import *
 
 __all__ = [name for name, ref in locals().items()\
     if not name[0] == '_' and not inspect.ismodule(ref)]
@@ -0,0 +1,263 @@
+
+"""
+*
+* Schema diff engine. Compares two Database trees, such as a live database
+* against a cached snapshot, and yields the DDL needed to turn one into the
+* other.
+*
+"""
+
+import doze.backend.pgsql as pgsql
+from relations import *
+
+def quote_path(schema, name):
+    """ Returns schema qualified, quoted name """
+
+    bc = pgsql.BaseClause()
+    return '.'.join([bc.quoteField(schema), bc.quoteField(name)])
+
+def keyed(objects):
+    """ Returns dictionary of objects in ObjectList, keyed by (schema, name) """
+
+    return dict(((obj.schema, obj.name), obj) for name, obj in objects)
+
+def diff_keys(old, new):
+    """
+    Compare two dictionaries. Returns (dropped, added, common) lists of
+    keys, in sorted order, so output is stable.
+    """
+
+    dropped = sorted([k for k in old if k not in new])
+    added = sorted([k for k in new if k not in old])
+    common = sorted([k for k in new if k in old])
+    return (dropped, added, common)
+
+def diff_sequence(old, new):
+    """
+    Returns ALTER SEQUENCE for the parameters which differ between old and
+    new, or None. last_value is ignored, as it changes with every nextval().
+    """
+
+    bc = pgsql.BaseClause()
+    pre = []
+    for param, clause in [
+            ('increment_by', 'INCREMENT BY'),
+            ('min_value', 'MINVALUE'),
+            ('max_value', 'MAXVALUE')]:
+        if getattr(old, param) != getattr(new, param):
+            pre.extend([clause, bc.quoteValue(getattr(new, param))])
+
+    if len(pre) == 0:
+        return None
+    return ' '.join(['ALTER SEQUENCE', quote_path(new.schema, new.name)] + pre)
+
+def diff_columns(old, new):
+    """ Generator, which yields ALTER TABLE statements for columns """
+
+    bc = pgsql.BaseClause()
+    path = quote_path(new.schema, new.name)
+    # ObjectList has a keys attribute, which dict() would mistake for a
+    # mapping, so iterate over the (name, column) pairs instead
+    old_columns = dict(iter(old.columns))
+    new_columns = dict(iter(new.columns))
+    dropped, added, common = diff_keys(old_columns, new_columns)
+
+    for name in dropped:
+        yield 'ALTER TABLE %s DROP COLUMN %s' % (path, bc.quoteField(name))
+
+    # Added columns keep their table order
+    for name, col in new.columns:
+        if name in added:
+            yield 'ALTER TABLE %s ADD COLUMN %s' % (path, str(col))
+
+    for name in common:
+        a = old_columns[name]
+        b = new_columns[name]
+        pre = 'ALTER TABLE %s ALTER COLUMN %s' % (path, bc.quoteField(name))
+
+        # USING makes casts without an implicit conversion work, such as
+        # text to integer
+        if a.get_type() != b.get_type():
+            yield '%s TYPE %s USING %s::%s' % (pre, b.get_type(),
+                bc.quoteField(name), b.get_type())
+
+        default_a = a.default if a.has_default else None
+        default_b = b.default if b.has_default else None
+        if default_a != default_b:
+            if default_b is None:
+                yield '%s DROP DEFAULT' % (pre)
+            else:
+                yield '%s SET DEFAULT %s' % (pre, default_b)
+
+        if bool(a.not_null) != bool(b.not_null):
+            if b.not_null:
+                yield '%s SET NOT NULL' % (pre)
+            else:
+                yield '%s DROP NOT NULL' % (pre)
+
+def drop_index(index):
+    """
+    Returns statement dropping index. Indexes backing a primary key, unique
+    or exclusion constraint can't be dropped with DROP INDEX, so the
+    constraint is dropped instead.
+    """
+
+    # Snapshots pickled before is_constraint was fetched only know about
+    # primary keys
+    if index.is_primary or getattr(index, 'is_constraint', False):
+        bc = pgsql.BaseClause()
+        return 'ALTER TABLE %s DROP CONSTRAINT %s' % (
+            quote_path(index.schema, index.table), bc.quoteField(index.name))
+    return 'DROP INDEX %s' % (quote_path(index.schema, index.name))
+
+def drop_constraint(constraint):
+    """ Returns statement dropping check or foreign key constraint """
+
+    bc = pgsql.BaseClause()
+    if constraint.type == 'f':
+        path = quote_path(constraint.src_schema, constraint.src_table)
+    else:
+        path = quote_path(constraint.schema, constraint.table)
+    return 'ALTER TABLE %s DROP CONSTRAINT %s' % (
+        path, bc.quoteField(constraint.name))
+
+def drop_trigger(trigger):
+    """ Returns statement dropping trigger """
+
+    bc = pgsql.BaseClause()
+    return 'DROP TRIGGER %s ON %s' % (
+        bc.quoteField(trigger.name), quote_path(trigger.schema, trigger.table))
+
+def diff_databases(old, new):
+    """
+    **
+    * Generator, which yields the DDL statements needed to turn Database old
+    * into Database new. Objects are matched by (schema, name) through
+    * dictionaries, and compared by their rendered DDL, so only objects
+    * which actually differ produce statements. Changed indexes,
+    * constraints, triggers and views are dropped and recreated, while
+    * tables and sequences are altered in place.
+    *
+    * Drops come first, in reverse dependency order, followed by creates in
+    * dependency order. Load both trees with Database.get(..., snapshot=True)
+    * or Database.get_cached(), so comparing doesn't query each table.
+    *
+    * Examples:
+    *
+    *   old = Database.get_cached(conn, '/var/cache/app.schema')
+    *   new = Database.get(conn, snapshot=True)
+    *   for statement in diff_databases(old, new):
+    *       print statement + ';'
+    **
+    """
+
+    old_tables = keyed(old.tables)
+    new_tables = keyed(new.tables)
+    dropped_tables, added_tables, common_tables = diff_keys(
+        old_tables, new_tables)
+
+    # Index, constraint and trigger DDL of tables present in both, keyed by
+    # (schema, table, name)
+    def children(tables, kind):
+        res = {}
+        for key in common_tables:
+            for name, obj in getattr(tables[key], kind):
+                res[key + (name,)] = obj
+        return res
+
+    def changes(kind):
+        a = children(old_tables, kind)
+        b = children(new_tables, kind)
+        dropped, added, common = diff_keys(a, b)
+        changed = [k for k in common if str(a[k]) != str(b[k])]
+        return (
+            [a[k] for k in dropped + changed],
+            [b[k] for k in sorted(added + changed)])
+
+    drop_triggers, add_triggers = changes('triggers')
+    drop_constraints, add_constraints = changes('constraints')
+    drop_indexes, add_indexes = changes('indexes')
+
+    old_views = keyed(old.views)
+    new_views = keyed(new.views)
+    dropped, added, common = diff_keys(old_views, new_views)
+    changed = [k for k in common if str(old_views[k]) != str(new_views[k])]
+    drop_views = [old_views[k] for k in dropped + changed]
+    add_views = [new_views[k] for k in sorted(added + changed)]
+
+    old_sequences = keyed(old.sequences)
+    new_sequences = keyed(new.sequences)
+    dropped_sequences, added_sequences, common_sequences = diff_keys(
+        old_sequences, new_sequences)
+
+    old_schemas = set([k for k, v in old.schemas
+        if k != 'public' and old.in_search_path(k)])
+    new_schemas = set([k for k, v in new.schemas
+        if k != 'public' and new.in_search_path(k)])
+
+    # Drops, foreign keys first
+    for obj in drop_triggers:
+        yield drop_trigger(obj)
+
+    for obj in sorted(drop_constraints, key=lambda c: c.type != 'f'):
+        yield drop_constraint(obj)
+
+    for obj in drop_indexes:
+        yield drop_index(obj)
+
+    for obj in drop_views:
+        yield 'DROP VIEW %s' % (quote_path(obj.schema, obj.name))
+
+    for key in dropped_tables:
+        yield 'DROP TABLE %s' % (quote_path(*key))
+
+    # Sequences owned by a column, such as for serial columns, are dropped
+    # along with their table or column, so may be gone by now
+    for key in dropped_sequences:
+        yield 'DROP SEQUENCE IF EXISTS %s' % (quote_path(*key))
+
+    bc = pgsql.BaseClause()
+    for name in sorted(old_schemas - new_schemas):
+        yield 'DROP SCHEMA %s' % (bc.quoteField(name))
+
+    # Creates and alters
+    for name in sorted(new_schemas - old_schemas):
+        yield str(getattr(new.schemas, name))
+
+    for key in added_sequences:
+        yield new_sequences[key].get_create()
+
+    for key in common_sequences:
+        statement = diff_sequence(old_sequences[key], new_sequences[key])
+        if statement is not None:
+            yield statement
+
+    for key in added_tables:
+        yield new_tables[key].get_create()
+
+    for key in common_tables:
+        for statement in diff_columns(old_tables[key], new_tables[key]):
+            yield statement
+
+    for obj in add_views:
+        yield str(obj)
+
+    for key in added_tables:
+        for name, obj in new_tables[key].indexes:
+            yield str(obj)
+    for obj in add_indexes:
+        yield str(obj)
+
+    # Check constraints before foreign keys
+    constraints = []
+    for key in added_tables:
+        constraints.extend([obj for name, obj in new_tables[key].constraints])
+    constraints.extend(add_constraints)
+    for obj in sorted(constraints, key=lambda c: c.type == 'f'):
+        yield str(obj)
+
+    for key in added_tables:
+        for name, obj in new_tables[key].triggers:
+            yield str(obj)
+    for obj in add_triggers:
+        yield str(obj)
@@ -0,0 +1,51 @@
+
+"""
+*
+* Command line entry point, for dumping schema DDL of a PostgreSQL database.
+*
+* Usage:
+*   python -m doze.backend.pgsql.relations.dump -d testdb -U testuser \
+*       -n public -n reports -o schema.sql
+*
+"""
+
+import os
+import sys
+import argparse
+import doze.backend.pgsql as pgsql
+from relations import *
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Dump schema DDL of a PostgreSQL database')
+    parser.add_argument('-H', '--host', default=None)
+    parser.add_argument('-p', '--port', default=5432)
+    parser.add_argument('-U', '--user', default=None)
+    parser.add_argument('-d', '--database', default=None)
+    parser.add_argument('-n', '--schema', action='append', dest='schemas',
+        help='Schema to dump, may be repeated (default: public)')
+    parser.add_argument('-o', '--output', default=None,
+        help='Output file (default: stdout)')
+    args = parser.parse_args(argv)
+    
+    # Password is taken from the environment, as with psql
+    conn = pgsql.connect(
+        host=args.host,
+        user=args.user,
+        password=os.environ.get('PGPASSWORD'),
+        database=args.database,
+        port=args.port)
+    
+    dbdef = Database.get(conn, args.schemas or ['public'])
+    
+    if args.output is None:
+        dbdef.dump(sys.stdout)
+    else:
+        with open(args.output, 'w') as f:
+            dbdef.dump(f)
+    
+    conn.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,8 +6,33 @@
 """
 
 import sys
+import itertools
 import doze.backend.pgsql as pgsql
 
+# Relation kinds with columns: tables, views, materialized views, foreign
+# tables and partitioned tables
+COLUMN_RELKINDS = ('r', 'v', 'm', 'f', 'p')
+
+def schema_condition(column, schema, escape):
+    """
+    Returns an SQL condition (prefixed with AND), matching column against
+    schema, and appends schema to escape. schema may be a str, list, tuple,
+    or None, in which case any schema matches.
+    """
+    
+    if schema is None:
+        return ''
+    elif type(schema) == str:
+        escape.append(schema)
+        return ' AND %s = %%s' % (column)
+    elif type(schema) == list or type(schema) == tuple:
+        _in = ','.join(['%s' for i in range(0, len(schema))])
+        escape.extend(schema)
+        return ' AND %s IN (%s)' % (column, _in)
+    
+    raise TypeError(('Parameter "schema" must be either'
+        ' str, list, tuple, or None'))
+
 def current_database(conn):
     """ Get current database. """
 
@@ -18,6 +43,66 @@ def current_database(conn):
     
     return database
 
+def catalog_fingerprint(conn, schema = None):
+    """
+    Get a fingerprint of the catalog, which changes whenever objects are
+    created, altered or dropped. Rows in the catalogs are never updated in
+    place by DDL, so the row count and the sum of xmin for each catalog
+    change along with them. Only objects in schema (see schema_condition())
+    are counted, and temporary schemas are always left out, so neither
+    unrelated schemas nor temporary tables change the fingerprint, and the
+    query stays cheap enough to run on every startup.
+    
+    View definitions are covered through pg_rewrite, and sequence
+    parameters through pg_sequence, on PostgreSQL 10 and later. Older
+    servers keep sequence parameters in the sequence itself, so ALTER
+    SEQUENCE doesn't change the fingerprint there.
+    """
+    
+    # (catalog, column, within), where column holds a namespace oid (ns),
+    # or a pg_class oid (rel) for catalogs which belong to a relation
+    catalogs = [
+        ('pg_namespace', 'oid', 'ns'),
+        ('pg_class', 'relnamespace', 'ns'),
+        ('pg_attribute', 'attrelid', 'rel'),
+        ('pg_attrdef', 'adrelid', 'rel'),
+        ('pg_index', 'indrelid', 'rel'),
+        ('pg_constraint', 'connamespace', 'ns'),
+        ('pg_trigger', 'tgrelid', 'rel'),
+        ('pg_rewrite', 'ev_class', 'rel')]
+    
+    if server_version(conn) >= 100000:
+        catalogs.append(('pg_sequence', 'seqrelid', 'rel'))
+    
+    escape = []
+    query = """
+        WITH ns AS (
+            SELECT oid FROM pg_catalog.pg_namespace
+            WHERE nspname !~ '^pg_(toast_)?temp_'"""
+    query += schema_condition('nspname', schema, escape)
+    query += """
+        ), rel AS (
+            SELECT oid FROM pg_catalog.pg_class
+            WHERE relnamespace IN (SELECT oid FROM ns)
+        )"""
+    
+    parts = []
+    for catalog, column, within in catalogs:
+        parts.append(
+            "(SELECT COUNT(*) || ':' || COALESCE(SUM(xmin::text::bigint), 0)"
+            " FROM pg_catalog.%s WHERE %s IN (SELECT oid FROM %s))"
+            % (catalog, column, within))
+    
+    query += " SELECT CURRENT_DATABASE() || '/' || %s" % (
+        " || '/' || ".join(parts))
+    
+    cursor = conn.cursor()
+    cursor.execute(query, escape)
+    fingerprint = str(cursor.fetchone()[0])
+    cursor.close()
+    
+    return fingerprint
+
 def databases(conn):
     """ Get list of databases, using conn as the connection. """
 
@@ -80,24 +165,97 @@ def tables(conn, schema='public'):
     
     return rows
 
-def sequences(conn, schema='public'):
-    """ Get list of sequences """
+def server_version(conn):
+    """ Get server version of connection, as an int such as 90605 """
+    
+    if hasattr(conn, 'server_version'):
+        return conn.server_version
+    return conn.info.server_version
+
+def iter_rows(cursor, size = 1000):
+    """
+    Generator, which yields rows from cursor as dictionaries, fetching
+    size rows at a time. Closes cursor when done.
+    """
+    
+    try:
+        columns = None
+        while True:
+            rows = cursor.fetchmany(size)
+            if len(rows) == 0:
+                break
+            
+            # Named cursors only have a description after the first fetch
+            if columns is None:
+                columns = [i[0] for i in cursor.description]
+            for i in rows:
+                yield dict(zip(columns, i))
+    finally:
+        cursor.close()
+
+def catalog_cursor(conn, stream = False):
+    """
+    Returns cursor for a catalog query. When stream is True, the cursor is
+    named (server-side), so rows are fetched a batch at a time by
+    iter_rows(), instead of all at once. views(), columns(), indexes() and
+    the constraint and trigger queries take stream, and return iter_rows()
+    when it's True.
+    """
+    
+    if not stream:
+        return conn.cursor()
+    
+    # Outside of a transaction, the cursor has to outlive it
+    name = pgsql.Builder.cursorNames.next()
+    return conn.cursor(name, withhold=bool(getattr(conn, 'autocommit', False)))
+
+def sequences(conn, schema='public', stream=False):
+    """
+    Generator, which yields sequences as dictionaries.
+    
+    On PostgreSQL 10 and later, sequence parameters are read from the
+    pg_sequences view, all in the same query. Older servers have no such
+    view, so after listing the sequences, their parameters are fetched
+    with one UNION ALL query per batch of sequences.
+    """
     
-    bc = pgsql.BaseClause()
     escape = []
     query = """
         SELECT
             s.relname AS name,
             ns.nspname AS schema,
-            a.rolname AS owner
+            a.rolname AS owner%s
         FROM
-            pg_catalog.pg_class s,
-            pg_catalog.pg_namespace ns,
-            pg_catalog.pg_roles a
+            pg_catalog.pg_class s
+            JOIN pg_catalog.pg_namespace ns ON (ns.oid = s.relnamespace)
+            JOIN pg_catalog.pg_roles a ON (a.oid = s.relowner)%s
         WHERE
-            ns.oid = s.relnamespace
-            AND a.oid = s.relowner
-            AND s.relkind = 'S'"""
+            s.relkind = 'S'"""
+    
+    if server_version(conn) >= 100000:
+        # Unused sequences have a NULL last_value, where selecting from the
+        # sequence returns its start value
+        query = query % (""",
+            COALESCE(ps.last_value, ps.start_value) AS last_value,
+            ps.increment_by,
+            ps.max_value,
+            ps.min_value""", """
+            JOIN pg_catalog.pg_sequences ps ON (
+                ps.schemaname = ns.nspname
+                AND ps.sequencename = s.relname)""")
+        query += schema_condition('ns.nspname', schema, escape)
+        
+        cursor = catalog_cursor(conn, stream)
+        cursor.execute(query, escape)
+        for row in iter_rows(cursor):
+            yield row
+        return
+    
+    query = query % ('', '')
+    query += schema_condition('ns.nspname', schema, escape)
+    
+    cursor = conn.cursor()
+    cursor.execute(query, escape)
     
     seq_map = [
         'last_value',
@@ -105,44 +263,34 @@ def sequences(conn, schema='public'):
         'max_value',
         'min_value']
     
-    seq_info = "SELECT %s FROM %s"
-    
-    if type(schema) == str:
-        # Normal case, schema is a string
-        query += " AND ns.nspname = %s"
-        escape.append(schema)
-    elif type(schema) == list or type(schema) == tuple:
-        # This function also supports lists/tuples for schema
-        _in = ','.join(['%s' for i in range(0, len(schema))])
-        query += " AND ns.nspname IN (%s)" % (_in)
-        escape.extend(schema)
-    
-    # Execute query
-    cursor = conn.cursor()
-    cursor.execute(query, escape)
-    
-    # Get column map
-    columns = [i[0] for i in cursor.description]
-    
-    # Build result to return
-    rows = []
-    for i in cursor.fetchall():
-        row = dict(zip(columns, i))
+    seq_info = "SELECT %d, %s FROM %s"
+    bc = pgsql.BaseClause()
+    batch_size = 500
+    
+    # Fetch sequence details, one query per batch
+    rows = iter_rows(cursor, batch_size)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if len(batch) == 0:
+            break
         
-        # Fetch sequence details
-        path = '.'.join([
-            bc.quoteField(row['schema']),
-            bc.quoteField(row['name'])])
+        union = []
+        for idx in range(0, len(batch)):
+            path = '.'.join([
+                bc.quoteField(batch[idx]['schema']),
+                bc.quoteField(batch[idx]['name'])])
+            union.append(seq_info % (idx, ','.join(seq_map), path))
         
-        cursor.execute(seq_info % (','.join(seq_map), path))
-        row.update(dict(zip(seq_map, cursor.fetchone())))
+        info_cursor = conn.cursor()
+        info_cursor.execute(' UNION ALL '.join(union))
+        for res in info_cursor.fetchall():
+            batch[res[0]].update(dict(zip(seq_map, res[1:])))
+        info_cursor.close()
         
-        rows.append(row)
-    
-    cursor.close()
-    return rows
+        for row in batch:
+            yield row
 
-def views(conn, schema='public'):
+def views(conn, schema='public', stream=False):
     """ Get list of views """
     
     escape = []
@@ -172,8 +320,10 @@ def views(conn, schema='public'):
         escape.extend(schema)
     
     # Execute query
-    cursor = conn.cursor()
+    cursor = catalog_cursor(conn, stream)
     cursor.execute(query, escape)
+    if stream:
+        return iter_rows(cursor)
     
     # Get column map
     columns = [i[0] for i in cursor.description]
@@ -186,21 +336,25 @@ def views(conn, schema='public'):
     cursor.close()
     return rows
 
-def columns(conn, table, schema='public'):
+def columns(conn, table, schema='public', kinds=None, stream=False):
     """
     Get column definition for table. Must provide at least a database
-    connection and a table. Schema defaults to public.
+    connection and a table. Schema defaults to public. When table is None,
+    columns of all relations in schema are returned, ordered by schema,
+    table and column position. kinds limits the relations to those with a
+    relkind in the list, and defaults to COLUMN_RELKINDS.
     
     Query code has been borrowed from PEAR::MDB2, with many modifications.
     
-    Returns a list of dictionaries.
+    Returns a list of dictionaries, or a generator of them when stream is
+    True.
     """
     
     # This is a bit of an unholy mess
     query = ("""
         SELECT
-        tb.tablename AS table,
-        tb.schemaname AS schema,
+        c.relname AS table,
+        n.nspname AS schema,
         a.attname AS name,
         t.typname AS internaltype,
         CASE
@@ -225,9 +379,9 @@ def columns(conn, table, schema='public'):
                 ELSE a.attlen
                 END AS length,
                 CASE t.typname
-                    WHEN 'numeric' THEN (a.atttypmod %% 65536) - 4
-                    WHEN 'decimal' THEN (a.atttypmod %% 65536) - 4
-                    WHEN 'money'   THEN (a.atttypmod %% 65536) - 4
+                    WHEN 'numeric' THEN MOD(a.atttypmod, 65536) - 4
+                    WHEN 'decimal' THEN MOD(a.atttypmod, 65536) - 4
+                    WHEN 'money'   THEN MOD(a.atttypmod, 65536) - 4
                     ELSE 0
                 END AS scale,
         a.attnotnull AS not_null,
@@ -240,20 +394,32 @@ def columns(conn, table, schema='public'):
                 AND a.atthasdef
         ) as default
         FROM pg_catalog.pg_attribute a
-            RIGHT JOIN pg_catalog.pg_class c ON (c.oid = a.attrelid)
-            RIGHT JOIN pg_catalog.pg_type t ON (a.atttypid = t.oid)
-            LEFT JOIN pg_catalog.pg_tables tb ON (tb.schemaname = %s AND tb.tablename = %s)
-        WHERE c.relname = %s
+            JOIN pg_catalog.pg_class c ON (c.oid = a.attrelid)
+            JOIN pg_catalog.pg_namespace n ON (n.oid = c.relnamespace)
+            JOIN pg_catalog.pg_type t ON (a.atttypid = t.oid)
+        WHERE c.relkind IN (%s)
             AND NOT a.attisdropped
-            AND a.attnum > 0
-        ORDER BY a.attnum;""")
+            AND a.attnum > 0""")
     
     #
     # TODO: Get primary and unique keys
     #
     
-    cursor = conn.cursor()
-    cursor.execute(query, [schema, table, table])
+    if kinds is None:
+        kinds = COLUMN_RELKINDS
+    
+    escape = list(kinds)
+    query = query % (','.join(['%s' for i in kinds]))
+    query += schema_condition('n.nspname', schema, escape)
+    if table is not None:
+        query += ' AND c.relname = %s'
+        escape.append(table)
+    query += ' ORDER BY n.nspname, c.relname, a.attnum'
+    
+    cursor = catalog_cursor(conn, stream)
+    cursor.execute(query, escape)
+    if stream:
+        return iter_rows(cursor)
     
     # Get column map
     columns = [i[0] for i in cursor.description]
@@ -267,8 +433,16 @@ def columns(conn, table, schema='public'):
     return rows
 
 
-def indexes(conn, table, schema = 'public'):
-    """ Get indexes on table, using connection """
+def indexes(conn, table, schema = 'public', stream=False, kinds=None,
+            inherited=True):
+    """
+    Get indexes on table, using connection. Returns one row per indexed
+    column. When table is None, indexes on all tables in schema are
+    returned. kinds limits the tables to those with a relkind in the list,
+    and defaults to ordinary tables. When inherited is False, indexes of
+    partitions which are attached to an index of their parent are left
+    out, as they're created along with it.
+    """
     
     #
     # TODO: Get column order correct
@@ -283,6 +457,12 @@ def indexes(conn, table, schema = 'public'):
             i.relname AS name,
             ix.indisprimary AS is_primary,
             ix.indisunique AS is_unique,
+            EXISTS (
+                SELECT 1 FROM pg_catalog.pg_constraint con
+                WHERE con.conindid = ix.indexrelid
+                    AND con.conrelid = ix.indrelid
+                    AND con.contype IN ('p', 'u', 'x')
+            ) AS is_constraint,
             a.attname AS column,
             r.rolname AS owner
         FROM
@@ -298,14 +478,78 @@ def indexes(conn, table, schema = 'public'):
             AND i.oid = ix.indexrelid
             AND a.attrelid = t.oid
             AND a.attnum = ANY(ix.indkey)
-            AND t.relkind = 'r'
-            AND ns.oid = t.relnamespace
-            AND ns.nspname = %s
-            AND t.relname = %s
-        ORDER BY t.relname, i.relname"""
+            AND t.relkind IN (%s)
+            AND ns.oid = t.relnamespace"""
+    
+    if kinds is None:
+        kinds = ['r']
+    
+    escape = list(kinds)
+    query = query % (','.join(['%s' for i in kinds]))
+    if not inherited and server_version(conn) >= 100000:
+        query += ' AND NOT i.relispartition'
+    query += schema_condition('ns.nspname', schema, escape)
+    if table is not None:
+        query += ' AND t.relname = %s'
+        escape.append(table)
+    query += ' ORDER BY ns.nspname, t.relname, i.relname'
+    
+    cursor = catalog_cursor(conn, stream)
+    cursor.execute(query, escape)
+    if stream:
+        return iter_rows(cursor)
+    
+    # Get column map
+    columns = [i[0] for i in cursor.description]
+    
+    # Build result to return
+    rows = []
+    for i in cursor.fetchall():
+        rows.append(dict(zip(columns, i)))
+    
+    cursor.close()
+    return rows
+
+def partitions(conn, schema='public'):
+    """
+    Get partitioning of tables in schema, as a list of dictionaries, one
+    per partitioned table or partition. partition_key is set for
+    partitioned tables, such as "RANGE (day)". parent_schema, parent_table
+    and partition_bound are set for partitions, such as "FOR VALUES FROM
+    (1) TO (10)". Servers before PostgreSQL 10 have no partitioning, and
+    return an empty list.
+    """
+    
+    if server_version(conn) < 100000:
+        return []
+    
+    query = """
+        SELECT
+            n.nspname AS schema,
+            c.relname AS table,
+            pn.nspname AS parent_schema,
+            p.relname AS parent_table,
+            CASE WHEN c.relkind = 'p'
+                THEN pg_catalog.pg_get_partkeydef(c.oid)
+            END AS partition_key,
+            CASE WHEN c.relispartition
+                THEN pg_catalog.pg_get_expr(c.relpartbound, c.oid)
+            END AS partition_bound
+        FROM pg_catalog.pg_class c
+            JOIN pg_catalog.pg_namespace n ON (n.oid = c.relnamespace)
+            LEFT JOIN pg_catalog.pg_inherits i ON (
+                c.relispartition AND i.inhrelid = c.oid)
+            LEFT JOIN pg_catalog.pg_class p ON (p.oid = i.inhparent)
+            LEFT JOIN pg_catalog.pg_namespace pn ON (pn.oid = p.relnamespace)
+        WHERE c.relkind IN ('r', 'p')
+            AND (c.relkind = 'p' OR c.relispartition)"""
+    
+    escape = []
+    query += schema_condition('n.nspname', schema, escape)
+    query += ' ORDER BY n.nspname, c.relname'
     
     cursor = conn.cursor()
-    cursor.execute(query, [schema, table])
+    cursor.execute(query, escape)
     
     # Get column map
     columns = [i[0] for i in cursor.description]
@@ -344,8 +588,14 @@ def schemas(conn):
     cursor.close()
     return rows
 
-def check_constraints(conn, table, schema='public'):
-    """ Get list of Check Constraints on table """
+def check_constraints(conn, table, schema='public', stream=False,
+                      inherited=True):
+    """
+    Get list of Check Constraints on table. When table is None, Check
+    Constraints on all tables in schema are returned. When inherited is
+    False, constraints which partitions inherit from their parent are left
+    out.
+    """
     
     query = """
         SELECT
@@ -360,12 +610,21 @@ def check_constraints(conn, table, schema='public'):
             WHERE
                 t.oid = c.conrelid
                 AND t.relnamespace = n.oid
-                AND c.contype = 'c'
-                AND t.relname = %s
-                AND n.nspname = %s"""
+                AND c.contype = 'c'"""
     
-    cursor = conn.cursor()
-    cursor.execute(query, [table, schema])
+    if not inherited and server_version(conn) >= 100000:
+        query += ' AND (c.conislocal OR NOT t.relispartition)'
+    
+    escape = []
+    query += schema_condition('n.nspname', schema, escape)
+    if table is not None:
+        query += ' AND t.relname = %s'
+        escape.append(table)
+    
+    cursor = catalog_cursor(conn, stream)
+    cursor.execute(query, escape)
+    if stream:
+        return iter_rows(cursor)
     
     # Column map
     columns = [i[0] for i in cursor.description]
@@ -379,28 +638,18 @@ def check_constraints(conn, table, schema='public'):
     
     return rows
 
-def foreign_key_constraints(conn, table, schema='public'):
-    """ Get list of Foreign Key Constraints on table """
-    
-    cursor2 = conn.cursor()
-    colname_query = """
-        SELECT
-            a.attname AS name
-            FROM pg_catalog.pg_attribute a
-                RIGHT JOIN pg_catalog.pg_class c ON (c.oid = a.attrelid)
-            WHERE c.oid = %s
-                AND NOT a.attisdropped
-                AND a.attnum > 0
-                AND a.attnum = %s"""
-    
-    # Nested helper function
-    def get_columns_by_attrnums(tableoid, attrnums=[]):
-        colnames = []
-        for i in attrnums:
-            cursor.execute(colname_query, [tableoid, i])
-            res = cursor.fetchone()
-            colnames.append(res[0])
-        return colnames
+def foreign_key_constraints(conn, table, schema='public', stream=False,
+                            inherited=True):
+    """
+    Get list of Foreign Key Constraints on table. When table is None,
+    Foreign Key Constraints on all tables in schema are returned. When
+    inherited is False, constraints cloned onto partitions from their
+    parent are left out.
+    
+    Column names are resolved within the query, by unnesting conkey and
+    confkey WITH ORDINALITY (PostgreSQL 9.4 and later), so the key column
+    order is kept.
+    """
     
     query = """
         SELECT
@@ -411,10 +660,22 @@ def foreign_key_constraints(conn, table, schema='public'):
             t2.relname as dst_table,
             c.condeferrable AS deferrable,
             c.confmatchtype AS match_type,
-            c.conkey,
-            c.confkey,
-            c.conrelid AS src_table_oid,
-            c.confrelid AS dst_table_oid,
+            ARRAY(
+                SELECT a.attname::text
+                FROM unnest(c.conkey) WITH ORDINALITY AS k(attnum, ord)
+                    JOIN pg_catalog.pg_attribute a ON (
+                        a.attrelid = c.conrelid
+                        AND a.attnum = k.attnum)
+                ORDER BY k.ord
+            ) AS src_columns,
+            ARRAY(
+                SELECT a.attname::text
+                FROM unnest(c.confkey) WITH ORDINALITY AS k(attnum, ord)
+                    JOIN pg_catalog.pg_attribute a ON (
+                        a.attrelid = c.confrelid
+                        AND a.attnum = k.attnum)
+                ORDER BY k.ord
+            ) AS dst_columns,
             c.confupdtype AS on_update_action,
             c.confdeltype AS on_delete_action
             FROM
@@ -428,46 +689,40 @@ def foreign_key_constraints(conn, table, schema='public'):
                 AND t1.relnamespace = n1.oid
                 AND c.confrelid = t2.oid
                 AND t2.relnamespace = n2.oid
-                AND c.contype = 'f'
-                AND n1.nspname = %s
-                AND t1.relname = %s"""
+                AND c.contype = 'f'"""
+    
+    if not inherited and server_version(conn) >= 110000:
+        query += ' AND c.conparentid = 0'
+    
+    escape = []
+    query += schema_condition('n1.nspname', schema, escape)
+    if table is not None:
+        query += ' AND t1.relname = %s'
+        escape.append(table)
+    query += ' ORDER BY n1.nspname, t1.relname, c.conname'
 
-    cursor = conn.cursor()
-    cursor.execute(query, [schema, table])
+    cursor = catalog_cursor(conn, stream)
+    cursor.execute(query, escape)
+    if stream:
+        return iter_rows(cursor)
     
     # Column map
     columns = [i[0] for i in cursor.description]
     
     # Build result to return
     rows = []
-    
     for i in cursor.fetchall():
-        row = dict(zip(columns, i))
-        src_columns = get_columns_by_attrnums(
-            row['src_table_oid'],
-            row['conkey'])
-        
-        dst_columns = get_columns_by_attrnums(
-            row['dst_table_oid'],
-            row['confkey'])
-        
-        row['src_columns'] = src_columns
-        row['dst_columns'] = dst_columns
-        del row['dst_table_oid']
-        del row['src_table_oid']
-        del row['confkey']
-        del row['conkey']
-        
-        rows.append(row)
+        rows.append(dict(zip(columns, i)))
     
     cursor.close()
-    cursor2.close()
     return rows
 
-def non_referential_triggers(conn, table=None, schema='public'):
+def non_referential_triggers(conn, table=None, schema=None, stream=False):
     """
     Returns a list of Triggers which are not used for
-    referential integrity (non Foreign Keys, etc).
+    referential integrity (non Foreign Keys, etc). When table is given,
+    schema defaults to public. When table is None, Triggers in all
+    schemas are returned unless schema is given.
     """
 
     query = """
@@ -493,13 +748,19 @@ def non_referential_triggers(conn, table=None, schema='public'):
                 AND t.relnamespace = n.oid
                 AND tg.tgisconstraint = 'f'"""
     
-    cursor = conn.cursor()
+    if table is not None and schema is None:
+        schema = 'public'
+    
+    escape = []
+    query += schema_condition('n.nspname', schema, escape)
     if table is not None:
-        query += "AND n.nspname = %s\n"
-        query += "AND t.relname = %s"
-        cursor.execute(query, [schema, table])
-    else:
-        cursor.execute(query)
+        query += ' AND t.relname = %s'
+        escape.append(table)
+    
+    cursor = catalog_cursor(conn, stream)
+    cursor.execute(query, escape)
+    if stream:
+        return iter_rows(cursor)
     
     # Column map
     columns = [i[0] for i in cursor.description]
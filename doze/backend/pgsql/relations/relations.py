@@ -5,11 +5,21 @@
 *
 """
 
+import os
 import sys
+import itertools
+import tempfile
+import cPickle as pickle
+from multiprocessing.pool import ThreadPool
 import doze.backend.pgsql as pgsql
 from doze.backend.generic.relations.base import *
 from information import *
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
 """
 
 TODO: Cleanup class hierarchy
@@ -18,9 +28,13 @@ TODO: Standardize names of attributes on Relation objects
 
 """
 
+# Format version of schema cache files, see Database.get_cached()
+SCHEMA_CACHE_VERSION = 2
+
 # Relation Types, as per relkind on pg_catalog.pg_class
 PG_CLASS_TABLE = 'r'
 PG_CLASS_VIEW = 'v'
+PG_CLASS_PARTITIONED = 'p'
 PG_CLASS_INDEX = 'i'
 PG_CLASS_SEQUENCE = 'S'
 PG_CLASS_SPECIAL = 's'
@@ -32,16 +46,138 @@ PG_TRIGGER_INS_MASK         = int('00000100', 2)
 PG_TRIGGER_DEL_MASK         = int('00001000', 2)
 PG_TRIGGER_UPD_MASK         = int('00010000', 2)
 
+def iter_index_columns(rows):
+    """
+    Generator, which groups rows returned by indexes(), which has one row
+    per indexed column, into one row per index, with the columns in a list.
+    """
+    
+    key = lambda i: (i['schema'], i['table'], i['name'])
+    for name, group in itertools.groupby(rows, key):
+        res = None
+        for i in group:
+            if res is None:
+                res = i
+                res['columns'] = []
+            res['columns'].append(i.pop('column'))
+        yield res
+
+def group_index_columns(rows):
+    """ Same as iter_index_columns(), but returns a list """
+    
+    return list(iter_index_columns(rows))
+
+def table_catalog(conn, schema, table):
+    """
+    Fetch catalog rows for a single table, as a dictionary of columns,
+    indexes, check_constraints, foreign_key_constraints and triggers, as
+    accepted by Table.set_catalog().
+    """
+    
+    return {
+        'columns': columns(conn, table, schema),
+        'indexes': group_index_columns(indexes(conn, table, schema)),
+        'check_constraints': check_constraints(conn, table, schema),
+        'foreign_key_constraints': foreign_key_constraints(conn, table, schema),
+        'triggers': non_referential_triggers(conn, table, schema)}
+
+def parallel_map(func, items, workers):
+    """
+    Like map(), but calls func from up to workers threads. Results are
+    returned in the order of items. Uses concurrent.futures when available,
+    or multiprocessing's ThreadPool otherwise.
+    """
+    
+    if ThreadPoolExecutor is not None:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            return list(executor.map(func, items))
+        finally:
+            executor.shutdown()
+    
+    threads = ThreadPool(workers)
+    try:
+        return threads.map(func, items, 1)
+    finally:
+        threads.close()
+        threads.join()
+
 # Lazy loaders
 class LazyloadTables(object):
     """ Lazyload Tables Class """
     
     def load_tables(self):
-        self.tables = ObjectList()
+        if self.__dict__.get('snapshot'):
+            return self.load_snapshot()
+        
         tbl_list = tables(self.conn, self.search_path)
-        for (schema, name, owner) in tbl_list:
+        self.tables = ObjectList(
+            (name, Table.factory(self.conn, schema, name, owner))
+            for (schema, name, owner) in tbl_list)
+        
+        return self.tables
+
+    def load_snapshot(self):
+        """
+        Load tables, along with their columns, indexes, constraints and
+        triggers. Instead of querying the catalog once per table, each kind
+        of object is fetched for the whole search path in one query, grouped
+        by (schema, table), and set on the tables, so they're never lazy
+        loaded.
+        """
+        
+        self.tables = ObjectList()
+        by_table = {}
+        
+        for (schema, name, owner) in tables(self.conn, self.search_path):
             tbl = Table.factory(self.conn, schema, name, owner)
             self.tables.setattr(name, tbl)
+            by_table[(schema, name)] = (tbl, {
+                'columns': [],
+                'indexes': [],
+                'check_constraints': [],
+                'foreign_key_constraints': [],
+                'triggers': []})
+        
+        def group(kind, rows, schema_key='schema', table_key='table'):
+            for i in rows:
+                key = (i[schema_key], i[table_key])
+                if key in by_table:
+                    by_table[key][1][kind].append(i)
+        
+        path = self.search_path
+        group('columns', columns(self.conn, None, path))
+        group('indexes', group_index_columns(indexes(self.conn, None, path)))
+        group('check_constraints', check_constraints(self.conn, None, path))
+        group('foreign_key_constraints',
+            foreign_key_constraints(self.conn, None, path),
+            'src_schema', 'src_table')
+        group('triggers', non_referential_triggers(self.conn, None, path))
+        
+        for tbl, data in by_table.values():
+            tbl.set_catalog(data)
+        
+        return self.tables
+    
+    def load_parallel(self, pool, workers=4):
+        """
+        Load tables, along with their columns, indexes, constraints and
+        triggers, fetching the catalog of each table on connections
+        borrowed from pool (a doze.ConnectionPool), with at most workers
+        tables in flight at once. Only the catalog queries run in worker
+        threads, the objects are built in the calling thread, and keep
+        using self.conn.
+        """
+        
+        tbl_list = [tbl for name, tbl in self.tables]
+        
+        def fetch(tbl):
+            with pool.connection() as conn:
+                return table_catalog(conn, tbl.schema, tbl.name)
+        
+        workers = max(1, min(workers, pool.maxsize, len(tbl_list)))
+        for tbl, data in zip(tbl_list, parallel_map(fetch, tbl_list, workers)):
+            tbl.set_catalog(data)
         
         return self.tables
 
@@ -49,10 +185,9 @@ class LazyloadSequences(object):
     """ Lazyload Sequences Class """
 
     def load_sequences(self):
-        self.sequences = ObjectList()
-        for i in sequences(self.conn, self.search_path):
-            s = Sequence.factory(self.conn, **i)
-            self.sequences.setattr(i['name'], s)
+        self.sequences = ObjectList(
+            (i['name'], Sequence.factory(self.conn, **i))
+            for i in sequences(self.conn, self.search_path))
         
         return self.sequences
 
@@ -62,10 +197,9 @@ class LazyloadViews(object):
     def load_views(self):
         """ Auto load views """
     
-        self.views = ObjectList()
-        for i in views(self.conn, self.search_path):
-            v = View.factory(self.conn, **i)
-            self.views.setattr(i['name'], v)
+        self.views = ObjectList(
+            (i['name'], View.factory(self.conn, **i))
+            for i in views(self.conn, self.search_path))
         
         return self.views
 
@@ -73,10 +207,9 @@ class LazyloadColumns(object):
     """ Lazyload Views Columns """
     
     def load_columns(self):
-        self.columns = ObjectList()
-        for i in columns(self.conn, self.name, self.schema):
-            col = Column.factory(self.conn, **i)
-            self.columns.setattr(i['name'], col)
+        self.columns = ObjectList(
+            (i['name'], Column.factory(self.conn, **i))
+            for i in columns(self.conn, self.name, self.schema))
         return self.columns
 
 class LazyLoadConstraints(object):
@@ -101,11 +234,9 @@ class LazyLoadTriggers(object):
     """ Lazy Load Triggers  """
     
     def load_triggers(self):
-        self.triggers = ObjectList()
-        
-        for i in non_referential_triggers(self.conn, self.name, self.schema):
-            obj = Trigger.factory(self.conn, **i)
-            self.triggers.setattr(i['name'], obj)
+        self.triggers = ObjectList(
+            (i['name'], Trigger.factory(self.conn, **i))
+            for i in non_referential_triggers(self.conn, self.name, self.schema))
         return self.triggers
 
 # Relations
@@ -120,6 +251,7 @@ class Index(Relation):
             'indrelid',
             'is_primary',
             'is_unique',
+            'is_constraint',
             'owner',
             'columns']
 
@@ -155,6 +287,11 @@ class Index(Relation):
         if self.is_primary:
             pre = ['ALTER TABLE', path, 'ADD PRIMARY KEY', columns]
             return ' '.join(pre)
+        
+        if self.is_unique and getattr(self, 'is_constraint', False):
+            pre = ['ALTER TABLE', path, 'ADD CONSTRAINT',
+                bc.quoteField(self.name), 'UNIQUE', columns]
+            return ' '.join(pre)
     
         ci = 'CREATE INDEX'
         if self.is_unique:
@@ -200,19 +337,20 @@ class Column(Relation):
         
         return col
     
+    def get_type(self):
+        """ Get column type, with its length for character types """
+        
+        if self.externaltype == 'char' and self.length is not None:
+            return '%s(%s)' % (self.internaltype, str(self.length))
+        return '%s' % (self.internaltype)
+    
     def __str__(self):
         """ To String """
     
         bc = pgsql.BaseClause()
         name = bc.quoteField(self.name)
-    
-        if self.externaltype == 'char':
-            if self.length is None:
-                pre = [name, '%s' % (self.internaltype)]
-            else:
-                pre = [name, '%s(%s)' % (self.internaltype, str(self.length))]
-        else:
-            pre = [name, self.internaltype]
+        pre = [name, self.get_type()]
+        
         if self.has_default:
             pre.append('DEFAULT')
             pre.append(self.default)
@@ -430,27 +568,39 @@ class Table(
             'triggers': 'load_triggers',
             'rules': 'load_rules'}
     
+    def set_catalog(self, data):
+        """
+        Set columns, indexes, constraints and triggers from catalog rows,
+        as returned by table_catalog(), so they're not lazy loaded.
+        """
+        
+        self.columns = ObjectList(
+            (i['name'], Column.factory(self.conn, **i))
+            for i in data['columns'])
+        
+        self.indexes = ObjectList(
+            (i['name'], Index.factory(self.conn, **i))
+            for i in data['indexes'])
+        
+        self.constraints = ObjectList(
+            (i['name'], CheckConstraint.factory(self.conn, **i))
+            for i in data['check_constraints'])
+        self.constraints.extend(
+            (i['name'], ForeignKeyConstraint.factory(self.conn, **i))
+            for i in data['foreign_key_constraints'])
+        
+        self.triggers = ObjectList(
+            (i['name'], Trigger.factory(self.conn, **i))
+            for i in data['triggers'])
+    
     def load_indexes(self):
         """ Lazy load indexes """
     
-        self.indexes = ObjectList()
-        
         # Data must be grouped properly
-        last = None
-        data = []
-        for i in indexes(self.conn, self.name, self.schema):
-            if last == i['name']:
-                data[len(data) - 1]['columns'].append(i['column'])
-            else:
-                i['columns'] = [i['column']]
-                del i['column']
-                data.append(i)
-            last = i['name']
-        
-        # Append objects
-        for i in data:
-            ind = Index.factory(self.conn, **i)
-            self.indexes.setattr(i['name'], ind)
+        data = group_index_columns(indexes(self.conn, self.name, self.schema))
+        
+        self.indexes = ObjectList(
+            (i['name'], Index.factory(self.conn, **i)) for i in data)
         return self.indexes
     
     @staticmethod
@@ -464,24 +614,43 @@ class Table(
         tbl.owner = owner
         return tbl
     
-    def create_table(self):
-        # TODO: Rules
-    
+    def get_create(self, partition=None):
+        """
+        Get CREATE TABLE statement, without indexes or constraints.
+        partition is the table's row from partitions(), if it's partitioned
+        or a partition. Partitions are created with PARTITION OF, taking
+        their columns from the parent.
+        """
+        
         bc = pgsql.BaseClause()
         
         path = '.'.join([
             bc.quoteField(self.schema),
             bc.quoteField(self.name)])
+        
+        if partition is not None and partition['partition_bound'] is not None:
+            parent = '.'.join([
+                bc.quoteField(partition['parent_schema']),
+                bc.quoteField(partition['parent_table'])])
+            create_table = ['CREATE TABLE', path, 'PARTITION OF', parent,
+                partition['partition_bound']]
+        else:
+            create_table = ['CREATE TABLE', path, '(\n']
+            columns = []
             
-        create_table = ['CREATE TABLE', path, '(\n']
-        columns = []
-        indexes = []
+            for name, obj in self.columns:
+                columns.append(str(obj))
+            
+            create_table.extend([',\n'.join(columns), '\n)'])
         
-        for name, obj in self.columns:
-            columns.append(str(obj))
+        if partition is not None and partition['partition_key'] is not None:
+            create_table.extend(['PARTITION BY', partition['partition_key']])
+        return ' '.join(create_table)
+    
+    def create_table(self):
+        # TODO: Rules
         
-        create_table.extend([',\n'.join(columns), '\n)'])
-        yield ' '.join(create_table)
+        yield self.get_create()
         
         for name, obj in self.indexes:
             yield str(obj)
@@ -493,8 +662,7 @@ class Table(
             yield str(obj)
     
     def __str__(self):
-        lst = list(self.create_table())
-        return ';\n'.join(lst) + ';'
+        return ';\n'.join(self.create_table()) + ';'
 
 
 class Sequence(Relation):
@@ -509,6 +677,12 @@ class Sequence(Relation):
         'max_value',
         'min_value']
 
+    def __init__(self):
+        # last_value changes with every nextval(), so it isn't pickled, and
+        # is read from the server when accessed on a cached sequence
+        self.__dict__['__attributes'] = {
+            'last_value': 'load_last_value'}
+    
     @staticmethod
     def factory(conn, **kwargs):
         """ Factory method """
@@ -522,6 +696,26 @@ class Sequence(Relation):
             seq[k] = v
         return seq
     
+    def __getstate__(self):
+        state = Relation.__getstate__(self)
+        state.pop('last_value', None)
+        return state
+    
+    def load_last_value(self):
+        """ Get current last value of the sequence, from the server """
+        
+        bc = pgsql.BaseClause()
+        path = '.'.join([
+            bc.quoteField(self.schema),
+            bc.quoteField(self.name)])
+        
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT last_value FROM %s' % (path))
+        last_value = cursor.fetchone()[0]
+        cursor.close()
+        
+        return last_value
+    
     def get_create_alter(self, type='create'):
         """ Get CREATE/ALTER for sequence """
         
@@ -654,6 +848,7 @@ class Database(
             'schemas': 'load_schemas',
             'views': 'load_views'}
         self.search_path = ['public']
+        self.snapshot = False
 
     def set_search_path(self, search_path):
         """ Set default search path for session """
@@ -675,23 +870,219 @@ class Database(
             if k in self.__dict__:
                 del self.__dict__[k]
 
+    def in_search_path(self, name):
+        """
+        Returns True when schema name is in the search path. A search path
+        of None matches all schemas, except for the system schemas.
+        """
+        
+        path = self.search_path
+        if path is None:
+            return not (name.startswith('pg_')
+                or name == 'information_schema')
+        elif type(path) == str:
+            return name == path
+        return name in path
+    
+    def ddl(self):
+        """
+        Generator, which yields DDL statements for the search path, in
+        dependency order: schemas, sequences, tables, check constraints,
+        views, indexes, foreign keys, then triggers. A search path of None
+        dumps all schemas, except for the system schemas.
+        
+        Each kind of object is fetched with one catalog query, through a
+        named cursor, and turned into statements as rows arrive, without
+        building the Relation tree. Output starts right away, and memory use
+        is bounded by the largest table definition, rather than by the
+        number of tables.
+        
+        Partitioned tables are created with PARTITION BY, and partitions
+        with PARTITION OF, after all other tables, parents first. Indexes
+        and constraints which partitions inherit from their parent are
+        left to the parent. Columns of partitions come from the parent, so
+        defaults or NOT NULL set on a partition only aren't reproduced.
+        """
+        
+        conn = self.conn
+        path = self.search_path
+        if path is None:
+            path = [i['name'] for i in schemas(conn)
+                if self.in_search_path(i['name'])]
+        
+        for i in schemas(conn):
+            if i['name'] != 'public' and self.in_search_path(i['name']):
+                yield str(Schema.factory(conn, **i))
+        
+        for i in sequences(conn, path, stream=True):
+            yield Sequence.factory(conn, **i).get_create()
+        
+        # Partitions wait until their parent, and its parents, are created
+        parts = dict(((i['schema'], i['table']), i)
+            for i in partitions(conn, path))
+        
+        def depth(key):
+            res = 0
+            while key in parts and parts[key]['parent_table'] is not None:
+                key = (parts[key]['parent_schema'], parts[key]['parent_table'])
+                res += 1
+            return res
+        
+        # Columns are ordered by schema and table, so each table is done
+        # once its last column has been read
+        kinds = [PG_CLASS_TABLE, PG_CLASS_PARTITIONED]
+        rows = columns(conn, None, path, kinds, stream=True)
+        key = lambda i: (i['schema'], i['table'])
+        deferred = []
+        for (schema, name), cols in itertools.groupby(rows, key):
+            tbl = Table.factory(conn, schema, name, None)
+            tbl.columns = ObjectList(
+                (i['name'], Column.factory(conn, **i)) for i in cols)
+            
+            part = parts.get((schema, name))
+            if part is not None and part['partition_bound'] is not None:
+                deferred.append((depth((schema, name)), schema, name,
+                    tbl.get_create(part)))
+            else:
+                yield tbl.get_create(part)
+        
+        for i in sorted(deferred):
+            yield i[-1]
+        
+        for i in check_constraints(conn, None, path, stream=True,
+                inherited=False):
+            yield str(CheckConstraint.factory(conn, **i))
+        
+        for i in views(conn, path, stream=True):
+            yield str(View.factory(conn, **i))
+        
+        rows = indexes(conn, None, path, stream=True, kinds=kinds,
+            inherited=False)
+        for i in iter_index_columns(rows):
+            yield str(Index.factory(conn, **i))
+        
+        for i in foreign_key_constraints(conn, None, path, stream=True,
+                inherited=False):
+            yield str(ForeignKeyConstraint.factory(conn, **i))
+        
+        for i in non_referential_triggers(conn, None, path, stream=True):
+            yield str(Trigger.factory(conn, **i))
+    
+    def dump(self, fileobj):
+        """
+        Write DDL for the search path to fileobj, one statement at a time,
+        as produced by ddl(). Returns number of statements written.
+        """
+        
+        count = 0
+        for statement in self.ddl():
+            fileobj.write(statement + ';\n\n')
+            count += 1
+        return count
+
     def load_schemas(self):
         """ Lazy load schemas """
         
         self.schemas = ObjectList()
         for i in schemas(self.conn):
             s = Schema.factory(self.conn, **i)
+            s.snapshot = self.snapshot
             self.schemas.setattr(i['name'], s)
         
         return self.schemas
 
     @staticmethod
-    def get(conn, search_path=['public']):
+    def get(conn, search_path=['public'], snapshot=False):
+        """
+        Get Database object. When snapshot is True, tables are loaded with
+        load_snapshot(), which fetches the columns, indexes, constraints and
+        triggers of all tables in a handful of queries, instead of several
+        queries per table.
+        """
+        
         dbdef = Database()
         dbdef.search_path = search_path
         dbdef.conn = conn
         dbdef.name = current_database(conn)
+        dbdef.snapshot = snapshot
+        
+        return dbdef
+    
+    def save(self, filename, fingerprint=None):
+        """
+        Pickle Database, along with everything loaded under it, to filename.
+        The file is written to a temporary file first, and renamed, so
+        readers never see a partial file. Connections are not saved.
+        """
+        
+        if fingerprint is None:
+            fingerprint = catalog_fingerprint(self.conn, self.search_path)
+        
+        data = {
+            'version': SCHEMA_CACHE_VERSION,
+            'fingerprint': fingerprint,
+            'search_path': self.search_path,
+            'database': self}
+        
+        fd, tmpname = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(filename)),
+            prefix='.doze-schema-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            
+            if os.name == 'nt' and os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmpname, filename)
+        except:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+    
+    @staticmethod
+    def load(conn, filename, fingerprint=None, search_path=None):
+        """
+        Load Database from a file written by save(), and attach conn to it.
+        Returns None when the file is missing or unreadable, or when it
+        doesn't match fingerprint / search_path. Only load files you trust,
+        as they're unpickled.
+        """
+        
+        try:
+            with open(filename, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            return None
+        
+        if (type(data) != dict
+        or data.get('version') != SCHEMA_CACHE_VERSION
+        or (fingerprint is not None and data['fingerprint'] != fingerprint)
+        or (search_path is not None and data['search_path'] != search_path)):
+            return None
+        
+        dbdef = data['database']
+        dbdef.set_connection(conn)
+        return dbdef
+    
+    @staticmethod
+    def get_cached(conn, filename, search_path=['public']):
+        """
+        Get Database object from the schema cache in filename, if the
+        catalog hasn't changed since it was written, which costs a single
+        query. Otherwise, the catalog is loaded with a snapshot, and written
+        to filename for next time.
+        """
+        
+        fingerprint = catalog_fingerprint(conn, search_path)
+        dbdef = Database.load(conn, filename, fingerprint, search_path)
+        if dbdef is not None:
+            return dbdef
+        
+        dbdef = Database.get(conn, search_path, snapshot=True)
+        for i in ['schemas', 'tables', 'sequences', 'views']:
+            getattr(dbdef, i)
         
+        dbdef.save(filename, fingerprint)
         return dbdef
 
 class UniqueConstraint(Relation): pass
@@ -1,4 +1,5 @@
 
+import sqlite3
 from doze import *
 import doze.backend.generic as generic
 
@@ -9,29 +10,18 @@ def connection_is_ready(conn):
     return True
 
 class QueryResultSqlite(generic.QueryResult):
-    def __del__(self):
-        self.cursor.close()
-    
-    def __iter__(self):
-        res = self.cursor.fetchone()
-        if res is None:
-            raise StopIteration()
-        
-        if self.cursorDescrInit == False:
-            self.initCursorDescr()
-    
-        while not res == None:
-            if self.fetch.__name__ == 'dict':
-                yield dict(zip(self.labels, res))
-            else:
-                yield res
-            res = self.cursor.fetchone()
-        
-        if self.destroy == True:
+    def closeCursor(self):
+        # sqlite3 cursors have no "closed" attribute, and raise when closed
+        # after their connection
+        if self.cursor is None:
+            return
+        try:
             self.cursor.close()
+        except sqlite3.ProgrammingError:
+            pass
 
     def next(self):
-        res = self.cursor.fetchone()
+        res = self.nextRow()
         if res is None:
             return None
         
@@ -39,9 +29,7 @@ class QueryResultSqlite(generic.QueryResult):
             self.initCursorDescr()
 
         self.rownumber += 1
-        if self.fetch.__name__ == 'dict':
-            return dict(zip(self.labels, res))
-        return res
+        return self.convertRow(res)
 
 class BaseClause(generic.BaseClause):
     # See: http://www.sqlite.org/datatype3.html
@@ -49,13 +37,22 @@ class BaseClause(generic.BaseClause):
 
     # Escape pattern
     escapePattern = '?'
+    
+    # Maximum number of parameters per statement (SQLITE_MAX_VARIABLE_NUMBER)
+    # See: http://www.sqlite.org/limits.html
+    if sqlite3.sqlite_version_info >= (3, 32, 0):
+        maxParameters = 32766
+    else:
+        maxParameters = 999
 
 class Where(generic.Where, BaseClause): pass
+class WhereGroup(generic.WhereGroup, BaseClause): pass
 class Join(generic.Join, BaseClause): pass
 class QueryResult(generic.QueryResult): pass
 
 class Builder(generic.Builder, BaseClause):
-    @ExceptionWrapper
-    def asObject(self, fetchall = False, server = False, destroy = True, fetch = dict):
-        cursor = self.cursor(server)
-        return QueryResultSqlite(cursor, destroy, fetch)
+    # Class used by asObject() to wrap cursors
+    queryResultClass = QueryResultSqlite
+    
+    # Class used to build conditions, such as by paginate()
+    whereClass = Where
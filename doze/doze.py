@@ -1,6 +1,8 @@
 
 # -*- coding: utf-8 -*-
 
+import threading
+
 VALUE = 1
 FIELD = 2
 
@@ -34,6 +36,29 @@ def ExceptionWrapper(func):
             return func(self, *args, **kargs)
     return wrapper
 
+class Param(object):
+    """
+    **
+    * Named placeholder for a value. Params can be used anywhere a value is
+    * accepted, such as Where(), values() and set(). When a Builder is
+    * compiled into a QueryTemplate, each Param becomes a slot, which is
+    * filled in by QueryTemplate.bind(), without rebuilding the SQL.
+    *
+    * Examples:
+    *
+    *   template = builder.select('*').from_('users')\
+    *       .where(Where('id').equals(Param('id'))).compile()
+    *
+    *   query, escape = template.sql(id=10)
+    **
+    """
+    
+    def __init__(self, name):
+        self.name = name
+    
+    def __repr__(self):
+        return 'Param(%s)' % (repr(self.name))
+
 class TableContext(object):
     """
     **
@@ -205,3 +230,124 @@ class TableContext(object):
             if v[1] == 'join':
                 yield [k, v[0]]
 
+class LRUCache(object):
+    """
+    **
+    * Bounded, thread-safe Least Recently Used cache. Once maxsize entries
+    * are stored, setting a new key evicts the entry which was used least
+    * recently. A maxsize of 0 disables the cache entirely.
+    *
+    * Examples:
+    *
+    *   cache = LRUCache(128)
+    *   cache.set('key', 'value')
+    *   print cache.get('key')
+    *
+    * When given, onEvict(key, value) is called for every entry evicted to
+    * make room, after the lock has been released.
+    **
+    """
+    
+    def __init__(self, maxsize = 1024, onEvict = None):
+        # Entries are kept in a circular, doubly linked list of
+        # [prev, next, key, value] links, with self.root as the sentinel.
+        self.maxsize = maxsize
+        self.onEvict = onEvict
+        self.lock = threading.Lock()
+        self.clear()
+    
+    def __contains__(self, key):
+        return key in self.links
+    
+    def __len__(self):
+        return len(self.links)
+    
+    def clear(self):
+        """ Remove all entries """
+        self.lock.acquire()
+        try:
+            root = []
+            root[:] = [root, root, None, None]
+            self.root = root
+            self.links = {}
+        finally:
+            self.lock.release()
+    
+    def get(self, key, default = None):
+        """ Get value for key, and mark it as recently used """
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is None:
+                return default
+            
+            # Move link to the front (most recently used)
+            root = self.root
+            prev, next = link[0], link[1]
+            prev[1] = next
+            next[0] = prev
+            last = root[0]
+            last[1] = root[0] = link
+            link[0] = last
+            link[1] = root
+            
+            return link[3]
+        finally:
+            self.lock.release()
+    
+    def set(self, key, value):
+        """ Set value for key, evicting the least recently used entry if full """
+        if self.maxsize <= 0:
+            return
+        
+        evicted = None
+        self.lock.acquire()
+        try:
+            root = self.root
+            link = self.links.get(key)
+            
+            if link is not None:
+                # Unlink, so it can be re-inserted at the front
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+            elif len(self.links) >= self.maxsize:
+                # Evict oldest
+                oldest = root[1]
+                oldest[0][1] = oldest[1]
+                oldest[1][0] = oldest[0]
+                del self.links[oldest[2]]
+                evicted = oldest
+            
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = link
+            self.links[key] = link
+        finally:
+            self.lock.release()
+        
+        if evicted is not None and self.onEvict is not None:
+            self.onEvict(evicted[2], evicted[3])
+    
+    def remove(self, key):
+        """ Remove key, if it exists """
+        self.lock.acquire()
+        try:
+            link = self.links.pop(key, None)
+            if link is not None:
+                link[0][1] = link[1]
+                link[1][0] = link[0]
+        finally:
+            self.lock.release()
+    
+    def keys(self):
+        """ Returns list of keys, from least to most recently used """
+        self.lock.acquire()
+        try:
+            keys = []
+            link = self.root[1]
+            while link is not self.root:
+                keys.append(link[2])
+                link = link[1]
+            return keys
+        finally:
+            self.lock.release()
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+import contextlib
+from doze import *
+
+class PoolError(DozeError): pass
+
+class ConnectionPool(object):
+    """
+    **
+    * Thread-safe pool of database connections, shared by all backends.
+    * Connections are opened with connect(), which takes no arguments, and
+    * are health-checked with isOpen() / isReady() when they're checked out.
+    * Connections are rolled back when they're checked in, and connections
+    * idle for longer than idle seconds are closed, down to minsize.
+    *
+    * A pool can be given to a Builder instead of a connection, in which case
+    * the Builder borrows a connection for the duration of execute() and
+    * asObject(). Backends provide a pool() helper, which takes the same
+    * parameters as their connect().
+    *
+    * Examples:
+    *
+    *   pool = ConnectionPool(lambda: pgsql.connect(host='127.0.0.1'),
+    *       minsize=2, maxsize=20, isOpen=pgsql.connection_is_open,
+    *       isReady=pgsql.connection_is_ready)
+    *
+    *   with pool.connection() as db:
+    *       pgsql.Builder(db).select('*').from_('users').asObject()
+    *
+    *   pgsql.Builder(pool).update('users').set({'active': True}).execute()
+    *
+    **
+    """
+
+    def __init__(self, connect, minsize = 1, maxsize = 10, idle = 300,
+                 timeout = None, isOpen = None, isReady = None):
+        if maxsize < 1 or minsize > maxsize:
+            raise ValueError('Invalid pool size: minsize=%d, maxsize=%d'
+                % (minsize, maxsize))
+
+        self.connect = connect
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.idle = idle
+        self.timeout = timeout
+        self.isOpen = isOpen
+        self.isReady = isReady
+
+        # Idle connections, as [connection, time checked in], with the most
+        # recently used last
+        self.idleConnections = []
+        self.size = 0
+        self.closed = False
+        self.condition = threading.Condition(threading.Lock())
+
+        for i in range(0, minsize):
+            self.idleConnections.append([self.connect(), time.time()])
+            self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def checkConnection(self, conn):
+        """ Returns True when connection passes the health checks """
+        try:
+            if self.isOpen is not None and not self.isOpen(conn):
+                return False
+            if self.isReady is not None and not self.isReady(conn):
+                return False
+        except Exception:
+            return False
+        return True
+
+    def closeConnection(self, conn):
+        """ Close connection, ignoring errors """
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def evict(self):
+        """
+        Close connections which have been idle for longer than self.idle
+        seconds, keeping at least self.minsize connections open. Must be
+        called with self.condition held.
+        """
+        if self.idle is None:
+            return
+
+        expires = time.time() - self.idle
+        while (len(self.idleConnections) > 0 and self.size > self.minsize
+        and self.idleConnections[0][1] < expires):
+            conn = self.idleConnections.pop(0)[0]
+            self.size -= 1
+            self.closeConnection(conn)
+
+    def get(self, timeout = None):
+        """
+        **
+        * Check out a connection. Idle connections are reused, most recently
+        * used first, and dropped when they fail the health checks. When
+        * maxsize connections are checked out, waits up to timeout seconds
+        * (self.timeout by default, or forever when None) for one to be
+        * checked in.
+        *
+        * @param    timeout     float
+        * @return   object
+        **
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            conn = None
+            self.condition.acquire()
+            try:
+                while True:
+                    if self.closed:
+                        raise PoolError('Connection pool is closed')
+
+                    self.evict()
+                    if len(self.idleConnections) > 0:
+                        # Health-checked outside of the lock, as the checks
+                        # may round-trip to the server
+                        conn = self.idleConnections.pop()[0]
+                        break
+
+                    if self.size < self.maxsize:
+                        # Reserve a slot, and connect outside of the lock
+                        self.size += 1
+                        break
+
+                    if deadline is None:
+                        self.condition.wait()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise PoolError('Timed out waiting for a connection.'
+                                + ' All ' + str(self.maxsize) + ' connections'
+                                + ' are in use')
+                        self.condition.wait(remaining)
+            finally:
+                self.condition.release()
+
+            if conn is None:
+                break
+
+            if self.checkConnection(conn):
+                return conn
+
+            self.closeConnection(conn)
+            self.condition.acquire()
+            try:
+                self.size -= 1
+                self.condition.notify()
+            finally:
+                self.condition.release()
+
+        try:
+            return self.connect()
+        except:
+            self.condition.acquire()
+            try:
+                self.size -= 1
+                self.condition.notify()
+            finally:
+                self.condition.release()
+            raise
+
+    def put(self, conn, discard = False):
+        """
+        **
+        * Check in a connection. Open transactions are rolled back. The
+        * connection is closed instead when discard is True, when it fails
+        * to roll back, or when the pool has been closed.
+        *
+        * @param    conn        object
+        * @param    discard     bool
+        **
+        """
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        if not discard and not self.checkConnection(conn):
+            discard = True
+
+        self.condition.acquire()
+        try:
+            if discard or self.closed:
+                self.size -= 1
+                self.closeConnection(conn)
+            else:
+                self.idleConnections.append([conn, time.time()])
+                self.evict()
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    @contextlib.contextmanager
+    def connection(self, timeout = None):
+        """
+        Context manager, which checks out a connection, and checks it back
+        in when done. The connection is committed when the block succeeds.
+        """
+        conn = self.get(timeout)
+        try:
+            yield conn
+            conn.commit()
+        except:
+            self.put(conn)
+            raise
+        self.put(conn)
+
+    def close(self):
+        """ Close idle connections, and any connection checked in later """
+        self.condition.acquire()
+        try:
+            self.closed = True
+            while len(self.idleConnections) > 0:
+                self.closeConnection(self.idleConnections.pop()[0])
+                self.size -= 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
@@ -17,4 +17,7 @@ setup(
     license='BSD',
     packages=find_packages(),
     include_package_data=True,
-    install_requires=requires)
+    install_requires=requires,
+    entry_points={
+        'console_scripts': [
+            'doze-pgdump = doze.backend.pgsql.relations.dump:main']})
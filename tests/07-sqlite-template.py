@@ -0,0 +1,64 @@
+import os, sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+import sqlite3
+
+CREATE_TEST_TABLE = (
+    "CREATE TABLE users ( "
+        "id INTEGER, "
+        "name CHAR(16) "
+    ");"
+)
+
+def main():
+    db = sqlite3.connect(':memory:')
+    bd = dz_sqlite.Builder(db)
+
+    cursor = db.cursor()
+    cursor.execute(CREATE_TEST_TABLE)
+    cursor.close()
+
+    # Compile INSERT once, then bind values for each row
+    insert = bd.insertInto('users').values({
+        'id': doze.Param('id'),
+        'name': doze.Param('name')}).compile()
+
+    for i in range(10):
+        bd.fromTemplate(insert, id=i, name='user%d' % (i)).execute()
+    db.commit()
+
+    # Compile SELECT once
+    select = bd.select('id, name').from_('users').where(
+        dz_sqlite.Where('id').equals(doze.Param('id'))).compile()
+
+    assert select.params == ('id',)
+    query, escape = select.sql(id=3)
+    assert escape == [3]
+    assert select.sql(4) == (query, [4])
+
+    for i in range(10):
+        rows = [r for r in bd.fromTemplate(select, id=i).asObject()]
+        assert len(rows) == 1
+        assert rows[0]['name'] == 'user%d' % (i)
+
+    # Unbound parameters are an error
+    try:
+        select.bind()
+        assert False
+    except doze.DozeError:
+        pass
+
+    # Templates are immutable
+    try:
+        select.query = 'DELETE FROM users'
+        assert False
+    except AttributeError:
+        pass
+
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
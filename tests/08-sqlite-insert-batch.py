@@ -0,0 +1,83 @@
+import os, sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+import sqlite3
+
+CREATE_TEST_TABLE = (
+    "CREATE TABLE numbers ( "
+        "a INTEGER, "
+        "b INTEGER, "
+        "c CHAR(8) "
+    ");"
+)
+
+def rows(start, count):
+    for i in range(start, start + count):
+        yield {'a': i, 'b': i * 2, 'c': str(i)}
+
+def count(bd):
+    res = bd.select('COUNT(*) AS n').from_('numbers').asObject()
+    return res.next()['n']
+
+def main():
+    db = sqlite3.connect(':memory:')
+    bd = dz_sqlite.Builder(db)
+
+    cursor = db.cursor()
+    cursor.execute(CREATE_TEST_TABLE)
+    cursor.close()
+
+    # Multi-row INSERT, split into batches of 100 rows
+    bd.insertInto('numbers').values(rows(0, 1050), batch=100)
+    batches = [escape for query, escape in bd.insertBatches()]
+    assert len(batches) == 11
+    assert len(batches[0]) == 300
+    assert len(batches[10]) == 150
+
+    inserted = bd.insertInto('numbers').values(rows(0, 1050), batch=100).execute()
+    assert inserted == 1050
+    assert count(bd) == 1050
+
+    # Batch size is capped by the driver's parameter limit
+    bd.insertInto('numbers').values(rows(0, 1), batch=1000000)
+    assert bd.insertRowsPerBatch(3) == bd.maxParameters // 3
+
+    inserted = bd.insertInto('numbers').values(rows(1050, 20000),
+        batch=1000000).execute()
+    assert inserted == 20000
+    assert count(bd) == 21050
+
+    # Batch size is capped by the estimated statement size
+    bd.maxStatementBytes = 1000
+    bd.insertInto('numbers').values([{'a': 0, 'b': 0, 'c': 'x' * 100}] * 20,
+        batch=10)
+    batches = [escape for query, escape in bd.insertBatches()]
+    assert [len(i) / 3 for i in batches] == [3, 3, 3, 1] * 2
+    bd.maxStatementBytes = None
+
+    # executemany()
+    inserted = bd.insertInto('numbers').values(rows(21050, 500),
+        many=True).execute()
+    assert inserted == 500
+    assert count(bd) == 21550
+
+    # Single statement for a list of rows
+    query, escape = bd.insertInto('numbers').values(list(rows(0, 2))).sql()
+    assert query.count('(?, ?, ?)') == 2
+    assert len(escape) == 6
+
+    # Rows with mismatched columns are an error
+    try:
+        bd.insertInto('numbers').values([{'a': 1}, {'b': 2}]).sql()
+        assert False
+    except doze.DozeError:
+        pass
+
+    db.commit()
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
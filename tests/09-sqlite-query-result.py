@@ -0,0 +1,80 @@
+import os, sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+import doze.backend.generic as generic
+import sqlite3
+import collections
+
+CREATE_TEST_TABLE = (
+    "CREATE TABLE numbers ( "
+        "id INTEGER, "
+        "name CHAR(8) "
+    ");"
+)
+
+def get_db():
+    db = sqlite3.connect(':memory:')
+    cursor = db.cursor()
+    cursor.execute(CREATE_TEST_TABLE)
+    cursor.close()
+
+    bd = dz_sqlite.Builder(db)
+    bd.insertInto('numbers').values(
+        [{'id': i, 'name': 'n%d' % (i)} for i in range(1000)]).execute()
+    db.commit()
+    return db
+
+def main():
+    db = get_db()
+    bd = dz_sqlite.Builder(db)
+
+    # fetchmany() batches, through iteration
+    res = bd.select('id, name').from_('numbers').order('id').asObject(arraysize=64)
+    rows = [r for r in res]
+    assert len(rows) == 1000
+    assert rows[999] == {'id': 999, 'name': 'n999'}
+
+    # fetchmany() batches, mixing next() and iteration
+    res = bd.select('id, name').from_('numbers').order('id').asObject(
+        arraysize=64, fetch=tuple)
+    for i in range(100):
+        assert res.next() == (i, 'n%d' % (i))
+    assert res.rownumber == 99
+
+    rows = [r for r in res]
+    assert len(rows) == 900
+    assert rows[0] == (100, 'n100')
+
+    # Server-side cursors default to buffered fetching
+    res = bd.select('id').from_('numbers').asObject(server=True)
+    assert res.arraysize == bd.serverArraysize
+    assert len([r for r in res]) == 1000
+
+    # Row shapes
+    query = bd.select('id, name, id AS self').from_('numbers').order('id')
+
+    res = query.asObject(fetch=collections.namedtuple)
+    row = res.next()
+    assert row.id == 0 and row.name == 'n0' and row[2] == 0
+
+    # Classes are generated once per set of labels
+    assert type(query.asObject(fetch=collections.namedtuple).next())\
+        is type(row)
+
+    res = query.asObject(fetch=generic.Record, arraysize=100)
+    rows = [r for r in res]
+    assert len(rows) == 1000
+    assert rows[5].id == 5 and rows[5].name == 'n5' and rows[5].self == 5
+    assert rows[5][1] == 'n5' and tuple(rows[5]) == (5, 'n5', 5)
+    assert not hasattr(rows[5], '__dict__')
+
+    res = query.asObject(fetch=tuple)
+    assert res.next() == (0, 'n0', 0)
+
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os, sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+import sqlite3
+import array
+
+CREATE_TEST_TABLE = (
+    "CREATE TABLE measures ( "
+        "id INTEGER, "
+        "value REAL, "
+        "label CHAR(8), "
+        "extra INTEGER "
+    ");"
+)
+
+def main():
+    db = sqlite3.connect(':memory:')
+    cursor = db.cursor()
+    cursor.execute(CREATE_TEST_TABLE)
+    cursor.close()
+
+    rows = []
+    for i in range(0, 5000):
+        rows.append({
+            'id': i,
+            'value': None if i % 7 == 0 else i * 0.5,
+            'label': 'l%d' % (i),
+            'extra': None if i < 5 else (i if i < 3000 else 'many'),
+        })
+
+    bd = dz_sqlite.Builder(db)
+    bd.insertInto('measures').values(rows, batch=500).execute()
+
+    columns = bd.select('id, value, label, extra').from_('measures')\
+        .order('id').asColumns(arraysize=128)
+    assert len(columns) == 5000
+
+    # Numeric columns are typed arrays, with a NULL mask when needed
+    assert isinstance(columns['id'], array.array)
+    assert list(columns['id']) == range(0, 5000)
+    assert columns.masks['id'] is None
+
+    assert columns['value'].typecode == 'd'
+    assert columns['value'][1] == 0.5
+    assert columns.masks['value'][0] == 1 and columns.masks['value'][1] == 0
+
+    # Text columns, and columns with values which don't fit, are lists
+    assert columns['label'][10] == 'l10'
+    assert columns['extra'][0:6] == [None, None, None, None, None, 5]
+    assert columns['extra'][4999] == 'many'
+
+    # NumPy is optional
+    try:
+        import numpy
+        arrays = bd.select('id, value').from_('measures').asArrays()
+        assert arrays['id'].sum() == sum(range(0, 5000))
+        assert arrays['value'].mask[0]
+    except ImportError:
+        try:
+            bd.select('id').from_('measures').asArrays()
+            assert False
+        except doze.NotSupported:
+            pass
+
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import os, sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+import sqlite3
+import tempfile
+import threading
+import time
+
+CREATE_TEST_TABLE = (
+    "CREATE TABLE numbers ( "
+        "id INTEGER, "
+        "name CHAR(8) "
+    ");"
+)
+
+def main():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+
+    opened = []
+    def connect():
+        db = sqlite3.connect(path, check_same_thread=False)
+        opened.append(db)
+        return db
+
+    pool = doze.ConnectionPool(connect, minsize=1, maxsize=3, timeout=0.1)
+    assert len(pool) == 1
+
+    with pool.connection() as db:
+        db.cursor().execute(CREATE_TEST_TABLE)
+
+    # Builder borrows a connection per execute(), and commits it
+    bd = dz_sqlite.Builder(pool)
+    inserted = bd.insertInto('numbers').values(
+        [{'id': i, 'name': 'n%d' % (i)} for i in range(100)]).execute()
+    assert inserted == 100
+    assert bd.getConnection() is None
+    assert len(opened) == 1
+
+    # asObject() holds on to the connection until the result is closed
+    res = bd.select('id').from_('numbers').order('id').asObject()
+    assert len(pool.idleConnections) == 0
+    assert len([r for r in res]) == 100
+    assert len(pool.idleConnections) == 1
+
+    # Checkout is bounded by maxsize
+    held = [pool.get() for i in range(3)]
+    assert len(opened) == 3
+    try:
+        pool.get()
+        assert False
+    except doze.PoolError:
+        pass
+
+    # Connections failing the health check are replaced
+    for db in held:
+        pool.put(db)
+
+    pool.isOpen = lambda db: db is not opened[0]
+    db = pool.get()
+    assert db is not opened[0]
+    pool.put(db)
+
+    # Health checks run without holding the pool lock
+    locked = []
+    def isOpen(db):
+        if pool.condition.acquire(False):
+            pool.condition.release()
+        else:
+            locked.append(db)
+        return True
+    pool.isOpen = isOpen
+    pool.put(pool.get())
+    pool.isOpen = None
+    assert locked == []
+
+    # Concurrent checkout from several threads
+    errors = []
+    def worker():
+        try:
+            for i in range(20):
+                res = dz_sqlite.Builder(pool).select('COUNT(*) AS n')\
+                    .from_('numbers').asObject()
+                assert res.next()['n'] == 100
+                res.close()
+        except Exception, ex:
+            errors.append(ex)
+
+    pool.timeout = None
+    threads = [threading.Thread(target=worker) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(pool) <= 3
+
+    # asObject() commits when the result is closed, as execute() does
+    res = dz_sqlite.Builder(pool).deleteFrom('numbers')\
+        .where(dz_sqlite.Where('id').gte(90)).asObject()
+    res.close()
+    res = bd.select('COUNT(*) AS n').from_('numbers').asObject()
+    assert res.next()['n'] == 90
+    res.close()
+
+    # Errors swallowed by onError still check the connection back in
+    errors = []
+    res = dz_sqlite.Builder(pool, onError=errors.append)\
+        .select('*').from_('missing').asObject()
+    if res is not None:
+        res.close()
+    assert len(errors) == 1
+    assert isinstance(errors[0], sqlite3.OperationalError)
+    assert len(pool.idleConnections) == len(pool)
+
+    # Idle connections above minsize are evicted
+    pool.idle = 0.01
+    time.sleep(0.05)
+    pool.put(pool.get())
+    assert len(pool) == 1
+
+    pool.close()
+    os.unlink(path)
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+import doze.backend.generic as generic
+import sqlite3
+import time
+
+CREATE_TEST_TABLES = [
+    "CREATE TABLE config (name CHAR(16), value INTEGER)",
+    "CREATE TABLE users (id INTEGER, name CHAR(16))",
+]
+
+class CountingConnection(object):
+    """ Wraps a sqlite3 connection, counting queries executed """
+
+    def __init__(self, db):
+        self.db = db
+        self.queries = 0
+
+    def cursor(self):
+        conn = self
+        cursor = self.db.cursor()
+
+        class Cursor(object):
+            def __getattr__(self, name):
+                return getattr(cursor, name)
+
+            def execute(self, query, escape = ()):
+                conn.queries += 1
+                return cursor.execute(query, escape)
+
+        return Cursor()
+
+    def commit(self):
+        self.db.commit()
+
+def main():
+    raw = sqlite3.connect(':memory:')
+    for i in CREATE_TEST_TABLES:
+        raw.execute(i)
+    db = CountingConnection(raw)
+
+    cache = generic.ResultCache(maxsize=2, ttl=None)
+    bd = dz_sqlite.Builder(db).setResultCache(cache)
+    bd.insertInto('config').values([{'name': 'a', 'value': 1},
+        {'name': 'b', 'value': 2}]).execute()
+
+    def config(name):
+        return [r for r in bd.select('value').from_('config')\
+            .where(dz_sqlite.Where('name').equals(name)).asObject()]
+
+    # Second run is served from the cache
+    before = db.queries
+    assert config('a') == [{'value': 1}]
+    assert config('a') == [{'value': 1}]
+    assert db.queries == before + 1
+    assert cache.hits == 1
+
+    # Row shapes work as usual on cached results
+    res = bd.select('name, value').from_('config').order('name')\
+        .asObject(fetch=tuple)
+    assert [r for r in res] == [(u'a', 1), (u'b', 2)]
+    res = bd.select('name, value').from_('config').order('name')\
+        .asObject(fetch=generic.Record)
+    assert [r.value for r in res] == [1, 2]
+
+    # Least recently used entry is evicted past maxsize
+    assert len(cache) == 2
+    config('b')
+    assert len(cache) == 2
+    before = db.queries
+    config('a')
+    assert db.queries == before + 1
+
+    # Writes invalidate entries for their table only
+    bd.select('*').from_('users').asObject()
+    assert len(cache) == 2
+    bd.update('config').set({'value': 10})\
+        .where(dz_sqlite.Where('name').equals('a')).execute()
+    assert len(cache) == 1
+    assert config('a') == [{'value': 10}]
+
+    # Joined tables are tagged too
+    bd.select('name').from_('users u')\
+        .join(dz_sqlite.Join(['config', 'c'])\
+            .where(dz_sqlite.Where('name').equals('name', kind=doze.FIELD)))\
+        .asObject()
+    assert cache.invalidate('"config"') == 2
+
+    # Tables in WHERE sub-queries are tagged
+    sub = dz_sqlite.Builder().select('value').from_('config')
+    bd.select('name').from_('users')\
+        .where(dz_sqlite.Where('id').isIn(sub)).asObject()
+    assert cache.invalidate('config') == 1
+
+    # Writes invalidate again once committed, dropping entries cached by
+    # other builders in between
+    other = dz_sqlite.Builder(db).setResultCache(cache)
+    bd.update('config').set({'value': 20})\
+        .where(dz_sqlite.Where('name').equals('a')).execute()
+    other.select('value').from_('config').asObject()
+    assert len(cache) == 1
+    bd.commit()
+    assert len(cache) == 0
+    assert len(bd.uncommittedTables) == 0
+
+    # Templates are tagged, and invalidate, like the builders they came from
+    cache.clear()
+    read = dz_sqlite.Builder().select('value').from_('config')\
+        .where(dz_sqlite.Where('name').equals(doze.Param('name'))).compile()
+    write = dz_sqlite.Builder().insertInto('config')\
+        .values({'name': doze.Param('name'), 'value': 3}).compile()
+    assert read.tables == ('config',) and write.destination == 'config'
+    assert [r for r in bd.fromTemplate(read, 'c').asObject()] == []
+    bd.fromTemplate(write, 'c').execute()
+    assert len(cache) == 0
+    assert [r for r in bd.fromTemplate(read, 'c').asObject()] ==\
+        [{'value': 3}]
+    bd.commit()
+    cache.clear()
+
+    # Builders on other connections don't share entries
+    raw2 = sqlite3.connect(':memory:')
+    for i in CREATE_TEST_TABLES:
+        raw2.execute(i)
+    bd2 = dz_sqlite.Builder(raw2).setResultCache(cache)
+    assert config('a') == [{'value': 20}]
+    assert [r for r in bd2.select('value').from_('config')\
+        .where(dz_sqlite.Where('name').equals('a')).asObject()] == []
+
+    # Entries expire after ttl
+    bd.setResultCache(cache, ttl=0.01)
+    config('b')
+    time.sleep(0.05)
+    before = db.queries
+    config('b')
+    assert db.queries == before + 1
+
+    # Large results aren't stored
+    cache.clear()
+    cache.maxrows = 1
+    bd.select('*').from_('config').asObject()
+    assert len(cache) == 0
+
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+import sys
+sys.path.append('../doze')
+
+import doze.backend.sqlite as dz_sqlite
+import doze.backend.generic as generic
+import sqlite3
+import json
+
+CREATE_TEST_TABLE = (
+    "CREATE TABLE numbers ( "
+        "id INTEGER, "
+        "name CHAR(8) "
+    ");"
+)
+
+def main():
+    db = sqlite3.connect(':memory:')
+    db.cursor().execute(CREATE_TEST_TABLE)
+
+    events = []
+    hooks = generic.QueryHooks()
+    hooks.add(lambda event, trace: events.append(event))
+    stats = generic.QueryStats()
+    hooks.add(stats)
+
+    bd = dz_sqlite.Builder(db).setHooks(hooks)
+    bd.insertInto('numbers').values(
+        [{'id': i, 'name': 'n%d' % (i)} for i in range(100)], batch=40).execute()
+
+    # Batched INSERT fires compile / execute hooks per statement
+    assert events.count(generic.HOOK_AFTER_EXECUTE) == 3
+    assert events.count(generic.HOOK_BEFORE_COMPILE) == 3
+    assert events.count(generic.HOOK_AFTER_COMPILE) == 3
+
+    # Rows are fetched in batches of arraysize
+    del events[:]
+    res = bd.select('id, name').from_('numbers').order('id').asObject(arraysize=30)
+    assert len([r for r in res]) == 100
+    assert events[0:4] == [
+        generic.HOOK_BEFORE_COMPILE,
+        generic.HOOK_AFTER_COMPILE,
+        generic.HOOK_BEFORE_EXECUTE,
+        generic.HOOK_AFTER_EXECUTE]
+    assert events.count(generic.HOOK_FETCH_BATCH) == 5
+    assert res.trace.rows == 100
+    assert res.trace.bytes == 100 * 8 + 10 * 2 + 90 * 3
+
+    # Errors fire the error hooks, and are raised as usual
+    del events[:]
+    try:
+        bd.select('*').from_('missing').asObject()
+        assert False
+    except sqlite3.OperationalError:
+        pass
+    assert events[-1] == generic.HOOK_ERROR
+
+    snapshot = stats.snapshot()
+    query = 'SELECT id, name FROM numbers ORDER BY id'
+    assert snapshot[query]['count'] == 1
+    assert snapshot[query]['rows'] == 100
+    assert snapshot['SELECT * FROM missing']['errors'] == 1
+    assert snapshot[query]['minTime'] <= snapshot[query]['p95Time']
+    assert snapshot[query]['p95Time'] <= snapshot[query]['maxTime']
+
+    # Both INSERT batch sizes share a fingerprint
+    inserts = [v for k, v in snapshot.items() if k.startswith('INSERT')]
+    assert len(inserts) == 1
+    assert inserts[0]['count'] == 3
+    json.dumps(snapshot)
+
+    # Literals and placeholder lists are collapsed
+    assert generic.fingerprint(
+        "SELECT * FROM t WHERE id IN (%s, %s,%s) AND name = 'it''s'") ==\
+        'SELECT * FROM t WHERE id IN (...) AND name = ?'
+    assert generic.fingerprint(
+        'SELECT "a 1", t2.b FROM t2  WHERE x::text = :x LIMIT 10') ==\
+        'SELECT "a 1", t2.b FROM t2 WHERE x::text = ? LIMIT ?'
+    assert generic.fingerprint('UPDATE t SET a = $1 WHERE b > -2.5e3') ==\
+        'UPDATE t SET a = ? WHERE b > -?'
+
+    # Long queries are fingerprinted, but not cached
+    query = 'INSERT INTO t VALUES ' + ', '.join(['(1, 2)'] * 1000)
+    assert generic.fingerprint(query) == 'INSERT INTO t VALUES (...)'
+    assert generic.fingerprintCache.get(query) is None
+
+    # Queries are fingerprinted once per statement, not per batch
+    res = bd.select('id').from_('numbers').asObject(arraysize=10)
+    res.trace.query = None
+    assert len([r for r in res]) == 100
+    assert res.trace.fingerprint() == 'SELECT id FROM numbers'
+
+    # Queries past maxEntries fingerprints are totalled together
+    stats.reset()
+    stats.maxEntries = 2
+    for i in range(4):
+        bd.select('id AS c%d' % (i)).from_('numbers').asObject().close()
+    snapshot = stats.snapshot()
+    assert len(snapshot) == 3
+    assert snapshot[generic.OTHER_QUERIES]['count'] == 2
+
+    # Without hooks, nothing is traced
+    bd.setHooks(None)
+    res = bd.select('id').from_('numbers').asObject()
+    assert res.trace is None
+
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+import doze.backend.generic as generic
+import sqlite3
+
+CREATE_TEST_TABLE = (
+    "CREATE TABLE events ( "
+        "day INTEGER, "
+        "seq INTEGER, "
+        "kind CHAR(8) "
+    ");"
+)
+
+def main():
+    db = sqlite3.connect(':memory:')
+    db.cursor().execute(CREATE_TEST_TABLE)
+
+    bd = dz_sqlite.Builder(db)
+    bd.insertInto('events').values([{'day': i // 10, 'seq': i % 10,
+        'kind': ['click', 'view'][i % 2]} for i in range(95)]).execute()
+
+    queries = []
+    hooks = generic.QueryHooks()
+    hooks.add(lambda event, trace: queries.append(trace.query),
+        [generic.HOOK_BEFORE_EXECUTE])
+    bd.setHooks(hooks)
+
+    # Composite key, ascending. 95 rows in pages of 20 is 5 queries.
+    rows = [r for r in bd.select('day, seq').from_('events')\
+        .paginate(['day', 'seq'], 20, fetch=tuple)]
+    assert rows == [(i // 10, i % 10) for i in range(95)]
+    assert len(queries) == 5
+    assert queries[1] == ('SELECT day, seq FROM events WHERE ((day > ?)'
+        ' OR (day = ? AND seq > ?)) ORDER BY day, seq LIMIT 20')
+
+    # Existing conditions are kept, and grouped
+    rows = [r['seq'] for r in bd.select('day, seq').from_('events')\
+        .where(dz_sqlite.Where('kind').equals('click').or_('seq').equals(9))\
+        .paginate(['day', 'seq'], 7, descending=True)]
+    expected = [i % 10 for i in reversed(range(95))
+        if i % 2 == 0 or i % 10 == 9]
+    assert rows == expected
+
+    # Pages end exactly on the last row
+    del queries[:]
+    rows = [r for r in bd.select('*').from_('events')\
+        .where(dz_sqlite.Where('day').lt(4)).paginate(['day', 'seq'], 10)]
+    assert len(rows) == 40
+    assert len(queries) == 5
+
+    # LIMIT caps the rows yielded, across pages
+    del queries[:]
+    rows = [r for r in bd.select('day, seq').from_('events').limit(25)\
+        .paginate(['day', 'seq'], 10, fetch=tuple)]
+    assert rows == [(i // 10, i % 10) for i in range(25)]
+    assert len(queries) == 3
+    assert len([r for r in bd.select('day').from_('events').limit(3)\
+        .paginate('day', 10)]) == 3
+
+    try:
+        [r for r in bd.select('day').from_('events').limit('3 OFFSET 2')\
+            .paginate('day')]
+        assert False
+    except doze.DozeError:
+        pass
+
+    # Key columns have to be selected, and are checked on the first row,
+    # even when it's the only page
+    try:
+        [r for r in bd.select('kind').from_('events').paginate('day', 10)]
+        assert False
+    except doze.DozeError:
+        pass
+
+    rows = []
+    try:
+        for r in bd.select('kind').from_('events').paginate('day', 1000):
+            rows.append(r)
+        assert False
+    except doze.DozeError:
+        pass
+    assert rows == []
+
+    # Groups nest, and can be used directly
+    group = dz_sqlite.WhereGroup([
+        dz_sqlite.Where('day').equals(1),
+        dz_sqlite.WhereGroup([dz_sqlite.Where('day').equals(2),
+            dz_sqlite.Where('seq').lt(3)])], 'or_')
+    assert group.sql() == ('((day = ?) OR ((day = ?) AND (seq < ?)))', [1, 2, 3])
+
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
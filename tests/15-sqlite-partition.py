@@ -0,0 +1,123 @@
+import os, sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+import doze.backend.generic as generic
+import sqlite3
+import tempfile
+import collections
+
+CREATE_TEST_TABLE = (
+    "CREATE TABLE numbers ( "
+        "id INTEGER, "
+        "name CHAR(8) "
+    ");"
+)
+
+def main():
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+
+    connect = lambda: sqlite3.connect(path, check_same_thread=False)
+    pool = doze.ConnectionPool(connect, minsize=1, maxsize=4)
+
+    with pool.connection() as db:
+        db.cursor().execute(CREATE_TEST_TABLE)
+
+    bd = dz_sqlite.Builder(pool)
+    bd.insertInto('numbers').values([{'id': i, 'name': 'n%d' % (i)}
+        for i in range(1000)] + [{'id': None, 'name': 'null'}]).execute()
+
+    queries = []
+    hooks = generic.QueryHooks()
+    hooks.add(lambda event, trace: queries.append(trace.query),
+        [generic.HOOK_BEFORE_EXECUTE])
+    bd.setHooks(hooks)
+
+    # Unordered, every row once, NULL keys included
+    res = bd.select('id, name').from_('numbers')\
+        .asPartitioned('id', partitions=4, arraysize=50)
+    rows = [r for r in res]
+    assert len(rows) == 1001
+    assert sorted([r['id'] for r in rows if r['id'] is not None]) == range(1000)
+    assert res.labels == ['id', 'name']
+    assert len(pool.idleConnections) == pool.size
+
+    # MIN / MAX, 4 ranges and NULLs
+    assert len(queries) == 6
+    assert queries[0] == 'SELECT MIN(id), MAX(id) FROM numbers'
+    assert sorted(queries[1:]) == sorted(
+        ['SELECT id, name FROM numbers WHERE id >= ? AND id < ?'] * 3 + [
+        'SELECT id, name FROM numbers WHERE id >= ? AND id <= ?',
+        'SELECT id, name FROM numbers WHERE id IS NULL'])
+
+    # Ordered, with existing conditions grouped
+    res = bd.select('id').from_('numbers')\
+        .where(dz_sqlite.Where('id').lt(100).or_('id').gte(900))\
+        .asPartitioned('id', partitions=3, workers=2, ordered=True,
+            fetch=collections.namedtuple, arraysize=10)
+    assert [r.id for r in res] == range(100) + range(900, 1000)
+
+    # Small ranges give fewer partitions
+    assert generic.splitRange(1, 3, 8) == [1, 2, 3]
+    assert generic.splitRange(5, 5, 4) == [5, 5]
+    assert generic.splitRange(0.0, 1.0, 4) == [0.0, 0.25, 0.5, 0.75, 1.0]
+
+    # Closing early stops the workers, and checks connections back in
+    res = bd.select('*').from_('numbers')\
+        .asPartitioned('id', arraysize=10)
+    assert res.next() is not None
+    res.close()
+    assert len(pool.idleConnections) == pool.size
+
+    # Workers default to the connections left, so holding one doesn't
+    # leave a partition waiting on the pool
+    pool.timeout = 1
+    held = [pool.get() for i in range(3)]
+    res = bd.select('id').from_('numbers')\
+        .asPartitioned('id', partitions=4, ordered=True, arraysize=10)
+    assert len([r for r in res]) == 1001
+    for db in held:
+        pool.put(db)
+    pool.timeout = None
+
+    # Bounds aren't served from a cache set for all builders
+    dz_sqlite.Builder.resultCache = generic.ResultCache()
+    try:
+        assert len([r for r in bd.select('id').from_('numbers')\
+            .asPartitioned('id')]) == 1001
+        with pool.connection() as db:
+            db.cursor().execute("INSERT INTO numbers VALUES (1000, 'n')")
+        assert len([r for r in bd.select('id').from_('numbers')\
+            .asPartitioned('id')]) == 1002
+    finally:
+        dz_sqlite.Builder.resultCache = None
+
+    # Errors in workers are raised by the consumer
+    res = bd.select('missing').from_('numbers').asPartitioned('id')
+    try:
+        [r for r in res]
+        assert False
+    except sqlite3.OperationalError:
+        pass
+
+    try:
+        bd.select('id').from_('numbers').limit(10).asPartitioned('id')
+        assert False
+    except doze.DozeError:
+        pass
+
+    try:
+        dz_sqlite.Builder(connect()).select('id').from_('numbers')\
+            .asPartitioned('id')
+        assert False
+    except doze.DozeError:
+        pass
+
+    pool.close()
+    os.remove(path)
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
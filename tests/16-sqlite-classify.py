@@ -0,0 +1,53 @@
+import os, sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+
+class Uncached(dz_sqlite.Builder):
+    classificationCacheSize = 0
+
+def main():
+    bd = dz_sqlite.Builder(None)
+    where = dz_sqlite.Where('id')
+
+    # Records are cached, and shared by clauses of the same dialect
+    record = bd.classifyField('u.name')
+    assert bd.classifyField('u.name') is record
+    assert where.classifyField('u.name') is record
+    assert bd.classificationCache() is where.classificationCache()
+
+    # Predicates fill in the cached record once
+    assert bd.fieldIsAliased('u.name')
+    assert record.aliased is True
+    assert record.tokens is not None
+    assert bd.quoteField('u.name') == '`u.name`'
+    assert record.quoted == '`u.name`'
+
+    # Overriding a dialect attribute on an instance isolates its cache
+    quoted = dz_sqlite.Builder(None)
+    quoted.fieldQuote = '"'
+    assert quoted.classificationCache() is not bd.classificationCache()
+    assert quoted.classifyField('u.name') is not record
+    assert quoted.quoteField('u.name') == '"u.name"'
+    assert bd.quoteField('u.name') == '`u.name`'
+
+    # With the cache disabled, the most recent field still shares its record
+    # between predicates
+    uncached = Uncached(None)
+    assert uncached.classificationCache() is not bd.classificationCache()
+    record = uncached.classifyField('u.name')
+    assert uncached.classifyField('u.name') is record
+    assert uncached.fieldIsAliased('u.name')
+    assert record.aliased is True and record.tokens is not None
+    uncached.classifyField('u.id')
+    assert len(uncached.classificationCache()) == 1
+    assert uncached.classifyField('u.name') is not record
+
+    # Fields which aren't strings aren't cached
+    assert bd.classifyField(None) is not bd.classifyField(None)
+
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
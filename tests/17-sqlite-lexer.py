@@ -0,0 +1,138 @@
+import os, sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.sqlite as dz_sqlite
+from doze.backend.generic.base import *
+
+FIELDS = [
+    'name',
+    'u.name',
+    'u.name AS n',
+    'u.name n',
+    'name.',
+    '`u.name`',
+    '`u`.`name`',
+    '`my table`.`my field`',
+    '`it``s`.name',
+    "'a.b'",
+    "'it''s'.x",
+    "'it\\'s'",
+    '"u.name"',
+    '`unterminated.name',
+    "`mixed 'quotes`.name",
+    'COUNT(*)',
+    'COUNT(u.id) AS total',
+    'COALESCE(u.name, \'a.b\')',
+    'LOWER(TRIM(`u`.`name`))',
+    'SUM(a) + SUM(b)',
+    'f(\'(\')',
+    'f(a',
+    'a)',
+    'id = 1',
+    'a.id >= b.id',
+    "name = 'x = y'",
+    'CASE WHEN a THEN b END',
+    '',
+]
+
+def old_characters(string, quotes):
+    """ Per-character (quoted, depth), as seen by IterableField """
+    chars = []
+    it = IterableField(string, quotes, parenthesis=True)
+    for i in it.iterate():
+        chars.append((i['inside_quote'], i['parenthesis_depth']))
+    return chars
+
+def new_characters(tokens):
+    """ Per-character (quoted, depth), expanded from FieldLexer tokens """
+    chars = []
+    for kind, start, end, depth in tokens:
+        chars.extend([(kind == TOKEN_QUOTED, depth)] * (end - start))
+    return chars
+
+def old_is_aliased(field, quotes, separator):
+    if separator not in field:
+        return False
+    for i in IterableField(field, quotes).iterate():
+        if (not i['inside_quote'] and i['string'] == separator
+            and i['last'] == False):
+            return True
+    return False
+
+def old_is_function(param, quotes):
+    if '(' not in param or ')' not in param:
+        return False
+    hasParen = False
+    for i in IterableField(param, quotes, parenthesis=True).iterate():
+        if i['parenthesis_depth'] > 0:
+            hasParen = True
+    return hasParen and i['parenthesis_closed']
+
+def old_is_expression(param, quotes):
+    if param[0:4].lower() == 'case':
+        return True
+    for i in IterableField(param, quotes).iterate():
+        if not i['inside_quote'] and i['string'] in '=<>':
+            return True
+    return False
+
+def main():
+    bd = dz_sqlite.Builder(None)
+    quotes = bd.searchQuotes
+    lexer = FieldLexer.get(quotes, '.,')
+    assert FieldLexer.get(quotes, '.,') is lexer
+
+    for field in FIELDS:
+        tokens = lexer.tokenize(field)
+
+        # Tokens are contiguous, and cover the whole string
+        offset = 0
+        for kind, start, end, depth in tokens:
+            assert start == offset and end > start, field
+            offset = end
+        assert offset == len(field), field
+
+        # Quoting and parenthesis depth match IterableField character by
+        # character, including escaped and unterminated quotes
+        assert new_characters(tokens) == old_characters(field, quotes), field
+
+        # Separators are single characters outside of quotes
+        for kind, start, end, depth in tokens:
+            if kind == TOKEN_SEPARATOR:
+                assert end - start == 1 and field[start] in '.,', field
+
+        # Predicates agree with the IterableField implementations
+        assert bd.fieldIsAliased(field) == \
+            old_is_aliased(field, quotes, bd.fieldSeparator), field
+        if field:
+            assert bd.isSqlFunction(field) == \
+                old_is_function(field, quotes), field
+            assert bd.isSqlExpression(field) == \
+                old_is_expression(field, quotes), field
+
+    # Quoted identifiers are one token, quotes included
+    tokens = lexer.tokenize('`u.name`')
+    assert tokens == ((TOKEN_QUOTED, 0, 8, 0),)
+
+    # Escaped quotes are adjacent quoted tokens, with nothing in between
+    tokens = lexer.tokenize('`it``s`.name')
+    assert [t[0] for t in tokens] == [TOKEN_QUOTED, TOKEN_QUOTED,
+        TOKEN_SEPARATOR, TOKEN_TEXT]
+
+    # Dotted and aliased fields
+    tokens = lexer.tokenize('u.name AS n')
+    assert [t[0] for t in tokens] == [TOKEN_TEXT, TOKEN_SEPARATOR, TOKEN_TEXT]
+    assert bd.fieldIsAliased('u.name AS n')
+    assert not bd.fieldIsAliased('`u.name`')
+    assert not bd.fieldIsAliased('name.')
+
+    # Parenthesis count as inside, at both ends
+    tokens = lexer.tokenize('f(a)')
+    assert tokens == ((TOKEN_TEXT, 0, 1, 0), (TOKEN_OPEN, 1, 2, 1),
+        (TOKEN_TEXT, 2, 3, 1), (TOKEN_CLOSE, 3, 4, 1))
+
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
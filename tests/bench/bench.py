@@ -0,0 +1,184 @@
+"""
+*
+* Benchmark harness. Benchmarks are registered with @benchmark, timed as the
+* best of several repeats, and reported as JSON, so results can be saved
+* and compared between revisions. Only sqlite3 and FakeConnection are used,
+* so results are reproducible without a database server.
+*
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Registered benchmarks, as (name, func, loops), in order of registration
+benchmarks = []
+
+def benchmark(name, loops = 1000):
+    """
+    Decorator, which registers func as a benchmark. func() is called once
+    to set up, and returns the callable which is timed.
+    """
+    def register(func):
+        benchmarks.append((name, func, loops))
+        return func
+    return register
+
+class FakeCursor(object):
+    """
+    Pure-Python DB-API cursor, returning rows generated up front, so result
+    handling is timed without any driver overhead.
+    """
+
+    def __init__(self, labels, rows):
+        self.description = tuple([(i, None, None, None, None, None, None)
+            for i in labels])
+        self.rows = rows
+        self.rowcount = -1
+        self.rownumber = 0
+        self.arraysize = 1
+        self.closed = False
+
+    def execute(self, query, escape = ()):
+        self.rownumber = 0
+        self.rowcount = len(self.rows)
+
+    def executemany(self, query, escapes):
+        self.rowcount = len(list(escapes))
+
+    def fetchone(self):
+        if self.rownumber >= len(self.rows):
+            return None
+        self.rownumber += 1
+        return self.rows[self.rownumber - 1]
+
+    def fetchmany(self, size = None):
+        if size is None:
+            size = self.arraysize
+        start = self.rownumber
+        self.rownumber = min(start + size, len(self.rows))
+        return self.rows[start:self.rownumber]
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows) - self.rownumber)
+
+    def close(self):
+        self.closed = True
+
+class FakeConnection(object):
+    """ Connection handing out FakeCursors over the same rows """
+
+    def __init__(self, labels, rows):
+        self.labels = labels
+        self.rows = rows
+
+    def cursor(self, *args):
+        return FakeCursor(self.labels, self.rows)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+def fake_rows(count, columns = 4):
+    """ Returns (labels, rows), with count rows of mixed types """
+    labels = ['c%d' % (i) for i in range(columns)]
+    rows = []
+    for i in range(count):
+        row = []
+        for j in range(columns):
+            if j % 2 == 0:
+                row.append(i * columns + j)
+            else:
+                row.append('value %d' % (i))
+        rows.append(tuple(row))
+    return (labels, rows)
+
+def run(func, loops, repeat):
+    """ Returns list of seconds per loop, for each repeat """
+    times = []
+    for i in range(repeat):
+        start = timer()
+        for j in xrange(loops):
+            func()
+        times.append((timer() - start) / loops)
+    return times
+
+def compare(results, baseline, threshold):
+    """
+    Returns list of (name, baseline, current, ratio) for benchmarks which
+    are slower than baseline by more than threshold (0.1 = 10%).
+    """
+    slower = []
+    for name, res in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None or base['best'] <= 0:
+            continue
+
+        ratio = res['best'] / base['best']
+        if ratio > 1.0 + threshold:
+            slower.append((name, base['best'], res['best'], ratio))
+    return sorted(slower)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Run Doze benchmarks')
+    parser.add_argument('-k', '--filter', default=None,
+        help='only run benchmarks whose name contains FILTER')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+        help='repeats per benchmark, the best is reported (default: 5)')
+    parser.add_argument('-s', '--scale', type=float, default=1.0,
+        help='multiply loops per repeat by SCALE (default: 1.0)')
+    parser.add_argument('-o', '--output', default=None,
+        help='write JSON results to OUTPUT, instead of stdout')
+    parser.add_argument('-c', '--compare', default=None,
+        help='compare with JSON results in COMPARE, exit 1 on regressions')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+        help='allowed slowdown for --compare (default: 0.1, for 10%%)')
+    args = parser.parse_args(argv)
+
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'benchmarks': {}}
+
+    for name, setup, loops in benchmarks:
+        if args.filter is not None and args.filter not in name:
+            continue
+
+        loops = max(int(loops * args.scale), 1)
+        times = run(setup(), loops, args.repeat)
+        results['benchmarks'][name] = {
+            'loops': loops,
+            'best': min(times),
+            'mean': sum(times) / len(times)}
+        sys.stderr.write('%-40s %12.3f us\n' % (name, min(times) * 1e6))
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output is None:
+        print output
+    else:
+        fileobj = open(args.output, 'w')
+        try:
+            fileobj.write(output + '\n')
+        finally:
+            fileobj.close()
+
+    if args.compare is not None:
+        baseline = json.load(open(args.compare))
+        slower = compare(results, baseline, args.threshold)
+        for name, base, current, ratio in slower:
+            sys.stderr.write('SLOWER %s: %.3f us -> %.3f us (%.2fx)\n'
+                % (name, base * 1e6, current * 1e6, ratio))
+        if len(slower) > 0:
+            return 1
+    return 0
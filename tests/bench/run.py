@@ -0,0 +1,160 @@
+"""
+*
+* Micro-benchmarks for the SQL builder and the result pipeline. Run from
+* this directory:
+*
+*   python run.py -o results.json
+*   python run.py -c results.json       # Exits 1 on regressions
+*   python run.py -k where -r 10        # Only benchmarks matching "where"
+*
+"""
+
+import sys
+sys.path.append('../../doze')
+
+import sqlite3
+import collections
+import doze
+import doze.backend.generic as generic
+import doze.backend.sqlite as dz_sqlite
+from doze.backend.generic.relations.base import ObjectList
+from bench import *
+
+@benchmark('iterable_field.iterate', loops=2000)
+def bench_iterable_field():
+    field = 'a.id, "quoted, name", COUNT(b.id), \'it\'\'s\', (1 + 2) AS x'
+    def func():
+        for i in generic.IterableField(field, parenthesis=True).iterate():
+            pass
+    return func
+
+@benchmark('builder.normalize_columns', loops=5000)
+def bench_normalize_columns():
+    bd = dz_sqlite.Builder().select('*').from_('users u')
+    columns = 'id, name, email, COUNT(*), "quoted col", g.name, \'value\''
+    return lambda: bd.normalizeColumns(columns)
+
+@benchmark('where.sql.in_1000', loops=200)
+def bench_where_in():
+    values = range(1000)
+    return lambda: dz_sqlite.Where('id').isIn(values)\
+        .and_('active').equals(True).sql()
+
+@benchmark('where.sql.chain_50', loops=200)
+def bench_where_chain():
+    def func():
+        where = dz_sqlite.Where('c0').equals(0)
+        for i in range(1, 50):
+            where.and_('c%d' % (i)).equals(i)
+        return where.sql()
+    return func
+
+@benchmark('builder.sql.join_chain_10', loops=200)
+def bench_join_chain():
+    def func():
+        bd = dz_sqlite.Builder().select('id, name').from_('t0 a')
+        for i in range(1, 10):
+            bd.join(dz_sqlite.Join(['t%d' % (i), 'abcdefghij'[i]])\
+                .where(dz_sqlite.Where('ref%d' % (i)).equals('id', kind=doze.FIELD)))
+        return bd.sql()
+    return func
+
+@benchmark('builder.sql.cte', loops=500)
+def bench_cte():
+    def func():
+        union = dz_sqlite.Builder().select('id, domain').from_('sites')\
+            .union(dz_sqlite.Builder().select('site, domain').from_('aliases'))
+        return dz_sqlite.Builder().with_('a').as_(union)\
+            .select('*').from_('a').where(dz_sqlite.Where('id').equals(1)).sql()
+    return func
+
+@benchmark('builder.sql.insert_batch_1000', loops=20)
+def bench_insert_batch():
+    rows = [{'id': i, 'name': 'n%d' % (i), 'value': i * 0.5} for i in range(1000)]
+    bd = dz_sqlite.Builder()
+    def func():
+        for i in bd.insertInto('numbers').values(rows).insertBatches():
+            pass
+    return func
+
+@benchmark('fingerprint.uncached', loops=500)
+def bench_fingerprint():
+    query = dz_sqlite.Where('id').isIn(range(100)).and_('name').equals('x').sql()[0]
+    def func():
+        generic.fingerprintCache.clear()
+        return generic.fingerprint(query)
+    return func
+
+def fake_result(fetch, count = 1000, arraysize = None):
+    labels, rows = fake_rows(count)
+    bd = generic.Builder(FakeConnection(labels, rows))
+    def func():
+        res = bd.select('*').from_('fake').asObject(fetch=fetch, arraysize=arraysize)
+        for row in res:
+            pass
+    return func
+
+@benchmark('query_result.fake.dict_1000', loops=50)
+def bench_result_dict():
+    return fake_result(dict)
+
+@benchmark('query_result.fake.tuple_1000', loops=50)
+def bench_result_tuple():
+    return fake_result(tuple)
+
+@benchmark('query_result.fake.namedtuple_1000', loops=50)
+def bench_result_namedtuple():
+    return fake_result(collections.namedtuple)
+
+@benchmark('query_result.fake.record_1000', loops=50)
+def bench_result_record():
+    return fake_result(generic.Record)
+
+@benchmark('query_result.fake.tuple_1000_arraysize', loops=50)
+def bench_result_arraysize():
+    return fake_result(tuple, arraysize=500)
+
+@benchmark('query_result.fake.columns_1000', loops=50)
+def bench_result_columns():
+    labels, rows = fake_rows(1000)
+    bd = generic.Builder(FakeConnection(labels, rows))
+    return lambda: bd.select('*').from_('fake').asColumns(arraysize=500)
+
+def sqlite_result(fetch):
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE numbers (id INTEGER, name CHAR(8), value REAL)')
+    bd = dz_sqlite.Builder(db)
+    bd.insertInto('numbers').values([{'id': i, 'name': 'n%d' % (i),
+        'value': i * 0.5} for i in range(1000)]).execute()
+
+    def func():
+        res = bd.select('id, name, value').from_('numbers').asObject(
+            fetch=fetch, arraysize=500)
+        for row in res:
+            pass
+    return func
+
+@benchmark('query_result.sqlite.dict_1000', loops=20)
+def bench_sqlite_dict():
+    return sqlite_result(dict)
+
+@benchmark('query_result.sqlite.tuple_1000', loops=20)
+def bench_sqlite_tuple():
+    return sqlite_result(tuple)
+
+@benchmark('object_list.lookup_10000', loops=50)
+def bench_object_list():
+    names = ['table_%d' % (i) for i in range(10000)]
+    objects = ObjectList((name, i) for i, name in enumerate(names))
+    def func():
+        for name in names:
+            getattr(objects, name)
+    return func
+
+@benchmark('object_list.build_10000', loops=20)
+def bench_object_list_build():
+    items = [('table_%d' % (i), i) for i in range(10000)]
+    return lambda: ObjectList(items)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""
+*
+* Test showing bulk loading and exporting with COPY on PostgreSQL.
+*
+"""
+
+import sys
+sys.path.append('../doze')
+
+import psycopg2
+import doze
+import doze.backend.pgsql as pgsql
+
+def connect():
+    return psycopg2.connect(
+        host='127.0.0.1',
+        user='testuser',
+        database='testdb',
+        port='5432',
+        password='8cp1FEqp')
+
+def rows(count):
+    for i in range(0, count):
+        yield {'name': 'Language %d' % (i), 'lang': 'l%d' % (i % 100)}
+
+def main():
+    db = connect()
+    builder = pgsql.Builder(db)
+
+    # Rows are streamed from the generator, one buffer at a time
+    copied = builder.copyFrom('languages', rows(100000))
+    print 'Copied %d rows into languages' % (copied)
+
+    # Export as CSV
+    builder.select('name, lang').from_('languages').where(
+        pgsql.Where('lang').equals('l1'))
+
+    copied = builder.copyTo(sys.stdout, format=pgsql.COPY_CSV, header=True)
+    print 'Exported %d rows from languages' % (copied)
+
+    # Binary values are written as bytea hex, in both formats
+    db.cursor().execute('CREATE TEMPORARY TABLE blobs (data bytea)')
+    data = '\t\n\\\x00\xff'
+    for format in (pgsql.COPY_TEXT, pgsql.COPY_CSV):
+        builder.copyFrom('blobs', [(buffer(data),), (bytearray(data),)],
+            format=format)
+    res = builder.select('data').from_('blobs').asObject(fetch=tuple)
+    assert [str(r[0]) for r in res] == [data] * 4
+
+    builder.rollback()
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+*
+* Test showing multiple asynchronous connections with PostgreSQL, driven by
+* an asyncio event loop instead of polling isReady().
+*
+"""
+
+import sys
+sys.path.append('../doze')
+
+import doze
+import doze.backend.pgsql as pgsql
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+def connect():
+    return pgsql.connect_async(
+        host='127.0.0.1',
+        user='testuser',
+        database='testdb',
+        port='5432',
+        password='8cp1FEqp')
+
+def main():
+    loop = asyncio.get_event_loop()
+
+    # Open 10 connections, and wait for all of them
+    connections = loop.run_until_complete(
+        asyncio.gather(*[connect() for i in range(0, 10)]))
+
+    # Run one query per connection, concurrently
+    futures = []
+    for db in connections:
+        builder = pgsql.AsyncBuilder(db).select('*').from_('metatags')
+        futures.append(builder.fetch())
+
+    for result in loop.run_until_complete(asyncio.gather(*futures)):
+        print result.next()
+
+    for i in connections:
+        if pgsql.connection_is_open(i):
+            i.close()
+
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
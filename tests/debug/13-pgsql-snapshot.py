@@ -0,0 +1,44 @@
+"""
+*
+* Test showing schema inspection on PostgreSQL, comparing lazy loading per
+* table against a catalog snapshot.
+*
+"""
+
+import sys
+sys.path.append('../doze')
+
+import time
+import psycopg2
+import doze.backend.pgsql.relations as pgsql_relations
+
+def connect():
+    return psycopg2.connect(
+        host='127.0.0.1',
+        user='testuser',
+        database='testdb',
+        port='5432',
+        password='8cp1FEqp')
+
+def walk(dbdef):
+    count = 0
+    for name, tbl in dbdef.tables:
+        for kind in (tbl.columns, tbl.indexes, tbl.constraints, tbl.triggers):
+            count += len(list(kind))
+    return count
+
+def main():
+    db = connect()
+
+    for snapshot in (False, True):
+        start = time.time()
+        dbdef = pgsql_relations.Database.get(db, snapshot=snapshot)
+        count = walk(dbdef)
+        print 'snapshot=%s: %d objects in %.3fs' % (
+            snapshot, count, time.time() - start)
+
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+*
+* Test showing the on-disk schema cache on PostgreSQL. The first run walks
+* the catalog and writes the cache, later runs only check its fingerprint.
+*
+"""
+
+import sys
+sys.path.append('../doze')
+
+import time
+import psycopg2
+import doze.backend.pgsql.relations as pgsql_relations
+
+def connect():
+    return psycopg2.connect(
+        host='127.0.0.1',
+        user='testuser',
+        database='testdb',
+        port='5432',
+        password='8cp1FEqp')
+
+def main():
+    db = connect()
+
+    for i in range(0, 2):
+        start = time.time()
+        dbdef = pgsql_relations.Database.get_cached(db, '/tmp/doze-testdb.schema')
+        print '%d tables in %.3fs' % (len(dbdef.tables), time.time() - start)
+
+    for name, obj in dbdef.tables:
+        print obj
+
+    # Temporary tables, and schemas outside of the search path, don't
+    # change the fingerprint, while tables in it do
+    fingerprint = pgsql_relations.catalog_fingerprint(db, ['public'])
+    cursor = db.cursor()
+    cursor.execute('CREATE TEMPORARY TABLE doze_temp (id int)')
+    cursor.execute('CREATE SCHEMA doze_other')
+    cursor.execute('CREATE TABLE doze_other.t (id int)')
+    assert pgsql_relations.catalog_fingerprint(db, ['public']) == fingerprint
+    cursor.execute('CREATE TABLE public.doze_fp (id int)')
+    assert pgsql_relations.catalog_fingerprint(db, ['public']) != fingerprint
+
+    # So do replaced views, and altered sequences
+    cursor.execute('CREATE VIEW doze_fp_view AS SELECT 1 AS a')
+    cursor.execute('CREATE SEQUENCE doze_fp_seq')
+    fingerprint = pgsql_relations.catalog_fingerprint(db, ['public'])
+    cursor.execute('CREATE OR REPLACE VIEW doze_fp_view AS SELECT 2 AS a')
+    assert pgsql_relations.catalog_fingerprint(db, ['public']) != fingerprint
+    if db.server_version >= 100000:
+        fingerprint = pgsql_relations.catalog_fingerprint(db, ['public'])
+        cursor.execute('ALTER SEQUENCE doze_fp_seq INCREMENT BY 5')
+        assert pgsql_relations.catalog_fingerprint(db, ['public'])\
+            != fingerprint
+    db.rollback()
+
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+*
+* Test showing parallel schema introspection on PostgreSQL, spreading the
+* catalog queries of each table across pooled connections.
+*
+"""
+
+import sys
+sys.path.append('../doze')
+
+import time
+import doze.backend.pgsql as pgsql
+import doze.backend.pgsql.relations as pgsql_relations
+
+PARAMS = {
+    'host': '127.0.0.1',
+    'user': 'testuser',
+    'database': 'testdb',
+    'port': '5432',
+    'password': '8cp1FEqp'}
+
+def main():
+    db = pgsql.connect(**PARAMS)
+    pool = pgsql.pool(minsize=0, maxsize=4, **PARAMS)
+
+    start = time.time()
+    dbdef = pgsql_relations.Database.get(db)
+    dbdef.load_parallel(pool, workers=4)
+    print '%d tables in %.3fs' % (len(dbdef.tables), time.time() - start)
+
+    for name, obj in dbdef.tables:
+        print obj
+
+    pool.close()
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+*
+* Test showing the schema diff engine on PostgreSQL. A snapshot is taken,
+* a table is changed, and the DDL needed to go from the first snapshot to
+* the second is printed.
+*
+"""
+
+import sys
+sys.path.append('../doze')
+
+import psycopg2
+import doze.backend.pgsql.relations as pgsql_relations
+
+def connect():
+    return psycopg2.connect(
+        host='127.0.0.1',
+        user='testuser',
+        database='testdb',
+        port='5432',
+        password='8cp1FEqp')
+
+def main():
+    db = connect()
+    cursor = db.cursor()
+
+    old_without = pgsql_relations.Database.get(db, snapshot=True)
+    for i in ['schemas', 'tables', 'sequences', 'views']:
+        getattr(old_without, i)
+    cursor.execute('CREATE TABLE doze_diff (id serial PRIMARY KEY, a int, '
+        'c text UNIQUE)')
+
+    old = pgsql_relations.Database.get(db, snapshot=True)
+    old.tables
+
+    cursor.execute('ALTER TABLE doze_diff ADD COLUMN b text NOT NULL')
+    cursor.execute('ALTER TABLE doze_diff ALTER COLUMN a SET DEFAULT 1')
+    cursor.execute('CREATE INDEX doze_diff_b ON doze_diff (b)')
+    cursor.execute('ALTER TABLE doze_diff DROP CONSTRAINT doze_diff_c_key')
+
+    new = pgsql_relations.Database.get(db, snapshot=True)
+    for statement in pgsql_relations.diff_databases(old, new):
+        print statement + ';'
+
+    # Going back re-adds the unique constraint as a constraint, not as a
+    # unique index
+    statements = list(pgsql_relations.diff_databases(new, old))
+    assert 'ALTER TABLE "public"."doze_diff" ADD CONSTRAINT '\
+        '"doze_diff_c_key" UNIQUE ("c")' in statements
+
+    # Indexes backing constraints are dropped through the constraint, and
+    # type changes cast with USING, as text doesn't convert to integer
+    cursor.execute('ALTER TABLE doze_diff ALTER COLUMN c TYPE int '
+        'USING c::int')
+    cursor.execute('ALTER TABLE doze_diff ADD CONSTRAINT doze_diff_a_key '
+        'UNIQUE (a)')
+    newer = pgsql_relations.Database.get(db, snapshot=True)
+    for statement in pgsql_relations.diff_databases(newer, new):
+        print statement + ';'
+        cursor.execute(statement)
+
+    # Dropping a table drops its serial sequence too, which the script
+    # mustn't trip over
+    for statement in pgsql_relations.diff_databases(new, old_without):
+        cursor.execute(statement)
+
+    db.rollback()
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
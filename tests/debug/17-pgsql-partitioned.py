@@ -0,0 +1,63 @@
+"""
+*
+* Test showing that partitioned tables (PostgreSQL 11+) are loaded with
+* their columns, and included in Database.ddl() along with their
+* partitions and indexes.
+*
+"""
+
+import sys
+sys.path.append('../doze')
+
+import psycopg2
+import doze.backend.pgsql.relations as pgsql_relations
+
+def connect():
+    return psycopg2.connect(
+        host='127.0.0.1',
+        user='testuser',
+        database='testdb',
+        port='5432',
+        password='8cp1FEqp')
+
+def main():
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute('CREATE TABLE doze_parted (id int NOT NULL, day date)'
+        ' PARTITION BY RANGE (day)')
+    cursor.execute("CREATE TABLE doze_parted_2020 PARTITION OF doze_parted"
+        " FOR VALUES FROM ('2020-01-01') TO ('2021-01-01')")
+    cursor.execute('CREATE INDEX doze_parted_day ON doze_parted (day)')
+
+    dbdef = pgsql_relations.Database.get(db)
+    table = getattr(dbdef.tables, 'doze_parted')
+    print [name for name, column in table.columns]
+    assert len(table.columns) == 2
+
+    creates = [i for i in dbdef.ddl() if i.startswith('CREATE TABLE')
+        and 'doze_parted' in i.split('(')[0]]
+    print '\n'.join(creates)
+    assert len(creates) == 2
+    assert creates[0].endswith('PARTITION BY RANGE (day)')
+    assert 'PARTITION OF "public"."doze_parted" FOR VALUES' in creates[1]
+
+    # The index on the parent is dumped, not the ones it created on the
+    # partitions
+    statements = list(dbdef.ddl())
+    assert len([i for i in statements if 'doze_parted_day' in i]) == 1
+    assert len([i for i in statements if i.startswith('CREATE INDEX')
+        and 'doze_parted_2020' in i]) == 0
+
+    # The dump can be replayed
+    cursor.execute('CREATE SCHEMA doze_replay')
+    cursor.execute('SET search_path TO doze_replay')
+    for i in statements:
+        if 'doze_parted' in i:
+            cursor.execute(i.replace('"public".', '"doze_replay".'))
+
+    db.rollback()
+    db.close()
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+*
+* Test showing schema DDL dumps on PostgreSQL, with Database.dump(), and
+* with the doze-pgdump command line entry point.
+*
+"""
+
+import os
+import sys
+sys.path.append('../doze')
+
+import tempfile
+import StringIO
+import psycopg2
+import doze.backend.pgsql.relations as pgsql_relations
+from doze.backend.pgsql.relations import dump
+
+def connect():
+    return psycopg2.connect(
+        host='127.0.0.1',
+        user='testuser',
+        database='testdb',
+        port='5432',
+        password='8cp1FEqp')
+
+def main():
+    db = connect()
+    cursor = db.cursor()
+    cursor.execute('CREATE TABLE doze_dump (id serial PRIMARY KEY,'
+        ' name text NOT NULL CHECK (name <> \'\'))')
+    cursor.execute('CREATE INDEX doze_dump_name ON doze_dump (name)')
+    db.commit()
+
+    try:
+        # Database.dump()
+        out = StringIO.StringIO()
+        count = pgsql_relations.Database.get(db).dump(out)
+        print '%d statements' % (count)
+        assert count > 0
+        assert 'doze_dump_name' in out.getvalue()
+
+        # System schemas are left out when dumping all schemas
+        statements = list(pgsql_relations.Database.get(db, None).ddl())
+        assert len([i for i in statements if 'pg_catalog.' in i
+            and i.startswith('CREATE TABLE')]) == 0
+
+        # doze-pgdump
+        fd, path = tempfile.mkstemp(suffix='.sql')
+        os.close(fd)
+        os.environ['PGPASSWORD'] = '8cp1FEqp'
+        assert dump.main(['-H', '127.0.0.1', '-U', 'testuser',
+            '-d', 'testdb', '-o', path]) == 0
+        sql = open(path).read()
+        os.unlink(path)
+        print sql
+        assert 'doze_dump' in sql
+    finally:
+        db.rollback()
+        cursor.execute('DROP TABLE doze_dump')
+        db.commit()
+        db.close()
+
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()